@@ -0,0 +1,109 @@
+"""
+Writing of files in background threads, so that the main thread can carry on extracting data while files are
+serialised, compressed and written (most of which waits on the file system, which releases the GIL).
+
+The number of queued writes is limited: submitting a write blocks while the queue is full, so memory use stays
+bounded when data is extracted faster than it can be written. If a write fails, the queued writes are cancelled and
+its error is raised by the next call to `submit` or by `close`, so that a failed write stops the run.
+
+E.g.:
+
+    with BackgroundWriter() as writer:
+        for filename, data in files:
+            writer.submit(write_json_file, filename, data)
+    # all files have been written here
+"""
+import threading
+from types import TracebackType
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Set, Type
+
+
+# Number of threads that write files (0 to write files in the calling thread instead)
+WRITER_THREADS = 2
+# Maximum number of writes that are queued or in progress
+WRITER_MAX_PENDING = 8
+
+# Number of writer threads used by `BackgroundWriter` unless specified, see `set_writer_threads`
+_writer_threads = WRITER_THREADS
+
+
+def set_writer_threads(threads: int) -> None:
+    global _writer_threads
+    _writer_threads = threads
+
+
+class BackgroundWriter:
+
+    def __init__(self, threads: Optional[int] = None, max_pending: int = WRITER_MAX_PENDING) -> None:
+        """Start threads that write files.
+
+        Parameters
+        ----------
+        threads
+            Number of writer threads (defaults to the number set by `set_writer_threads`). With 0 threads, files
+            are written by `submit` itself.
+        max_pending
+            Maximum number of writes that are queued or in progress before `submit` blocks.
+        """
+        threads = _writer_threads if threads is None else threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='writer') if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending: 'Set[Future[Any]]' = set()
+        self.error: Optional[BaseException] = None
+
+    def _done(self, future: 'Future[Any]') -> None:
+        with self.lock:
+            self.pending.discard(future)
+            if not future.cancelled() and future.exception() is not None and self.error is None:
+                self.error = future.exception()
+        self.slots.release()
+
+    def _cancel_pending(self) -> None:
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            self._cancel_pending()
+            raise self.error
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> None:
+        """Call a function that writes a file in a writer thread, waiting while the queue of writes is full."""
+        self._raise_error()
+        if self.executor is None:
+            function(*args)
+            return
+        self.slots.acquire()
+        # a write may have failed while waiting
+        if self.error is not None:
+            self.slots.release()
+            self._raise_error()
+        with self.lock:
+            future = self.executor.submit(function, *args)
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+
+    def close(self) -> None:
+        """Wait until all files have been written, and raise the error of the first write that failed (if any)."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self._raise_error()
+
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+
+    def __exit__(
+            self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+            traceback: Optional[TracebackType]
+        ) -> None:
+        if exc_value is None:
+            self.close()
+            return
+        # the run is aborted, so queued writes are dropped and the original error is raised
+        self._cancel_pending()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
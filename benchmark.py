@@ -0,0 +1,701 @@
+#!/usr/bin/env python3
+"""
+Benchmark of extracting synthetic family trees of increasing size from both FTB databases and Gramps XML files.
+
+Synthetic trees are generated with the tables of an FTB database that the queries in "ftb_queries.py" use, and as
+a matching Gramps XML export. Trees span several generations with families of varying size, spouses who marry into
+the tree without any known ancestors, remarriages, single parents, and facts with dates of varying precision.
+Generated trees are kept in the work directory and reused by later runs.
+
+Each tree is extracted in a separate process, which records the time taken to load the data source and to generate
+the JSON files (and the time of each stage, see `run_report`), the peak memory usage, the number of SQL statements
+run (for FTB databases) and the size of the output. A digest of the content of the output is compared against the digests of previous runs (the "golden"
+output), independently of how files are split or formatted, so that faster ways of generating the output (e.g.
+more processes, incremental runs or another output format) are checked to produce the same data. Runs with more
+than one process are compared with a run with a single process, to check that the processes speed up the run.
+
+E.g.:
+
+    ./benchmark.py --sizes 1000,10000 --jobs 4
+"""
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import random
+import shutil
+import hashlib
+import resource
+import contextlib
+import functools
+import multiprocessing
+import sqlite3 as sql
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import typer
+
+import extract
+import ftb_queries
+import run_report
+import json_serializer
+from columnar_format import COLUMNAR_FORMAT, decode_columnar
+from extraction_cache import CachedFamilyData
+from background_writer import WRITER_THREADS, set_writer_threads
+
+
+app = typer.Typer(
+    add_completion=False
+)
+
+
+BENCHMARK_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BENCHMARK_FORMATS = ['ftb', 'gxml']
+# Changing how trees are generated requires a new version, so that previously generated trees aren't reused
+GENERATOR_VERSION = 1
+
+FIRST_NAMES = {
+    'M': ['Jan', 'Pieter', 'Johannes', 'Hendrik', 'Willem', 'Jacobus', 'Gerrit', 'Sipho', 'Thabo', 'John',
+          'William', 'Étienne', 'François', 'Karl', 'Jürgen', 'Andries', 'Daniël', 'Frederik', 'Louis', 'Paul'],
+    'F': ['Anna', 'Maria', 'Johanna', 'Elizabeth', 'Susanna', 'Catharina', 'Sanet', 'Lerato', 'Nomsa', 'Jane',
+          'Margaret', 'Zoë', 'Renée', 'Hélène', 'Ingrid', 'Aletta', 'Magdalena', 'Sophia', 'Emma', 'Sarah'],
+}
+LAST_NAMES = ['Muller', 'Botha', 'van der Merwe', 'Smith', 'Nkosi', 'du Plessis', 'Pretorius', 'Fourie', 'Nel',
+              'van Wyk', 'Dlamini', 'Jacobs', 'Coetzee', 'le Roux', 'Venter', 'Brown', 'Jones', 'Schoeman',
+              'Malan', 'de Villiers', 'Marais', 'Steyn', 'Naidoo', 'Khumalo', 'Ndlovu', 'Swart', 'Kruger',
+              'Müller', 'Lötter', 'Strauß']
+PLACE_SYLLABLES = ['kaap', 'stad', 'berg', 'dorp', 'fontein', 'burg', 'wes', 'oos', 'rivier', 'bosch', 'dal',
+                   'kloof', 'port', 'ville', 'ton', 'field', 'vlei', 'heuwel']
+OCCUPATIONS = ['Farmer', 'Teacher', 'Minister', 'Miner', 'Nurse', 'Clerk', 'Carpenter', 'Merchant', 'Blacksmith']
+CAUSES_OF_DEATH = ['Old age', 'Tuberculosis', 'Influenza', 'Accident']
+
+# Relative chance of families having a given number of children (index)
+CHILDREN_WEIGHTS = [10, 12, 20, 18, 13, 9, 6, 4, 3, 2, 1, 1]
+# Chance of a person marrying, and of them marrying again
+MARRIAGE_RATE = 0.85
+REMARRIAGE_RATE = 0.1
+# Chance of a marriage being between two people in the tree, instead of with someone without known ancestors
+INTERNAL_MARRIAGE_RATE = 0.3
+# Chance of a family not having a known mother or father
+SINGLE_PARENT_RATE = 0.05
+# Ratio of people that are the first generation of the tree (i.e. have no known parents)
+FOUNDER_RATIO = 0.02
+
+# FTB fact tokens and the Gramps event types they're exported as
+FACT_TYPES = {'BIRT': 'Birth', 'DEAT': 'Death', 'BURI': 'Burial', 'OCCU': 'Occupation', 'RESI': 'Residence'}
+
+FTB_SCHEMA = """
+CREATE TABLE individual_main_data (
+    individual_id TEXT PRIMARY KEY, gender TEXT, is_alive INTEGER, privacy_level INTEGER, delete_flag INTEGER,
+    last_update INTEGER);
+CREATE TABLE individual_data_set (
+    individual_data_set_id INTEGER PRIMARY KEY, individual_id TEXT, delete_flag INTEGER);
+CREATE TABLE individual_lang_data (
+    individual_lang_data_id INTEGER PRIMARY KEY, individual_data_set_id INTEGER, data_language INTEGER,
+    first_name TEXT, last_name TEXT, suffix TEXT);
+CREATE TABLE individual_fact_main_data (
+    individual_fact_id INTEGER PRIMARY KEY, individual_id TEXT, token TEXT, fact_type TEXT, sorted_date INTEGER,
+    place_id INTEGER, delete_flag INTEGER, privacy_level INTEGER);
+CREATE TABLE individual_fact_lang_data (
+    individual_fact_lang_data_id INTEGER PRIMARY KEY, individual_fact_id INTEGER, data_language INTEGER,
+    header TEXT, cause_of_death TEXT);
+CREATE TABLE places_main_data (place_id INTEGER PRIMARY KEY);
+CREATE TABLE places_lang_data (
+    place_lang_data_id INTEGER PRIMARY KEY, place_id INTEGER, data_language INTEGER, place TEXT);
+CREATE TABLE family_main_data (family_id TEXT PRIMARY KEY, delete_flag INTEGER);
+CREATE TABLE family_individual_connection (
+    family_individual_connection_id INTEGER PRIMARY KEY, family_id TEXT, individual_id TEXT,
+    individual_role_type INTEGER, delete_flag INTEGER);
+CREATE INDEX individual_data_set_individual_id ON individual_data_set (individual_id);
+CREATE INDEX individual_lang_data_data_set_id ON individual_lang_data (individual_data_set_id);
+CREATE INDEX individual_fact_main_data_individual_id ON individual_fact_main_data (individual_id);
+CREATE INDEX individual_fact_lang_data_fact_id ON individual_fact_lang_data (individual_fact_id);
+CREATE INDEX places_lang_data_place_id ON places_lang_data (place_id);
+CREATE INDEX family_individual_connection_family_id ON family_individual_connection (family_id);
+CREATE INDEX family_individual_connection_individual_id ON family_individual_connection (individual_id);
+"""
+
+
+class SyntheticPerson(NamedTuple):
+    idx: int
+    gender: str
+    first_name: str
+    last_name: str
+    birth_year: int
+
+
+class SyntheticFamily(NamedTuple):
+    idx: int
+    father: Optional[int]
+    mother: Optional[int]
+    children: List[int]
+
+
+class SyntheticFact(NamedTuple):
+    token: str
+    # (year, month, day) with a month and/or day of 0 if unknown
+    date: Optional[Tuple[int, int, int]]
+    place: Optional[int]
+    description: str
+
+
+class SyntheticTree(NamedTuple):
+    seed: int
+    people: List[SyntheticPerson]
+    families: List[SyntheticFamily]
+    place_names: List[List[str]]
+
+
+def generate_tree(num_people: int, seed: int = 0) -> SyntheticTree:
+    """Generate a family tree of the given number of people, one generation at a time."""
+    rnd = random.Random(seed)
+    people: List[SyntheticPerson] = []
+    families: List[SyntheticFamily] = []
+
+    def add_person(gender: str, last_name: str, birth_year: int) -> Optional[int]:
+        if len(people) >= num_people:
+            return None
+        people.append(SyntheticPerson(len(people), gender, rnd.choice(FIRST_NAMES[gender]), last_name, birth_year))
+        return len(people) - 1
+
+    def add_married_in(gender: str, birth_year: int) -> Optional[int]:
+        return add_person(gender, rnd.choice(LAST_NAMES), birth_year + rnd.randint(-5, 5))
+
+    def add_family(father: Optional[int], mother: Optional[int], birth_year: int) -> List[int]:
+        if rnd.random() < SINGLE_PARENT_RATE:
+            if rnd.random() < 0.5:
+                father = None
+            else:
+                mother = None
+        last_name = people[father].last_name if father is not None else \
+            people[mother].last_name if mother is not None else rnd.choice(LAST_NAMES)
+        children: List[int] = []
+        num_children = rnd.choices(range(len(CHILDREN_WEIGHTS)), CHILDREN_WEIGHTS)[0]
+        for _ in range(num_children):
+            child = add_person(rnd.choice('MF'), last_name, birth_year + rnd.randint(20, 40))
+            if child is None:
+                break
+            children.append(child)
+        families.append(SyntheticFamily(len(families), father, mother, children))
+        return children
+
+    birth_year = 1650
+    generation: List[int] = []
+    while len(people) < num_people:
+        # start new lines of ancestors when the tree is small or has died out
+        num_founders = max(2, int(num_people * FOUNDER_RATIO)) if len(generation) == 0 else 0
+        for _ in range(num_founders):
+            founder = add_person(rnd.choice('MF'), rnd.choice(LAST_NAMES), birth_year + rnd.randint(-10, 10))
+            if founder is not None:
+                generation.append(founder)
+        rnd.shuffle(generation)
+        unmarried = {'M': [idx for idx in generation if people[idx].gender == 'M'],
+                     'F': [idx for idx in generation if people[idx].gender == 'F']}
+        num_internal = int(min(len(unmarried['M']), len(unmarried['F'])) * INTERNAL_MARRIAGE_RATE)
+        next_generation: List[int] = []
+        for _ in range(num_internal):
+            father, mother = unmarried['M'].pop(), unmarried['F'].pop()
+            next_generation.extend(add_family(father, mother, people[father].birth_year))
+        for gender, spouse_gender in [('M', 'F'), ('F', 'M')]:
+            for idx in unmarried[gender]:
+                if rnd.random() > MARRIAGE_RATE:
+                    continue
+                for _ in range(2 if rnd.random() < REMARRIAGE_RATE else 1):
+                    spouse = add_married_in(spouse_gender, people[idx].birth_year)
+                    if spouse is None:
+                        break
+                    father, mother = (idx, spouse) if gender == 'M' else (spouse, idx)
+                    next_generation.extend(add_family(father, mother, people[idx].birth_year))
+        generation = next_generation
+        birth_year += 30
+
+    num_places = max(20, num_people // 100)
+    place_names = []
+    for _ in range(num_places):
+        name = ''.join(rnd.choice(PLACE_SYLLABLES) for _ in range(rnd.randint(2, 3))).capitalize()
+        # some places also have a name in another language
+        place_names.append([name, name + 'stad'] if rnd.random() < 0.1 else [name])
+    return SyntheticTree(seed, people, families, place_names)
+
+
+def person_facts(tree: SyntheticTree, person: SyntheticPerson) -> List[SyntheticFact]:
+    """Get the facts of a person (which are the same every time, without having to store them for every person)."""
+    rnd = random.Random(tree.seed * 1_000_003 + person.idx)
+
+    def random_date(year: int) -> Optional[Tuple[int, int, int]]:
+        precision = rnd.random()
+        if precision < 0.1:
+            return None
+        if precision < 0.4:
+            return year, 0, 0
+        if precision < 0.5:
+            return year, rnd.randint(1, 12), 0
+        return year, rnd.randint(1, 12), rnd.randint(1, 28)
+
+    def random_place() -> Optional[int]:
+        return rnd.randrange(len(tree.place_names)) if rnd.random() < 0.7 else None
+
+    facts = []
+    if rnd.random() < 0.95:
+        facts.append(SyntheticFact('BIRT', random_date(person.birth_year), random_place(), ''))
+    death_year = person.birth_year + rnd.randint(0, 95)
+    if death_year < 2000 and rnd.random() < 0.8:
+        cause = rnd.choice(CAUSES_OF_DEATH) if rnd.random() < 0.3 else ''
+        facts.append(SyntheticFact('DEAT', random_date(death_year), random_place(), cause))
+        if rnd.random() < 0.3:
+            facts.append(SyntheticFact('BURI', random_date(death_year), random_place(), ''))
+    if rnd.random() < 0.4:
+        facts.append(SyntheticFact('OCCU', random_date(person.birth_year + 25), None, rnd.choice(OCCUPATIONS)))
+    for _ in range(rnd.choices([0, 1, 2], [6, 3, 1])[0]):
+        facts.append(SyntheticFact('RESI', random_date(person.birth_year + rnd.randint(0, 60)), random_place(), ''))
+    return facts
+
+
+def ftb_person_id(index: int) -> str:
+    # ids aren't consecutive, as if some people had been deleted
+    return str(index + 1 + index // 37)
+
+
+def ftb_family_id(index: int) -> str:
+    return str(index + 1 + index // 53)
+
+
+def write_ftb_db(filename: str, tree: SyntheticTree) -> None:
+    """Write tree as an FTB database (with only the tables and columns used by the extractor)."""
+    if os.path.exists(filename):
+        os.remove(filename)
+    conn = sql.connect(filename)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(FTB_SCHEMA)
+    conn.executemany('INSERT INTO places_main_data VALUES (?)', ((idx,) for idx in range(len(tree.place_names))))
+    conn.executemany('INSERT INTO places_lang_data (place_id, data_language, place) VALUES (?, ?, ?)',
+        ((idx, lang, name) for idx, names in enumerate(tree.place_names) for lang, name in enumerate(names)))
+    conn.executemany('INSERT INTO individual_main_data VALUES (?, ?, ?, 0, 0, ?)',
+        ((ftb_person_id(person.idx), person.gender, 2 if person.birth_year < 1930 else 3,
+          1_600_000_000 + person.idx) for person in tree.people))
+    conn.executemany('INSERT INTO individual_data_set VALUES (?, ?, 0)',
+        ((person.idx, ftb_person_id(person.idx)) for person in tree.people))
+    conn.executemany('INSERT INTO individual_lang_data '
+        '(individual_data_set_id, data_language, first_name, last_name, suffix) VALUES (?, ?, ?, ?, ?)',
+        ((person.idx, 0, person.first_name, person.last_name, 'Jr' if person.idx % 97 == 0 else None)
+         for person in tree.people))
+    fact_id = 0
+    fact_rows = []
+    fact_lang_rows: List[Tuple[int, Optional[str], Optional[str]]] = []
+    for person in tree.people:
+        for fact in person_facts(tree, person):
+            fact_id += 1
+            sorted_date = 0 if fact.date is None else fact.date[0] * 10000 + fact.date[1] * 100 + fact.date[2]
+            # some facts have been deleted
+            fact_rows.append((fact_id, ftb_person_id(person.idx), fact.token, '', sorted_date, fact.place,
+                1 if fact_id % 151 == 0 else 0))
+            if fact.token == 'DEAT':
+                fact_lang_rows.append((fact_id, None, fact.description or None))
+            elif fact.description:
+                fact_lang_rows.append((fact_id, fact.description, None))
+        if len(fact_rows) >= 100_000:
+            conn.executemany('INSERT INTO individual_fact_main_data VALUES (?, ?, ?, ?, ?, ?, ?, 0)', fact_rows)
+            fact_rows = []
+    conn.executemany('INSERT INTO individual_fact_main_data VALUES (?, ?, ?, ?, ?, ?, ?, 0)', fact_rows)
+    conn.executemany('INSERT INTO individual_fact_lang_data '
+        '(individual_fact_id, data_language, header, cause_of_death) VALUES (?, 0, ?, ?)', fact_lang_rows)
+    conn.executemany('INSERT INTO family_main_data VALUES (?, 0)',
+        ((ftb_family_id(family.idx),) for family in tree.families))
+    conn.executemany('INSERT INTO family_individual_connection '
+        '(family_id, individual_id, individual_role_type, delete_flag) VALUES (?, ?, ?, 0)',
+        ((ftb_family_id(family.idx), ftb_person_id(person_idx), role)
+         for family in tree.families for person_idx, role in _family_roles(family)))
+    conn.commit()
+    conn.close()
+
+
+def _family_roles(family: SyntheticFamily) -> Iterator[Tuple[int, int]]:
+    """Get members of a family with their FTB role type (see `individual_role_type`)."""
+    if family.father is not None:
+        yield family.father, 2
+    if family.mother is not None:
+        yield family.mother, 3
+    for child in family.children:
+        # a few children are adopted
+        yield child, 6 if child % 41 == 0 else 5
+
+
+def _gramps_date(date: Tuple[int, int, int]) -> str:
+    return '-'.join(f'{value:02d}' for value in date if value != 0)
+
+
+def write_gramps_xml(filename: str, tree: SyntheticTree) -> None:
+    """Write tree as a gzipped Gramps XML export."""
+    child_of: Dict[int, List[int]] = {}
+    parent_in: Dict[int, List[int]] = {}
+    for family in tree.families:
+        for parent in [family.father, family.mother]:
+            if parent is not None:
+                parent_in.setdefault(parent, []).append(family.idx)
+        for child in family.children:
+            child_of.setdefault(child, []).append(family.idx)
+
+    with gzip.open(filename, 'wt', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE database PUBLIC "-//Gramps//DTD Gramps XML 1.7.1//EN" '
+            '"http://gramps-project.org/xml/1.7.1/grampsxml.dtd">\n'
+            '<database xmlns="http://gramps-project.org/xml/1.7.1/">\n'
+            '  <header>\n    <created date="2022-03-04" version="5.1.5"/>\n  </header>\n')
+        file.write('  <events>\n')
+        for person in tree.people:
+            for num, fact in enumerate(person_facts(tree, person)):
+                file.write(f'    <event handle="_e{person.idx:08x}_{num}" change="{1_600_000_000 + person.idx}" '
+                    f'id="E{person.idx:04d}_{num}">\n      <type>{FACT_TYPES[fact.token]}</type>\n')
+                if fact.date is not None:
+                    file.write(f'      <dateval val="{_gramps_date(fact.date)}"/>\n')
+                if fact.place is not None:
+                    file.write(f'      <place hlink="_l{fact.place:08x}"/>\n')
+                if fact.description:
+                    file.write(f'      <description>{escape(fact.description)}</description>\n')
+                file.write('    </event>\n')
+        file.write('  </events>\n  <people>\n')
+        for person in tree.people:
+            file.write(f'    <person handle="_p{person.idx:08x}" change="{1_600_000_000 + person.idx}" '
+                f'id="I{person.idx:04d}">\n      <gender>{person.gender}</gender>\n'
+                f'      <name type="Birth Name">\n        <first>{escape(person.first_name)}</first>\n')
+            prefix, _, surname = person.last_name.rpartition(' ')
+            if prefix:
+                file.write(f'        <surname prefix={quoteattr(prefix)}>{escape(surname)}</surname>\n')
+            else:
+                file.write(f'        <surname>{escape(surname)}</surname>\n')
+            file.write('      </name>\n')
+            for num, _ in enumerate(person_facts(tree, person)):
+                file.write(f'      <eventref hlink="_e{person.idx:08x}_{num}" role="Primary"/>\n')
+            for family_idx in child_of.get(person.idx, []):
+                file.write(f'      <childof hlink="_f{family_idx:08x}"/>\n')
+            for family_idx in parent_in.get(person.idx, []):
+                file.write(f'      <parentin hlink="_f{family_idx:08x}"/>\n')
+            file.write('    </person>\n')
+        file.write('  </people>\n  <families>\n')
+        for family in tree.families:
+            file.write(f'    <family handle="_f{family.idx:08x}" change="1" id="F{family.idx:04d}">\n'
+                '      <rel type="Married"/>\n')
+            if family.father is not None:
+                file.write(f'      <father hlink="_p{family.father:08x}"/>\n')
+            if family.mother is not None:
+                file.write(f'      <mother hlink="_p{family.mother:08x}"/>\n')
+            for child in family.children:
+                file.write(f'      <childref hlink="_p{child:08x}"/>\n')
+            file.write('    </family>\n')
+        file.write('  </families>\n  <places>\n')
+        for idx, names in enumerate(tree.place_names):
+            file.write(f'    <placeobj handle="_l{idx:08x}" change="1" id="P{idx:04d}" type="City">\n'
+                f'      <pname value={quoteattr(names[0])}/>\n    </placeobj>\n')
+        file.write('  </places>\n</database>\n')
+
+
+def tree_filename(work_dir: str, format: str, size: int, seed: int) -> str:
+    extension = 'ftb' if format == 'ftb' else 'gramps'
+    return f'{work_dir}/tree-v{GENERATOR_VERSION}-{size}-{seed}.{extension}'
+
+
+def ensure_trees(work_dir: str, formats: List[str], size: int, seed: int) -> None:
+    """Generate the tree of the given size in each format, unless it has already been generated."""
+    missing = [format for format in formats if not os.path.exists(tree_filename(work_dir, format, size, seed))]
+    if len(missing) == 0:
+        return
+    print(f'Generating tree of {size} people...')
+    tree = generate_tree(size, seed)
+    for format in missing:
+        filename = tree_filename(work_dir, format, size, seed)
+        # write to a temporary file so that partially written trees aren't reused
+        write = write_ftb_db if format == 'ftb' else write_gramps_xml
+        write(filename + '.tmp', tree)
+        os.replace(filename + '.tmp', filename)
+
+
+def _record_digest(record: Any) -> str:
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('ascii')).hexdigest()
+
+
+def _read_json(filename: str) -> Any:
+    with open(filename) as infile:
+        data = json.load(infile)
+    if isinstance(data, dict) and data.get('format') == COLUMNAR_FORMAT:
+        data = decode_columnar(data)
+    if isinstance(data, dict):
+        data.pop('metadata', None)
+    return data
+
+
+def output_digests(output_dir: str) -> Dict[str, str]:
+    """Get a digest of each type of data in the output, independently of how the data is split into files.
+
+    The output of sharded family links is decoded, so that it has the same digest as a single family links file.
+    """
+    records: Dict[str, Dict[str, str]] = {}
+    for filename in glob.glob(f'{output_dir}/*/*.json'):
+        data_type = os.path.basename(os.path.dirname(filename))
+        data = _read_json(filename)
+        if not isinstance(data, dict):
+            # e.g. search files contain a list of people
+            data = {os.path.basename(filename): data}
+        records.setdefault(data_type, {}).update((str(id), _record_digest(value)) for id, value in data.items())
+    # the shard index depends on the size of files, and the manifest on the formatting of files
+    for filename in set(glob.glob(f'{output_dir}/*.json')) - {f'{output_dir}/shard-index.json',
+            extract.manifest_filename(output_dir)}:
+        records[os.path.basename(filename)] = {'': _record_digest(_read_json(filename))}
+
+    if len(records.get('links', {})) > 0:
+        legend = _read_json(f'{output_dir}/shard-index.json')['linkLegend']
+        links = {}
+        for filename in glob.glob(f'{output_dir}/links/*.json'):
+            for person_id, person_links in _read_json(filename).items():
+                links[person_id] = [[link[0], legend['roles'][link[1]], *(legend['types'][value] for value in link[2:])]
+                    for link in person_links]
+        records['family-links.json'] = {'': _record_digest(links)}
+    records.pop('links', None)
+    return {data_type: _record_digest(sorted(data_records.items()))
+        for data_type, data_records in sorted(records.items())
+        if len(data_records) > 0}
+
+
+class BenchmarkCase(NamedTuple):
+    format: str
+    size: int
+    seed: int
+    source: str
+    output_dir: str
+    jobs: int
+    incremental: bool
+    stream_xml: bool
+    compact_json: bool
+    compress: bool
+    columnar: bool
+    sharded_links: bool
+    in_memory: bool
+    cache: Optional[str]
+    write_threads: int
+
+    @property
+    def name(self) -> str:
+        """Name of the tree of the case, which all ways of extracting it should produce the same output for."""
+        return f'{self.format}-{self.size}-{self.seed}'
+
+
+def _peak_rss_bytes() -> int:
+    usage = max(resource.getrusage(who).ru_maxrss for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN])
+    # kilobytes on Linux, but bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def _cpu_seconds() -> float:
+    return sum(usage.ru_utime + usage.ru_stime
+        for usage in [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)])
+
+
+def run_case(case: BenchmarkCase) -> Dict[str, Any]:
+    """Extract the tree of a case and measure it (in a process of its own, so that peak memory is its own)."""
+    if not case.incremental:
+        shutil.rmtree(case.output_dir, ignore_errors=True)
+    extract.set_output_format(compact=case.compact_json, compress=case.compress, columnar=case.columnar)
+    set_writer_threads(case.write_threads)
+    # statements run by worker processes are added to the report by the main process
+    report = run_report.start_report({name: value for name, value in vars(ftb_queries).items()
+        if name.startswith('QRY_') and isinstance(value, str)})
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        cache_path = None if case.cache is None else Path(case.cache)
+        cache_hit = None if cache_path is None else os.path.exists(cache_path)
+        open_source: Callable[[], extract.FamilyData]
+        open_db: Optional[Callable[[], extract.FamilyData]] = None
+        if case.format == 'ftb':
+            open_source = open_db = functools.partial(extract.open_ftb_db, case.source, case.in_memory)
+            focus_person_id = ftb_person_id(case.size - 1)
+        else:
+            open_source = functools.partial(extract.open_gramps_xml, Path(case.source), case.stream_xml)
+            focus_person_id = f'I{case.size - 1:04d}'
+        with run_report.stage('load'):
+            db = extract.open_cached(cache_path, Path(case.source), case.format.upper(), open_source)
+        if case.cache is not None:
+            open_db = functools.partial(CachedFamilyData, case.cache)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        extract.generate_json(db, case.output_dir, os.path.basename(case.source), focus_person_id, jobs=case.jobs,
+            open_db=open_db, incremental=case.incremental, sharded_links=case.sharded_links)
+        generate_seconds = time.perf_counter() - start
+
+    filenames = [os.path.join(path, filename) for path, _, filenames in os.walk(case.output_dir)
+        for filename in filenames]
+    return {
+        'case': case.name,
+        'format': case.format,
+        'size': case.size,
+        'jobs': case.jobs,
+        'incremental': case.incremental,
+        'cacheHit': cache_hit,
+        'loadSeconds': round(load_seconds, 3),
+        'generateSeconds': round(generate_seconds, 3),
+        'cpuSeconds': round(_cpu_seconds(), 3),
+        'peakRssBytes': _peak_rss_bytes(),
+        # compact JSON is written faster by orjson, if it's installed
+        'jsonBackend': json_serializer.backend_name(),
+        'statements': sum(query['count'] for query in report.queries.values()) if case.format == 'ftb' else None,
+        'outputFiles': len(filenames),
+        'outputBytes': sum(os.path.getsize(filename) for filename in filenames),
+        'stages': report.to_json()['stages'],
+        'queries': report.queries,
+        'stageSummary': report.summary(),
+        'digests': output_digests(case.output_dir),
+    }
+
+
+def _run_case_process(case: BenchmarkCase, results: 'multiprocessing.Queue[Dict[str, Any]]') -> None:
+    results.put(run_case(case))
+
+
+def run_case_process(case: BenchmarkCase) -> Dict[str, Any]:
+    """Run a case in a new process (which isn't forked, so that it doesn't inherit the memory of this one)."""
+    context = multiprocessing.get_context('spawn')
+    results: 'multiprocessing.Queue[Dict[str, Any]]' = context.Queue()
+    process = context.Process(target=_run_case_process, args=(case, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def compare_golden(golden: Dict[str, Dict[str, str]], result: Dict[str, Any]) -> str:
+    """Compare the output digests of a case with the golden output, which is stored if there is none yet."""
+    expected = golden.setdefault(result['case'], result['digests'])
+    different = sorted(data_type for data_type in set(expected) | set(result['digests'])
+        if expected.get(data_type) != result['digests'].get(data_type))
+    return 'ok' if len(different) == 0 else 'DIFFERENT: ' + ', '.join(different)
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    statements = '' if result['statements'] is None else result['statements']
+    return (f"{result['case']:<18} {result['jobs']:>4} {result['loadSeconds']:>8.2f} {result['generateSeconds']:>9.2f} "
+        f"{result['cpuSeconds']:>8.2f} {result['peakRssBytes'] / 2**20:>9.1f} {statements:>10} "
+        f"{result['outputFiles']:>7} {result['outputBytes'] / 2**20:>10.1f}  {result['golden']}")
+
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip() != '']
+
+
+@app.command()
+def main(
+    sizes: str = typer.Option(','.join(str(size) for size in BENCHMARK_SIZES),
+        help="Comma-separated numbers of people of the trees to benchmark."
+    ),
+    formats: str = typer.Option(','.join(BENCHMARK_FORMATS),
+        help="Comma-separated formats of the trees to benchmark (ftb and/or gxml)."
+    ),
+    seed: int = typer.Option(0,
+        help="Seed of the random generation of trees."
+    ),
+    work_dir: str = typer.Option('var/benchmark',
+        help="Directory in which generated trees and output are stored."
+    ),
+    golden: Optional[str] = typer.Option(None,
+        help="JSON file with digests of the golden output of each tree (defaults to golden.json in the work directory)."
+    ),
+    update_golden: bool = typer.Option(False,
+        help="Replace the golden output of the benchmarked trees with their current output."
+    ),
+    report: Optional[str] = typer.Option(None,
+        help="Write the results as JSON to this file."
+    ),
+    jobs: int = typer.Option(1,
+        help="Number of worker processes used to generate the people, families and facts files.",
+        min=1
+    ),
+    incremental: bool = typer.Option(False,
+        help="Also time an incremental run without any changes after each full run."
+    ),
+    stream_xml: bool = typer.Option(False,
+        help="Incrementally parse XML and only keep the parts that are used."
+    ),
+    compact_json: bool = typer.Option(False,
+        help="Write JSON files without whitespace."
+    ),
+    compress: bool = typer.Option(False,
+        help="Also write compressed copies of JSON files."
+    ),
+    columnar: bool = typer.Option(False,
+        help="Write people and families files in a compact columnar format."
+    ),
+    shard_links: bool = typer.Option(False,
+        help="Split family links into files by id."
+    ),
+    in_memory: bool = typer.Option(False,
+        help="Copy FTB databases into memory and index them before querying."
+    ),
+    write_threads: int = typer.Option(WRITER_THREADS,
+        help="Number of threads that write files in the background (0 to not use threads).",
+        min=0
+    ),
+    cache: bool = typer.Option(False,
+        help="Extract trees through an extraction cache, timing both the run that creates it and one that reads it."
+    ),
+    serial_baseline: bool = typer.Option(True,
+        help="When --jobs is more than 1, also time a run with a single process to compare the runs with."
+    ),
+    stages: bool = typer.Option(False,
+        help="Also show the time spent in each stage of extracting a tree."
+    )) -> None:
+    """Benchmark extracting synthetic family trees and check that the output matches the golden output."""
+    os.makedirs(work_dir, exist_ok=True)
+    golden_filename = golden or f'{work_dir}/golden.json'
+    golden_digests: Dict[str, Dict[str, str]] = {}
+    if os.path.exists(golden_filename):
+        with open(golden_filename) as infile:
+            golden_digests = json.load(infile)
+
+    print(f'Compact JSON is written with {json_serializer.backend_name()}\n')
+    print(f"{'case':<18} {'jobs':>4} {'load s':>8} {'generate s':>9} {'cpu s':>8} {'peak MiB':>9} {'statements':>10} "
+        f"{'files':>7} {'output MiB':>10}  golden")
+    results = []
+    for size in (int(size) for size in parse_list(sizes)):
+        ensure_trees(work_dir, parse_list(formats), size, seed)
+        for format in parse_list(formats):
+            if format not in BENCHMARK_FORMATS:
+                raise typer.BadParameter(f'Unknown format: {format}')
+            case = BenchmarkCase(format, size, seed, tree_filename(work_dir, format, size, seed),
+                f'{work_dir}/output-{format}-{size}', jobs, False, stream_xml, compact_json, compress, columnar,
+                shard_links, in_memory, f'{work_dir}/cache-{format}-{size}-{seed}.sqlite' if cache else None,
+                write_threads)
+            if update_golden:
+                golden_digests.pop(case.name, None)
+            if case.cache is not None and os.path.exists(case.cache):
+                os.remove(case.cache)
+            # pairs of the number of jobs and whether the run is incremental
+            runs = ([(jobs, False)] if cache else []) + ([(1, False)] if jobs > 1 and serial_baseline else []) + \
+                [(jobs, False)] + ([(jobs, True)] if incremental else [])
+            serial_seconds = None
+            for run_jobs, run_incremental in runs:
+                result = run_case_process(case._replace(jobs=run_jobs, incremental=run_incremental))
+                result['golden'] = compare_golden(golden_digests, result)
+                print(format_result(result))
+                if run_jobs == 1 and not run_incremental:
+                    serial_seconds = result['generateSeconds']
+                elif serial_seconds is not None and not run_incremental:
+                    result['speedupOverSerial'] = round(serial_seconds / max(result['generateSeconds'], 0.001), 2)
+                    print(f"{'':<18} {'':>4} {result['speedupOverSerial']:.2f}x the speed of a single process")
+                if stages:
+                    print('\n' + result.pop('stageSummary') + '\n')
+                else:
+                    result.pop('stageSummary')
+                results.append(result)
+
+    with open(golden_filename, 'w') as outfile:
+        json.dump(golden_digests, outfile, indent=2, sort_keys=True)
+    if report is not None:
+        with open(report, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    if any(result['golden'] != 'ok' for result in results):
+        raise typer.Exit(code=1)
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,147 @@
+"""
+Compact columnar format for JSON files containing records (e.g. people or families) keyed by id.
+
+Instead of repeating the keys of every record, a file contains a header of schemas (lists of columns) and then
+an array of values for each record. Strings that repeat often within a column (e.g. surnames and places) are
+stored once in a string table and referenced by index. E.g.:
+
+    {"1": {"personId": "1", "lastName": "Muller", "facts": {"birth": {"date": "1900"}}},
+     "2": {"personId": "2", "lastName": "Muller", "facts": {"birth": {"date": null}}}}
+
+is stored as:
+
+    {"format": "columnar", "version": 1,
+     "ids": ["1", "2"],
+     "schemas": [[[0, "personId"], [1, "lastName"], [0, "facts", "birth", "date"]]],
+     "strings": ["Muller"],
+     "rows": [[0, "1", 0, "1900"], [0, "2", 0, null]]}
+
+Each column is a list of a value kind followed by the path of keys to the value in the record. Each row starts
+with the index of its schema, since records with a different structure (e.g. missing keys) need their own schema.
+Value kinds are:
+- `VALUE_RAW`: the JSON value itself (which includes empty objects).
+- `VALUE_STRING`: index in the string table.
+- `VALUE_RECORDS`: a list of records (e.g. family members) which are each stored as rows.
+
+See `decodeColumnar()` in "public/main.js" for decoding.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Set, Tuple
+
+
+COLUMNAR_FORMAT = 'columnar'
+COLUMNAR_VERSION = 1
+
+VALUE_RAW = 0
+VALUE_STRING = 1
+VALUE_RECORDS = 2
+
+# Only intern strings of columns in which values repeat, i.e. with at most this ratio of distinct values
+MAX_INTERNED_DISTINCT_RATIO = 0.5
+
+Path = Tuple[str, ...]
+
+
+def _is_records(value: Any) -> bool:
+    return isinstance(value, list) and len(value) > 0 and \
+        all(isinstance(item, dict) and len(item) > 0 for item in value)
+
+
+def _collect_values(record: Dict[str, Any], values: Dict[Path, List[Any]], path: Path = ()) -> None:
+    """Collect leaf values of record per path (paths of nested records are relative to those records)."""
+    for key, value in record.items():
+        value_path = path + (key,)
+        if isinstance(value, dict) and len(value) > 0:
+            _collect_values(value, values, value_path)
+        elif _is_records(value):
+            for item in value:
+                _collect_values(item, values)
+        else:
+            values.setdefault(value_path, []).append(value)
+
+
+class ColumnarEncoder:
+    """Encodes the records of a single file into columnar format."""
+
+    def __init__(self, records: Dict[Any, Dict[str, Any]]) -> None:
+        self.records = records
+        values: Dict[Path, List[Any]] = {}
+        for record in records.values():
+            _collect_values(record, values)
+        self.interned_paths: Set[Path] = {
+            path for path, path_values in values.items()
+            if all(isinstance(value, str) for value in path_values)
+            and len(set(path_values)) <= MAX_INTERNED_DISTINCT_RATIO * len(path_values)
+        }
+        # most frequent strings get the smallest indexes
+        counts = Counter(value for path in sorted(self.interned_paths) for value in values[path])
+        self.strings = [value for value, _ in sorted(counts.items(), key=lambda item: -item[1])]
+        self.string_indexes = {value: idx for idx, value in enumerate(self.strings)}
+        self.schemas: List[List[List[Any]]] = []
+        self.schema_indexes: Dict[Tuple[Tuple[Any, ...], ...], int] = {}
+
+    def _flatten(self, record: Dict[str, Any], columns: List[List[Any]], row: List[Any], path: Path = ()) -> None:
+        for key, value in record.items():
+            value_path = path + (key,)
+            if isinstance(value, dict) and len(value) > 0:
+                self._flatten(value, columns, row, value_path)
+            elif _is_records(value):
+                columns.append([VALUE_RECORDS, *value_path])
+                row.append([self.encode_record(item) for item in value])
+            elif isinstance(value, str) and value_path in self.interned_paths:
+                columns.append([VALUE_STRING, *value_path])
+                row.append(self.string_indexes[value])
+            else:
+                columns.append([VALUE_RAW, *value_path])
+                row.append(value)
+
+    def encode_record(self, record: Dict[str, Any]) -> List[Any]:
+        """Encode record as a row starting with the index of its schema."""
+        columns: List[List[Any]] = []
+        row: List[Any] = []
+        self._flatten(record, columns, row)
+        schema_key = tuple(tuple(column) for column in columns)
+        if schema_key not in self.schema_indexes:
+            self.schema_indexes[schema_key] = len(self.schemas)
+            self.schemas.append(columns)
+        return [self.schema_indexes[schema_key]] + row
+
+    def encode(self) -> Dict[str, Any]:
+        rows = [self.encode_record(record) for record in self.records.values()]
+        return {
+            'format': COLUMNAR_FORMAT,
+            'version': COLUMNAR_VERSION,
+            'ids': list(self.records.keys()),
+            'schemas': self.schemas,
+            'strings': self.strings,
+            'rows': rows,
+        }
+
+
+def encode_columnar(records: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+    """Encode records keyed by id into columnar format."""
+    return ColumnarEncoder(records).encode()
+
+
+def _decode_row(data: Dict[str, Any], row: List[Any]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {}
+    for column, value in zip(data['schemas'][row[0]], row[1:]):
+        kind, path = column[0], column[1:]
+        target = record
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        if kind == VALUE_STRING:
+            value = data['strings'][value]
+        elif kind == VALUE_RECORDS:
+            value = [_decode_row(data, item) for item in value]
+        target[path[-1]] = value
+    return record
+
+
+def decode_columnar(data: Dict[str, Any]) -> Dict[Any, Any]:
+    """Decode columnar format back into records keyed by id (along with any metadata)."""
+    assert data.get('format') == COLUMNAR_FORMAT and data.get('version') == COLUMNAR_VERSION
+    records = {id: _decode_row(data, row) for id, row in zip(data['ids'], data['rows'])}
+    if 'metadata' in data:
+        records['metadata'] = data['metadata']
+    return records
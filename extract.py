@@ -10,7 +10,15 @@
 
 import os
 import re
-import json
+import glob
+import gzip
+import bisect
+import hashlib
+import time
+import functools
+import itertools
+import contextlib
+import multiprocessing
 import pathlib
 import os.path
 import sqlite3 as sql
@@ -18,23 +26,64 @@ from enum import Enum
 from pathlib import Path
 from datetime import datetime
 from collections import defaultdict
-from typing import Dict, List, Set, Tuple, Any, Generator, Optional, Callable, Literal, Union, cast, Protocol
+from typing import Dict, List, Set, Tuple, Any, BinaryIO, Iterable, Iterator, Optional, Callable, Literal, Union, \
+    Protocol
 
 import click
 import typer
+from typer.core import TyperGroup
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
 
+import ftb_queries
+import run_report
+import json_serializer
+import site_server
 from ftb_format import *
-from gramps_xml_format import GrampsXML, load_xml
+from gramps_xml_format import GrampsXML, load_xml, iterparse_xml
+from columnar_format import encode_columnar
+from search_index import build_search_index
+from background_writer import BackgroundWriter, WRITER_THREADS, set_writer_threads
+from extraction_cache import CachedFamilyData, file_hash, open_cache, write_cache
+
+
+class DefaultCommandGroup(TyperGroup):
+    """Group of commands that runs the "generate" command if no command is given.
+
+    This keeps commands like `extract.py --format ftb family.ftb` working as they did before there were other
+    commands.
+    """
+
+    default_command = 'generate'
+
+    def parse_args(self, ctx: Any, args: List[str]) -> List[str]:
+        if len(args) > 0 and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args = [self.default_command] + args
+        return super().parse_args(ctx, args)
 
 
 app = typer.Typer(
-    add_completion=False
+    add_completion=False,
+    cls=DefaultCommandGroup
 )
 
 
-family_json_div_size = 100
-person_json_div_size = 1000
-fact_json_div_size = 1000
+# Target size of the people, families and facts JSON files (see `shard_by_size`)
+SHARD_MAX_BYTES = 64 * 1024
+# Types of data that are split into files (shards) by id, with each type stored in a folder of the same name
+SHARD_TYPES = ['people', 'families', 'facts']
+# Types of data derived from family links only, which are split into files in the same way
+# ("links" only contain data if family links are sharded, see `encode_sharded_links`)
+LINK_SHARD_TYPES = ['antecedents', 'kinship', 'links']
+# Types of files that earlier versions generated, which are removed from output directories
+REMOVED_SHARD_TYPES = ['family-members']
+SHARD_INDEX_VERSION = 2
+# Number of hex digits of the content hash of a file that are used as its version in the shard index
+SHARD_VERSION_DIGITS = 16
+# Number of generations of ancestors stored per person for relationship lookups, see `get_ancestor_tables`
+KINSHIP_MAX_GENERATIONS = 4
 
 
 IDKey = Union[str, Literal["metadata"]]
@@ -48,18 +97,30 @@ class FamilyData(Protocol):
     def get_person_data(self, person_id: str) -> Dict[str, Any]:
         pass
 
+    def get_people_data(self, person_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        pass
+
     def get_family_data(self, family_id: str) -> Dict[str, Any]:
         pass
 
+    def get_families_data(self, family_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        pass
+
     def get_all_family_links(self) -> Dict[str, List[Any]]:
         pass
         
     def get_facts(self, person_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
         pass
 
+    def iter_facts(self, person_ids: Iterable[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        pass
+
     def get_last_updated_date(self) -> datetime:
         pass
 
+    def get_update_stamps(self) -> Dict[str, Any]:
+        pass
+
 
 def get_persons_in_family_links(family_links: FamilyLinks) -> List[IDKey]:
     """Extract all person ids used in family links object."""
@@ -75,151 +136,1165 @@ def get_families_in_family_links(family_links: FamilyLinks) -> Set[IDKey]:
     return all_families
 
 
-def split_dict_by_ids(data_dict: IDDict, divs:int = 1000) -> Generator[Tuple[List[int], IDDict], None, None]:
-    """A generator that splits a dictionary with ids as keys into separate smaller dicts.
-    
+ID_LETTERS_RE = re.compile(r"[A-Za-z]")
+
+
+@functools.lru_cache(maxsize=None)
+def numeric_id(id: IDKey) -> int:
+    """Get the integer part of an id (e.g. "I0012" -> 12)."""
+    return int(ID_LETTERS_RE.sub("", str(id)))
+
+
+def id_sort_key(id: IDKey) -> Tuple[int, str]:
+    """Sort key that orders ids numerically (e.g. "I2" before "I10000")."""
+    return numeric_id(id), str(id)
+
+
+# A file of data split by id: (lowest id, upper bound (non-inclusive) of ids, ids of data stored in file)
+Shard = Tuple[int, int, List[IDKey]]
+# Shards of each type of data, see `SHARD_TYPES`
+ShardPlan = Dict[str, List[Shard]]
+# Approximate JSON size of the data of each id (keyed by id as string) for each type of data
+RecordSizes = Dict[str, Dict[str, int]]
+
+
+def record_size(id: IDKey, record: Any) -> int:
+    """Get the approximate size of the JSON of an id and its data as stored in a dictionary."""
+    compact = _output_format['compact']
+    return len(json_serializer.dumps(str(id), compact)) + len(json_serializer.dumps(record, compact)) + 4
+
+
+def shard_by_size(
+        items: Iterable[Tuple[IDKey, Any]], get_size: Callable[[Any], int], max_bytes: int
+    ) -> Iterator[Tuple[int, int, List[Tuple[IDKey, Any]]]]:
+    """Split items into shards of consecutive ids, with each shard closed before it would exceed max_bytes.
+
+    Shards only exceed max_bytes if a single id has more data than that. Items with the same numeric id
+    (e.g. "I12" and "12") are always kept in the same shard.
+
     Parameters
     ----------
-    data_dict
-        A dictionary with integer ids as keys.
-    divs
-        Divisons, the maximum amount of ids to fit into a smaller dict.
+    items
+        Pairs of ids and their data, ordered by `id_sort_key`.
+    get_size
+        A function returning the size in bytes of the data of an item.
+    max_bytes
+        Target size of each shard.
 
     Yields
     ------
-    A tuple containing the division range (e.g. [1000, 2000]) and the smaller dictionary.
+    A tuple containing the lowest numeric id in the shard, the upper bound (non-inclusive) of numeric ids in the
+    shard and the items in the shard.
+    """
+    shard: List[Tuple[IDKey, Any]] = []
+    shard_bytes = 0
+    lower = upper = 0
+    for number, group in itertools.groupby(items, key=lambda item: numeric_id(item[0])):
+        group_items = list(group)
+        group_bytes = sum(get_size(data) for _, data in group_items)
+        if len(shard) > 0 and shard_bytes + group_bytes > max_bytes:
+            yield lower, number, shard
+            shard, shard_bytes = [], 0
+        if len(shard) == 0:
+            lower = number
+        shard.extend(group_items)
+        shard_bytes += group_bytes
+        upper = number + 1
+    if len(shard) > 0:
+        yield lower, upper, shard
+
+
+def plan_shards(
+        ids: Iterable[IDKey], sizes: Dict[str, int], max_bytes: int, previous: Optional[List[Tuple[int, int]]] = None
+    ) -> List[Shard]:
+    """Split the ids that have a size into shards of at most max_bytes.
+
+    If the id ranges of the shards of a previous build are given, then those ranges are kept as long as their
+    data still fits, so that changes only affect the shards containing changed ids. Ids outside the previous
+    ranges are added to the preceding shard (or the first shard), and shards that have become too large are
+    split. Shards are never merged, so this can leave small shards until everything is resharded.
+    """
+    items = [(id, sizes[str(id)]) for id in sorted(ids, key=id_sort_key) if str(id) in sizes]
+    if previous is None or len(previous) == 0:
+        return [(lower, upper, [id for id, _ in shard_items])
+            for lower, upper, shard_items in shard_by_size(items, int, max_bytes)]
+
+    lowers = [lower for lower, _ in previous]
+    groups: List[List[Tuple[IDKey, Any]]] = [[] for _ in previous]
+    for item in items:
+        groups[max(bisect.bisect_right(lowers, numeric_id(item[0])) - 1, 0)].append(item)
+    shards: List[Shard] = []
+    for (lower, upper), group in zip(previous, groups):
+        if len(group) == 0:
+            continue
+        lower = min(lower, numeric_id(group[0][0]))
+        upper = max(upper, numeric_id(group[-1][0]) + 1)
+        if sum(size for _, size in group) <= max_bytes:
+            shards.append((lower, upper, [id for id, _ in group]))
+            continue
+        split = [(shard_lower, shard_upper, [id for id, _ in shard_items])
+            for shard_lower, shard_upper, shard_items in shard_by_size(group, int, max_bytes)]
+        # the split shards still cover the whole range of the previous shard
+        split[0] = (lower, split[0][1], split[0][2])
+        split[-1] = (split[-1][0], upper, split[-1][2])
+        shards.extend(split)
+    return shards
+
+
+def shard_filename(output_dir: str, shard_type: str, shard: Shard) -> str:
+    return f'{output_dir}/{shard_type}/{shard_type}-{shard[0]}-{shard[1]}.json'
+
+
+MANIFEST_VERSION = 1
+# Content hash and size of each JSON file that has been written (keyed by filename), see `write_json_file`
+ManifestEntry = Dict[str, Any]
+_manifest: Dict[str, ManifestEntry] = {}
+
+# Format options of written JSON files, see `set_output_format`
+OutputFormat = Dict[str, bool]
+_output_format: OutputFormat = {'compact': False, 'compress': False, 'columnar': False}
+
+
+class BrotliWriter:
+    """Stream that compresses data written to it with brotli into a file (which it leaves open when closed)."""
+
+    def __init__(self, outfile: BinaryIO) -> None:
+        self.outfile = outfile
+        self.compressor = brotli.Compressor()
+
+    def write(self, data: bytes) -> int:
+        self.outfile.write(self.compressor.process(data))
+        return len(data)
+
+    def close(self) -> None:
+        self.outfile.write(self.compressor.finish())
+
+
+# File extensions of precompressed copies and functions that open streams to write them into files
+COMPRESSIONS: Dict[str, Callable[[BinaryIO], Any]] = {
+    # fixed mtime and no filename so that output is deterministic
+    '.gz': lambda outfile: gzip.GzipFile('', 'wb', compresslevel=9, fileobj=outfile, mtime=0),
+}
+if brotli is not None:
+    COMPRESSIONS['.br'] = BrotliWriter
+
+
+def set_output_format(compact: bool = False, compress: bool = False, columnar: bool = False) -> None:
+    """Set format options of written JSON files.
+
+    Parameters
+    ----------
+    compact
+        Write JSON without whitespace.
+    compress
+        Also write gzip (and, if the brotli module is available, brotli) compressed copies of each JSON file,
+        e.g. "people-0-1000.json.gz", for web servers to serve.
+    columnar
+        Write people and families files in columnar format (see `columnar_format`).
+    """
+    _output_format['compact'] = compact
+    _output_format['compress'] = compress
+    _output_format['columnar'] = columnar
+
+
+def format_records(records: IDDict) -> Any:
+    """Convert records (e.g. people or families) keyed by id into the output format of records files."""
+    if _output_format['columnar']:
+        return encode_columnar(records)
+    return records
+
+
+def remove_json_file(filename: str) -> None:
+    """Remove JSON file along with its compressed copies."""
+    for path in [filename] + [filename + extension for extension in COMPRESSIONS]:
+        if os.path.exists(path):
+            os.remove(path)
+    _manifest.pop(filename, None)
+
+
+def _without_last_byte(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    previous = next(chunks)
+    for chunk in chunks:
+        yield previous
+        previous = chunk
+    yield previous[:-1]
+
+
+def _write_json_chunks(filename: str, chunks: Iterable[bytes], extensions: List[str], suffix: str = '') -> int:
+    """Write JSON chunks into a file, along with the compressed copies with the given extensions.
+
+    Files are named after the JSON file with the suffix appended, e.g. "people-0-1000.json.gz.tmp" for ".tmp".
+
+    Returns
+    -------
+    The size of the JSON file.
     """
-    # smaller dictionary in which some values were split
-    mini_dict: IDDict = {}
-    # id ranges that smaller dict will contain (end value is non-inclusive)
-    range = [0, divs]
-    for id in sorted(data_dict.keys()):
-        num_id = re.sub(r"[A-Za-z]", "", str(id))
-        if int(num_id) >= range[1]:
-            yield range, mini_dict
-            mini_dict = {}
-            range = [range[1], range[1] + divs]
-        mini_dict[id] = data_dict[id]
-    yield range, mini_dict
-
-
-def generate_split_json(
-        filename_prefix: str, id_list: Union[List[IDKey], Set[IDKey]],
-        get_data_func: Callable[[IDKey], Any], div_size: int, metadata: Optional[JSON] = None
-    ) -> IDDict:
-    """Generate a dictionary with ids as keys which is then split and used to generate JSON files.
-    
+    size = 0
+    with contextlib.ExitStack() as stack:
+        outfile = stack.enter_context(open(filename + suffix, 'wb'))
+        compressed_outfiles = [COMPRESSIONS[extension](stack.enter_context(open(filename + extension + suffix, 'wb')))
+            for extension in extensions]
+        for chunk in chunks:
+            outfile.write(chunk)
+            for compressed_outfile in compressed_outfiles:
+                compressed_outfile.write(chunk)
+            size += len(chunk)
+        for compressed_outfile in compressed_outfiles:
+            compressed_outfile.close()
+    run_report.add_bytes(size + sum(os.path.getsize(filename + extension + suffix) for extension in extensions))
+    return size
+
+
+def write_json_file(filename: str, data: Any, metadata: Optional[JSON] = None, stream: bool = False) -> ManifestEntry:
+    """Write data to a JSON file, unless the manifest shows that the file already contains the same data.
+
+    Metadata is added to dictionaries under the "metadata" key, but is replaced by null when calculating the
+    content hash so that files aren't rewritten only because metadata (e.g. the generation time) has changed.
+
     Parameters
     ----------
-    filename_prefix
-        Folder path and filename prefix.
-    id_list
-        List of ids that will be used as dictionary keys.
-    get_data_func
-        A function to generate the actual data values to be stored.
-    div_size
-        The size of the rough number of the ids per JSON file
+    stream
+        Write the JSON into a temporary file while it's being serialised (see `json_serializer.iterencode`) instead
+        of serialising it in full first, so that large files don't have to be held in memory.
+
+    Returns
+    -------
+    The manifest entry of the file.
     """
-    print(f'\nGenerating {filename_prefix}xxx.json for {len(id_list)} ids...')
-    data_dict: IDDict = {}
-    for idx, idval  in enumerate(id_list):
-        if idx % 100 == 0:
-            print('*' if idx % 1000 == 0 else '.', end="", flush=True)
-        data_dict[idval] = get_data_func(idval)
-        # print(data_dict[idval])
-
-    for rng, split_data_dict in split_dict_by_ids(data_dict, divs=div_size):
-        rng_str = f"{rng[0]}-{rng[1]}"
-        # print(rng_str, min(split_data_dict.keys()), max(split_data_dict.keys()))
-        split_data_dict["metadata"] = metadata
-        with open(f'{filename_prefix}{rng_str}.json', 'w') as outfile:
-            json.dump(split_data_dict, outfile)
-    
-    return data_dict
-
-
-def get_direct_antecedents(person_id: str, family_links: FamilyLinks, families: Dict[Any, Set[Tuple[IDKey, Any]]], depth:int = 1) -> Set[Tuple[int, IDKey]]:
-    # get "birth" family
-    parent_family_ids = [link[0] for link in family_links[person_id] if "child" in link[1]]
-    if len(parent_family_ids) != 1:
-        return set()
-    # get parents of family
-    parents = {(depth, pid) for pid, role in families[parent_family_ids[0]] if not "child" in role}
-
-    # recurse to get further antecedents
-    grand_parents: Set[Tuple[int, IDKey]] = set()
-    for parent in parents:
-        grand_parents = grand_parents.union(get_direct_antecedents(parent[1], family_links, families, depth+1))
-
-    antecedents = parents.union(grand_parents)
-    return antecedents
+    compact = _output_format['compact']
+    chunks = json_serializer.iterencode(data, compact) if stream else iter([json_serializer.dumps(data, compact)])
+    content_hash = hashlib.sha256()
+    metadata_chunks: List[bytes] = []
+    hash_end = b''
+    if isinstance(data, dict):
+        # same as serialising {**data, "metadata": metadata}
+        item_separator, key_separator = (',', ':') if compact else (', ', ': ')
+        metadata_key = ((item_separator if len(data) > 0 else '') + f'"metadata"{key_separator}').encode('ascii')
+        chunks = _without_last_byte(chunks)
+        metadata_chunks = [metadata_key + json_serializer.dumps(metadata, compact) + b'}']
+        hash_end = metadata_key + b'null}'
 
+    def hash_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            content_hash.update(chunk)
+            yield chunk
+        content_hash.update(hash_end)
 
-def get_antecedents(focus_person_id: str, family_links: FamilyLinks) -> Dict[str, List[int]]:
-    """Antecedents are predecessors in a family line (for which the focus person is a descendant)."""
-    families: Dict[Any, Set[Tuple[IDKey, Any]]] = defaultdict(set)
-    for pid, links in family_links.items():
+    content_chunks = itertools.chain(hash_chunks(chunks), metadata_chunks)
+    extensions = [extension for extension in COMPRESSIONS if _output_format['compress']]
+    compressed_filenames = [filename + extension for extension in extensions]
+    # remove compressed copies that are no longer generated so that they aren't served instead of the JSON file
+    for path in [filename + extension for extension in COMPRESSIONS]:
+        if path not in compressed_filenames and os.path.exists(path):
+            os.remove(path)
+
+    previous_entry = _manifest.get(filename)
+    if stream:
+        # the hash is only known once the JSON has been written, so it's written into temporary files that replace
+        # the existing files if they're different
+        temp_filenames = [path + '.tmp' for path in [filename] + compressed_filenames]
+        try:
+            size = _write_json_chunks(filename, content_chunks, extensions, '.tmp')
+        except BaseException:
+            for temp_filename in temp_filenames:
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+            raise
+        unchanged = previous_entry is not None and previous_entry['hash'] == content_hash.hexdigest() and \
+            all(os.path.exists(path) for path in [filename] + compressed_filenames)
+        for path, temp_filename in zip([filename] + compressed_filenames, temp_filenames):
+            if unchanged:
+                os.remove(temp_filename)
+            else:
+                os.replace(temp_filename, path)
+        if unchanged:
+            assert previous_entry is not None
+            return previous_entry
+    else:
+        content = b''.join(content_chunks)
+        if previous_entry is not None and previous_entry['hash'] == content_hash.hexdigest() and \
+                all(os.path.exists(path) for path in [filename] + compressed_filenames):
+            return previous_entry
+        size = _write_json_chunks(filename, [content], extensions)
+    entry = {'hash': content_hash.hexdigest(), 'size': size}
+    _manifest[filename] = entry
+    return entry
+
+
+def manifest_filename(output_dir: str) -> str:
+    return f'{output_dir}/manifest.json'
+
+
+# Data of the JSON files that runs save for the next run (the manifest and build state) keyed by filename, along with
+# the size and modification time of each file, so that repeated runs in the same process (see `watch`) don't have to
+# load them again
+_saved_json: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+
+
+def _file_stamp(filename: str) -> Tuple[int, int]:
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_json_state(filename: str, data: Any, compact: bool = False) -> None:
+    """Save JSON data for the next run (which must only contain JSON types, e.g. lists instead of tuples)."""
+    write_file_if_changed(filename, json_serializer.dumps(data, compact))
+    _saved_json[filename] = (_file_stamp(filename), data)
+
+
+def load_json_state(filename: str) -> Any:
+    """Load JSON data saved by a previous run (None if there is none).
+
+    If the data was saved by this process and the file hasn't changed since, the saved data is returned as is.
+    """
+    if not os.path.isfile(filename):
+        return None
+    saved = _saved_json.get(filename)
+    if saved is not None and saved[0] == _file_stamp(filename):
+        return saved[1]
+    with open(filename, 'rb') as infile:
+        return json_serializer.loads(infile.read())
+
+
+def load_manifest(output_dir: str) -> None:
+    """Load the manifest of files written into the output directory by a previous run."""
+    global _manifest
+    _manifest = {}
+    manifest = load_json_state(manifest_filename(output_dir))
+    if manifest is None or manifest.get('version') != MANIFEST_VERSION:
+        return
+    _manifest = {f'{output_dir}/{path}': entry for path, entry in manifest['files'].items()}
+
+
+def save_manifest(output_dir: str) -> None:
+    """Save manifest listing the content hash and size of every JSON file in the output directory."""
+    prefix = f'{output_dir}/'
+    files = {filename[len(prefix):]: entry for filename, entry in sorted(_manifest.items())
+        if filename.startswith(prefix) and os.path.exists(filename)}
+    save_json_state(manifest_filename(output_dir), {'version': MANIFEST_VERSION, 'files': files})
+
+
+def write_file_if_changed(filename: str, content: bytes) -> None:
+    """Write content to file, unless the file already contains exactly the same content."""
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as infile:
+            if infile.read() == content:
+                return
+    with open(filename, 'wb') as outfile:
+        outfile.write(content)
+
+
+def person_search_title(person: Dict[str, Any]) -> str:
+    return f'{person["firstName"]} {person["lastName"]}'
+
+
+def write_shards(
+        output_dir: str, shard_type: str, items: Iterable[Tuple[IDKey, Any]], max_bytes: int,
+        metadata: Optional[JSON] = None, format_data: Callable[[IDDict], Any] = lambda data: data
+    ) -> Tuple[List[Shard], Dict[str, int]]:
+    """Split a stream of data into shards of at most max_bytes and write each shard's JSON file as soon as it's complete.
+
+    Files are written by a `BackgroundWriter`, while the next shards are being extracted.
+
+    Parameters
+    ----------
+    items
+        Pairs of ids and the data to be stored for them, ordered by `id_sort_key`.
+    format_data
+        A function that converts the data of a shard (keyed by id) into the content of its file.
+
+    Returns
+    -------
+    A tuple containing the written shards and the sizes of the data of each id.
+    """
+    print(f'\nGenerating {output_dir}/{shard_type}/{shard_type}-xxx.json...')
+    shards: List[Shard] = []
+    sizes: Dict[str, int] = {}
+    sized_items = ((id, (data, record_size(id, data))) for id, data in items)
+    with BackgroundWriter() as writer:
+        for lower, upper, shard_items in shard_by_size(sized_items, lambda data_size: data_size[1], max_bytes):
+            shard: Shard = (lower, upper, [id for id, _ in shard_items])
+            writer.submit(write_json_file, shard_filename(output_dir, shard_type, shard),
+                format_data({id: data for id, (data, _) in shard_items}), metadata)
+            sizes.update((str(id), size) for id, (_, size) in shard_items)
+            shards.append(shard)
+            run_report.add_rows(len(shard_items))
+            print('*', end="", flush=True)
+    return shards, sizes
+
+
+def generate_json_serial(
+        db: FamilyData, output_dir: str, people_ids: List[IDKey], family_ids: Set[IDKey], metadata: Optional[JSON],
+        max_bytes: int = SHARD_MAX_BYTES
+    ) -> Tuple[Dict[IDKey, str], ShardPlan, RecordSizes]:
+    """Generate the people, families and facts JSON files.
+
+    Returns
+    -------
+    A tuple containing the search titles of all people, the shards of each type of data and the sizes of the
+    data of each id.
+    """
+    shards: ShardPlan = {}
+    sizes: RecordSizes = {}
+    sorted_people_ids = sorted(people_ids, key=id_sort_key)
+    with run_report.stage('people'):
+        people = db.get_people_data(sorted_people_ids)
+        shards['people'], sizes['people'] = write_shards(output_dir, 'people',
+            ((person_id, people[person_id]) for person_id in sorted_people_ids), max_bytes, metadata, format_records)
+        person_titles = {person_id: person_search_title(people[person_id]) for person_id in people_ids}
+
+    with run_report.stage('families'):
+        sorted_family_ids = sorted(family_ids, key=id_sort_key)
+        families = db.get_families_data(sorted_family_ids)
+        shards['families'], sizes['families'] = write_shards(output_dir, 'families',
+            ((family_id, families[family_id]) for family_id in sorted_family_ids), max_bytes, metadata,
+            format_records)
+
+    with run_report.stage('facts'):
+        shards['facts'], sizes['facts'] = write_shards(output_dir, 'facts', db.iter_facts(sorted_people_ids),
+            max_bytes, metadata)
+    return person_titles, shards, sizes
+
+
+def measure_sizes(db: FamilyData, shard_type: str, ids: List[IDKey]) -> Dict[str, int]:
+    """Get the sizes of the people, families or facts data of the given ids, which are needed to plan shards.
+
+    People without facts are left out of the sizes of facts.
+    """
+    if shard_type == 'people':
+        people = db.get_people_data(ids)
+        return {str(person_id): record_size(person_id, people[person_id]) for person_id in ids}
+    if shard_type == 'families':
+        families = db.get_families_data(ids)
+        return {str(family_id): record_size(family_id, families[family_id]) for family_id in ids}
+    return {str(person_id): record_size(person_id, facts) for person_id, facts in db.iter_facts(ids)}
+
+
+def measure_record_sizes(db: FamilyData, person_ids: List[IDKey], family_ids: List[IDKey]) -> RecordSizes:
+    """Get the sizes of the people, families and facts data of the given ids (see `measure_sizes`)."""
+    ids = {'people': person_ids, 'families': family_ids, 'facts': person_ids}
+    return {shard_type: measure_sizes(db, shard_type, ids[shard_type]) for shard_type in SHARD_TYPES}
+
+
+# A JSON file to generate: (filename, ids of data to store in file, metadata)
+FileTask = Tuple[str, List[IDKey], Optional[JSON]]
+# Result of generating a JSON file: (filename, manifest entry (None if no file), search titles of people in file)
+FileResult = Tuple[str, Optional[ManifestEntry], List[Tuple[IDKey, str]]]
+# Files to generate for each type of data: "people", "families" and "facts"
+FileTasks = Dict[str, List[FileTask]]
+
+# Data source used by worker processes (see `generate_files`)
+_worker_db: Optional[FamilyData] = None
+
+
+def _init_worker(
+        open_db: Optional[Callable[[], FamilyData]], manifest: Dict[str, ManifestEntry], output_format: OutputFormat,
+        report_queries: Optional[Dict[str, str]] = None
+    ) -> None:
+    """Open a separate connection to the data source in each worker, unless one was inherited by forking.
+
+    If the run is being reported on, each worker reports its queries (by the given query constants) in a report of
+    its own, which is handed back with the result of each task (see `_run_worker_task`).
+    """
+    global _worker_db, _manifest
+    if report_queries is not None:
+        # started before opening the data source, which only reports queries if a report has been started
+        run_report.start_report(report_queries)
+    if open_db is not None:
+        _worker_db = open_db()
+    _manifest = manifest
+    set_output_format(**output_format)
+
+
+def _generate_people_file(filename: str, person_ids: List[IDKey], metadata: Optional[JSON]) -> FileResult:
+    """Generate a people JSON file and return the search titles of the people in it."""
+    assert _worker_db is not None
+    people = _worker_db.get_people_data(person_ids)
+    entry = write_json_file(filename, format_records({person_id: people[person_id] for person_id in person_ids}), metadata)
+    return filename, entry, [(person_id, person_search_title(people[person_id])) for person_id in person_ids]
+
+
+def _generate_families_file(filename: str, family_ids: List[IDKey], metadata: Optional[JSON]) -> FileResult:
+    """Generate a families JSON file."""
+    assert _worker_db is not None
+    families = _worker_db.get_families_data(family_ids)
+    entry = write_json_file(filename, format_records({family_id: families[family_id] for family_id in family_ids}), metadata)
+    return filename, entry, []
+
+
+def _generate_facts_file(filename: str, person_ids: List[IDKey], metadata: Optional[JSON]) -> FileResult:
+    """Generate a facts JSON file if any of the people have facts (otherwise remove any existing file)."""
+    assert _worker_db is not None
+    facts: IDDict = dict(_worker_db.iter_facts(person_ids))
+    if len(facts) > 0:
+        return filename, write_json_file(filename, facts, metadata), []
+    remove_json_file(filename)
+    return filename, None, []
+
+
+def _measure_sizes(shard_type: str, ids: List[IDKey]) -> Dict[str, int]:
+    """Measure the data of some ids in a worker process (see `measure_sizes`)."""
+    assert _worker_db is not None
+    return measure_sizes(_worker_db, shard_type, ids)
+
+
+def write_search_index(output_dir: str, person_titles: Dict[IDKey, str], metadata: Optional[JSON] = None) -> None:
+    """Write the person search index and the files of its prefixes (see `search_index`)."""
+    print(f'\nSaving {output_dir}/search-index.json for {len(person_titles)} ids...')
+    index, files = build_search_index(person_titles)
+    with BackgroundWriter() as writer:
+        for filename, people in files.items():
+            writer.submit(write_json_file, f'{output_dir}/search/{filename}', people)
+    # remove files of prefixes that are no longer used, along with the search file of previous versions
+    for filename in glob.glob(f'{output_dir}/search/search-*.json') + [f'{output_dir}/person-search.json']:
+        if os.path.basename(filename) not in files and os.path.exists(filename):
+            remove_json_file(filename)
+    write_json_file(f'{output_dir}/search-index.json', index, metadata)
+
+
+def get_file_tasks(output_dir: str, shards: ShardPlan, metadata: Optional[JSON]) -> FileTasks:
+    """Get the people, families and facts JSON files to generate for the given shards."""
+    return {shard_type: [(shard_filename(output_dir, shard_type, shard), shard[2], metadata) for shard in type_shards]
+        for shard_type, type_shards in shards.items()}
+
+
+def write_shard_index(
+        output_dir: str, shards: ShardPlan, focus_person_id: Optional[str] = None,
+        link_legend: Optional[Dict[str, List[Any]]] = None, metadata: Optional[JSON] = None
+    ) -> None:
+    """Write the id range of every sharded file, which the website uses to locate the file of an id.
+
+    Each range is listed along with the version of its file (the start of its content hash, or null if there is no
+    file), which the website adds to the URL of the file, so that files can be cached until their content changes
+    (see `site_server`). The index also contains the id of the focus person, whom the website describes relationships to, and if
+    family links are sharded, the legend of the roles and family types in them.
+    """
+    index: Dict[str, Any] = {'version': SHARD_INDEX_VERSION, 'focusPersonId': focus_person_id}
+    if link_legend is not None:
+        index['linkLegend'] = link_legend
+    for shard_type, type_shards in shards.items():
+        index[shard_type] = []
+        for shard in type_shards:
+            entry = _manifest.get(shard_filename(output_dir, shard_type, shard))
+            index[shard_type].append([shard[0], shard[1], None if entry is None else entry['hash'][:SHARD_VERSION_DIGITS]])
+    write_json_file(f'{output_dir}/shard-index.json', index, metadata)
+
+
+def remove_stale_shard_files(output_dir: str, shards: ShardPlan) -> None:
+    """Remove people, families and facts files that aren't part of the given shards (e.g. from previous builds)."""
+    for shard_type, type_shards in shards.items():
+        filenames = {shard_filename(output_dir, shard_type, shard) for shard in type_shards}
+        for filename in glob.glob(f'{output_dir}/{shard_type}/{shard_type}-*.json'):
+            if filename not in filenames:
+                remove_json_file(filename)
+
+
+def generate_files(
+        db: FamilyData, tasks: FileTasks, jobs: int = 1, open_db: Optional[Callable[[], FamilyData]] = None
+    ) -> Dict[IDKey, str]:
+    """Generate the people, families and facts JSON files of the given tasks, with a pool of worker processes if jobs > 1.
+
+    Parameters
+    ----------
+    db
+        Data source that is shared with workers if they are forked and `open_db` is not specified.
+    tasks
+        Files to generate.
+    jobs
+        Number of worker processes.
+    open_db
+        A function that each worker uses to open its own connection to the data source.
+
+    Returns
+    -------
+    The search titles of all people in the generated people files.
+    """
+    global _worker_db
+    _worker_db = db
+    print(f'\nGenerating {len(tasks["people"])} people, {len(tasks["families"])} families and {len(tasks["facts"])}'
+        f' facts files with {jobs} processes...')
+    if jobs <= 1 or not any(tasks.values()):
+        results: List[FileResult] = []
+        for shard_type, generate_file in GENERATE_FILE_FUNCTIONS.items():
+            with run_report.stage(shard_type):
+                results.extend(generate_file(*task) for task in tasks[shard_type])
+                run_report.add_rows(sum(len(ids) for _, ids, _ in tasks[shard_type]))
+    else:
+        with _worker_pool(jobs, open_db) as pool:
+            results = _generate_files_in_pool(pool, tasks)
+    return _merge_file_results(results)
+
+
+# Functions that generate a file of each type of data
+GENERATE_FILE_FUNCTIONS: Dict[str, Callable[[str, List[IDKey], Optional[JSON]], FileResult]] = {
+    'people': _generate_people_file,
+    'families': _generate_families_file,
+    'facts': _generate_facts_file,
+}
+
+
+def _generate_files_in_pool(pool: Any, tasks: FileTasks) -> List[FileResult]:
+    """Generate the files of the given tasks in worker processes (see `_worker_pool`)."""
+    # files of all types are generated at the same time, so they're only reported on as a whole
+    with run_report.stage('files'):
+        results_async = [_start_worker_tasks(pool, generate_file, tasks[shard_type])
+            for shard_type, generate_file in GENERATE_FILE_FUNCTIONS.items()]
+        results = [result for result_async in results_async for result in _worker_task_results(result_async)]
+        run_report.add_rows(sum(len(ids) for type_tasks in tasks.values() for _, ids, _ in type_tasks))
+        run_report.add_bytes(_written_bytes(results))
+    return results
+
+
+def _worker_pool(jobs: int, open_db: Optional[Callable[[], FamilyData]]) -> Any:
+    """Start worker processes, which are forked where possible so that they inherit the data source."""
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    report = run_report.get_report()
+    return context.Pool(jobs, initializer=_init_worker,
+        initargs=(open_db, _manifest, _output_format, None if report is None else report.query_constants))
+
+
+def _run_worker_task(function: Callable[..., Any], *args: Any) -> Tuple[Any, Dict[str, Dict[str, Any]]]:
+    """Run a task in a worker process and return its result along with the queries that it ran."""
+    result = function(*args)
+    return result, run_report.pop_queries()
+
+
+def _start_worker_tasks(pool: Any, function: Callable[..., Any], tasks: Iterable[Tuple[Any, ...]]) -> Any:
+    """Start calling a function with the arguments of each task in worker processes."""
+    return pool.starmap_async(_run_worker_task, [(function, *task) for task in tasks])
+
+
+def _worker_task_results(result_async: Any) -> List[Any]:
+    """Wait for the results of tasks started by `_start_worker_tasks`, adding the queries they ran to the report."""
+    results = []
+    for result, queries in result_async.get():
+        run_report.merge_queries(queries)
+        results.append(result)
+    return results
+
+
+def _written_bytes(results: List[FileResult]) -> int:
+    """Get the number of bytes of the files that worker processes have (re)written."""
+    return sum(entry['size'] for filename, entry, _ in results if entry is not None and entry != _manifest.get(filename))
+
+
+def _merge_file_results(results: List[FileResult]) -> Dict[IDKey, str]:
+    """Add the files generated by worker processes to the manifest and return the search titles of their people."""
+    titles: Dict[IDKey, str] = {}
+    for filename, entry, file_titles in results:
+        if entry is None:
+            _manifest.pop(filename, None)
+        else:
+            _manifest[filename] = entry
+        titles.update(file_titles)
+    return titles
+
+
+# Number of id ranges per worker process that `generate_json_parallel` splits each type of data into to measure it,
+# so that workers that finish early can take over ranges from the others
+RANGES_PER_JOB = 4
+
+
+def split_id_ranges(sorted_ids: List[IDKey], count: int) -> List[List[IDKey]]:
+    """Split ids ordered by `id_sort_key` into at most count ranges of about the same number of ids.
+
+    Ids with the same numeric id are kept in the same range, like they are kept in the same shard.
+    """
+    ranges: List[List[IDKey]] = []
+    range_ids: List[IDKey] = []
+    range_size = max(-(-len(sorted_ids) // max(count, 1)), 1)
+    for _, group in itertools.groupby(sorted_ids, key=numeric_id):
+        if len(range_ids) >= range_size:
+            ranges.append(range_ids)
+            range_ids = []
+        range_ids.extend(group)
+    if len(range_ids) > 0:
+        ranges.append(range_ids)
+    return ranges
+
+
+def generate_json_parallel(
+        db: FamilyData, output_dir: str, people_ids: List[IDKey], family_ids: Set[IDKey], metadata: Optional[JSON],
+        max_bytes: int = SHARD_MAX_BYTES, jobs: int = 2, open_db: Optional[Callable[[], FamilyData]] = None
+    ) -> Tuple[Dict[IDKey, str], ShardPlan, RecordSizes]:
+    """Generate the people, families and facts JSON files with a pool of worker processes.
+
+    The workers first measure the data of consecutive ranges of ids, from which shards are planned in the same way
+    as `generate_json_serial` splits data into shards (so the files are the same regardless of the number of
+    workers). The workers then generate the files of the planned shards.
+
+    Returns
+    -------
+    The same as `generate_json_serial`.
+    """
+    global _worker_db
+    _worker_db = db
+    sorted_ids = {'people': sorted(people_ids, key=id_sort_key), 'families': sorted(family_ids, key=id_sort_key)}
+    sorted_ids['facts'] = sorted_ids['people']
+    with _worker_pool(jobs, open_db) as pool:
+        with run_report.stage('plan'):
+            print(f"Measuring data to plan files with {jobs} processes...")
+            sizes_async = {shard_type: _start_worker_tasks(pool, _measure_sizes, [(shard_type, ids)
+                for ids in split_id_ranges(sorted_ids[shard_type], jobs * RANGES_PER_JOB)])
+                for shard_type in SHARD_TYPES}
+            sizes: RecordSizes = {shard_type: {id: size for range_sizes in _worker_task_results(result_async)
+                for id, size in range_sizes.items()} for shard_type, result_async in sizes_async.items()}
+            shards = {shard_type: plan_shards(sorted_ids[shard_type], sizes[shard_type], max_bytes)
+                for shard_type in SHARD_TYPES}
+            run_report.add_rows(sum(len(type_sizes) for type_sizes in sizes.values()))
+        tasks = get_file_tasks(output_dir, shards, metadata)
+        print(f'\nGenerating {len(tasks["people"])} people, {len(tasks["families"])} families and '
+            f'{len(tasks["facts"])} facts files with {jobs} processes...')
+        results = _generate_files_in_pool(pool, tasks)
+    return _merge_file_results(results), shards, sizes
+
+
+BUILD_STATE_VERSION = 7
+
+
+def build_state_filename(output_dir: str) -> str:
+    return f'{output_dir}/.build-state.json'
+
+
+def load_build_state(output_dir: str, max_bytes: int) -> Optional[Dict[str, Any]]:
+    """Load the state saved by a previous build, if it exists and was made with the same settings."""
+    state: Optional[Dict[str, Any]] = load_json_state(build_state_filename(output_dir))
+    if state is None or state.get('version') != BUILD_STATE_VERSION or state.get('shardMaxBytes') != max_bytes or \
+            state.get('outputFormat') != _output_format:
+        return None
+    return state
+
+
+def save_build_state(
+        output_dir: str, max_bytes: int, focus_person_id: Optional[str], sharded_links: bool,
+        update_stamps: Dict[IDKey, Any], person_titles: Dict[IDKey, str], links: FamilyLinks, shards: ShardPlan,
+        sizes: RecordSizes
+    ) -> None:
+    """Save the state required to determine which files are affected by changes made before the next build."""
+    state = {
+        'version': BUILD_STATE_VERSION,
+        'shardMaxBytes': max_bytes,
+        'outputFormat': dict(_output_format),
+        'focusPersonId': focus_person_id,
+        'shardedLinks': sharded_links,
+        'people': {str(person_id): [update_stamps.get(person_id), title] for person_id, title in person_titles.items()},
+        'links': links,
+        'shards': {
+            shard_type: [[lower, upper, [str(id) for id in ids]] for lower, upper, ids in type_shards]
+            for shard_type, type_shards in shards.items()
+        },
+        # sorted so that the state of an unchanged build is identical (family ids come from a set)
+        'sizes': {shard_type: dict(sorted(type_sizes.items())) for shard_type, type_sizes in sizes.items()},
+    }
+    save_json_state(build_state_filename(output_dir), state, compact=True)
+
+
+def get_family_members(family_links: FamilyLinks) -> Dict[str, List[Tuple[str, Any]]]:
+    """Get the members (and their roles) of all families used in family links object."""
+    members: Dict[str, List[Tuple[str, Any]]] = defaultdict(list)
+    for person_id, links in family_links.items():
         for link in links:
-            families[link[0]].add((pid, link[1]))
+            members[str(link[0])].append((str(person_id), link[1]))
+    return {family_id: sorted(family) for family_id, family in members.items()}
+
 
-    dd_set = get_direct_antecedents(focus_person_id, family_links, families)
-    dd_list = sorted(list(dd_set), key=lambda val: val[0])
+def get_changed_ids(state: Dict[str, Any], update_stamps: Dict[IDKey, Any], links: FamilyLinks) -> Dict[str, Set[str]]:
+    """Get the ids of the people, families and facts that changed since the build that saved the given state.
 
-    antecedents: Dict[Any, List[int]] = defaultdict(list)
-    for desc in dd_list:
-        antecedents[desc[1]].append(desc[0])
+    People have changed if they've been added, removed or updated, and families have changed if their members
+    have changed or if any of their members has changed.
+    """
+    previous_people = state['people']
+    person_ids = {str(person_id) for person_id in links}
+    changed_people = {person_id for person_id in person_ids if person_id not in previous_people}
+    changed_people.update(person_id for person_id in previous_people if person_id not in person_ids)
+    for person_id, stamp in update_stamps.items():
+        if str(person_id) in previous_people and previous_people[str(person_id)][0] != stamp:
+            changed_people.add(str(person_id))
+
+    previous_members = get_family_members(state['links'])
+    members = get_family_members(links)
+    changed_families = {family_id for family_id in set(previous_members) | set(members)
+        if previous_members.get(family_id) != members.get(family_id)}
+    for family_members in [previous_members, members]:
+        for family_id, family in family_members.items():
+            if any(person_id in changed_people for person_id, _ in family):
+                changed_families.add(family_id)
+
+    return {'people': changed_people, 'families': changed_families, 'facts': changed_people}
+
+
+def plan_changed_shards(
+        db: FamilyData, state: Dict[str, Any], changed_ids: Dict[str, Set[str]], people_ids: List[IDKey],
+        family_ids: Set[IDKey], max_bytes: int
+    ) -> Tuple[ShardPlan, RecordSizes]:
+    """Plan shards based on the shards of the build that saved the given state, only measuring the changed data.
+
+    Returns
+    -------
+    A tuple containing the shards of each type of data and the sizes of the data of each id.
+    """
+    ids = {'people': people_ids, 'families': list(family_ids), 'facts': people_ids}
+    changed_sizes = measure_record_sizes(db,
+        [person_id for person_id in people_ids if str(person_id) in changed_ids['people']],
+        [family_id for family_id in family_ids if str(family_id) in changed_ids['families']])
+    shards: ShardPlan = {}
+    sizes: RecordSizes = {}
+    for shard_type in SHARD_TYPES:
+        type_sizes = {id: size for id, size in state['sizes'][shard_type].items() if id not in changed_ids[shard_type]}
+        type_sizes.update(changed_sizes[shard_type])
+        sizes[shard_type] = {str(id): type_sizes[str(id)] for id in ids[shard_type] if str(id) in type_sizes}
+        previous = [(lower, upper) for lower, upper, _ in state['shards'][shard_type]]
+        shards[shard_type] = plan_shards(ids[shard_type], sizes[shard_type], max_bytes, previous)
+    return shards, sizes
+
+
+def get_changed_file_tasks(
+        output_dir: str, tasks: FileTasks, state: Dict[str, Any], changed_ids: Dict[str, Set[str]]
+    ) -> FileTasks:
+    """Select the files that have to be regenerated due to changes since the build that saved the given state.
+
+    A file has to be regenerated when the ids it contains have changed or when any of those ids has changed.
+    """
+    changed_tasks: FileTasks = {}
+    for file_type, file_tasks in tasks.items():
+        previous_files = {shard_filename(output_dir, file_type, (lower, upper, ids)): ids
+            for lower, upper, ids in state['shards'][file_type]}
+        changed_tasks[file_type] = []
+        for task in file_tasks:
+            ids = [str(id) for id in task[1]]
+            if previous_files.get(task[0]) != ids or any(id in changed_ids[file_type] for id in ids):
+                changed_tasks[file_type].append(task)
+    return changed_tasks
+
+
+def get_parents(family_links: FamilyLinks) -> Dict[str, List[str]]:
+    """Get the parents of each person that is a child in exactly one family."""
+    members = get_family_members(family_links)
+    parents = {}
+    for person_id, links in family_links.items():
+        parent_family_ids = [link[0] for link in links if "child" in link[1]]
+        if len(parent_family_ids) == 1:
+            parents[str(person_id)] = [pid for pid, role in members[str(parent_family_ids[0])] if not "child" in role]
+    return parents
+
+
+def get_antecedents(focus_person_id: str, family_links: FamilyLinks) -> Dict[str, List[int]]:
+    """Antecedents are predecessors in a family line (for which the focus person is a descendant).
+
+    Returns
+    -------
+    The generations (e.g. 1 for parents and 2 for grandparents) of each antecedent, which are more than one if
+    the antecedent is a predecessor through multiple family lines.
+    """
+    focus_person_id = str(focus_person_id)
+    parents = get_parents(family_links)
+    # count the children of each antecedent that are antecedents (or the focus person)
+    child_counts: Dict[str, int] = defaultdict(int)
+    stack = [focus_person_id]
+    visited = {focus_person_id}
+    while len(stack) > 0:
+        for parent in parents.get(stack.pop(), []):
+            if parent == focus_person_id:
+                continue
+            child_counts[parent] += 1
+            if parent not in visited:
+                visited.add(parent)
+                stack.append(parent)
+
+    # visit antecedents once all their children have been visited, so that the generations of every antecedent
+    # are only determined once (antecedents of a family line with a cycle are never visited)
+    generations: Dict[str, Set[int]] = {focus_person_id: {0}}
+    antecedents: Dict[str, List[int]] = {}
+    stack = [focus_person_id]
+    while len(stack) > 0:
+        person_id = stack.pop()
+        person_generations = generations.pop(person_id)
+        if person_id != focus_person_id:
+            antecedents[person_id] = sorted(person_generations)
+        for parent in parents.get(person_id, []):
+            if parent == focus_person_id:
+                continue
+            generations.setdefault(parent, set()).update(generation + 1 for generation in person_generations)
+            child_counts[parent] -= 1
+            if child_counts[parent] == 0:
+                stack.append(parent)
+    skipped = len(visited) - 1 - len(antecedents)
+    if skipped > 0:
+        print(f'Skipped {skipped} antecedents of {focus_person_id} in family lines with cycles')
     return antecedents
 
 
-def generate_json(db: FamilyData, output_dir: str = 'data', source_file: Optional[str] = None, focus_person_id: Optional[str] = None) -> None:
-    last_updated = db.get_last_updated_date()
-    metadata = {
-        "generated_at": datetime.now().replace(microsecond=0).isoformat(),
-        # "source": source_file
-        "source_updated_at": last_updated.isoformat(),
+def get_link_legend(family_links: FamilyLinks) -> Dict[str, List[Any]]:
+    """Get all roles and family types used in family links, the indexes of which are used to encode them.
+
+    Family types are only included in links of Gramps XML files (which are either "child" or "parent").
+    """
+    return {
+        'roles': sorted({link[1] for links in family_links.values() for link in links}),
+        'types': sorted({link[2] for links in family_links.values() for link in links if len(link) > 2}),
     }
-    print("Metadata:", metadata)
-
-    print("Extracting family-link data...")
-    links = db.get_all_family_links()
-    people_ids = get_persons_in_family_links(links)
-    family_ids = get_families_in_family_links(links)
-    # get direct antecedents for a specific person
-    if focus_person_id is not None:
-        antecedents = cast(Dict[IDKey, Union[List[int],Any]], get_antecedents(focus_person_id, links))
-        print(f'Saving {output_dir}/antecedents_{focus_person_id}.json for {len(antecedents)} ids...')
-        with open(f'{output_dir}/antecedents_{focus_person_id}.json', 'w') as outfile:
-            antecedents["metadata"] = metadata
-            json.dump(antecedents, outfile)
-
-    print(f'Saving {output_dir}/family-links.json for {len(links)} ids...')
-    with open(f'{output_dir}/family-links.json', 'w') as outfile:
-        # links = cast(IDDict, links)
-        links["metadata"] = metadata  # type: ignore
-        json.dump(links, outfile)
-
-    people_data = generate_split_json(f'{output_dir}/people/people-', people_ids,
-        lambda person_id: db.get_person_data(person_id),
-        person_json_div_size, metadata
-    )
-
-    person_search = []
-    for person_id, person in people_data.items():
-        person_title = f'{person["firstName"]} {person["lastName"]}'
-        person_search.append([person_id, person_title])
-    with open(f'{output_dir}/person-search.json', 'w') as outfile:
-        json.dump(person_search, outfile)
-
-    family_data = generate_split_json(f'{output_dir}/families/families-', family_ids,
-        lambda family_id: db.get_family_data(family_id),
-        family_json_div_size, metadata
-    )
-
-    facts = db.get_facts(people_ids)    
-    facts_data = generate_split_json(f'{output_dir}/facts/facts-', sorted(list(facts.keys())),
-        lambda fact_id: facts[str(fact_id)],
-        fact_json_div_size, metadata
-    )
+
+
+def encode_sharded_links(family_links: FamilyLinks, legend: Dict[str, List[Any]]) -> Dict[str, List[List[Any]]]:
+    """Encode family links for sharding, with roles and family types replaced by their index in the legend.
+
+    Returns
+    -------
+    The links of each person ([family id, role] or [family id, role, family type]).
+    """
+    roles = {role: idx for idx, role in enumerate(legend['roles'])}
+    types = {family_type: idx for idx, family_type in enumerate(legend['types'])}
+    return {str(person_id): [[link[0], roles[link[1]], *(types[value] for value in link[2:])] for link in links]
+        for person_id, links in family_links.items()}
+
+
+def get_ancestor_tables(
+        family_links: FamilyLinks, max_generations: int = KINSHIP_MAX_GENERATIONS
+    ) -> Dict[str, Dict[str, int]]:
+    """Get the ancestors of every person up to max_generations back, along with their generation (1 for parents).
+
+    The relationship of two people follows from their nearest common ancestor in these tables (e.g. people that are
+    both 2 generations from a common ancestor are cousins), which can be found by only looking up both tables.
+    If an ancestor is an ancestor through multiple family lines, then the nearest generation is stored.
+
+    Tables are built from the tables of parents, so each person's parents are processed first. People in (or
+    descending from) a family line with a cycle are left out. People without known ancestors are left out as well.
+    """
+    parents = get_parents(family_links)
+    children: Dict[str, List[str]] = defaultdict(list)
+    parent_counts: Dict[str, int] = {}
+    for person_id, person_parents in parents.items():
+        parent_counts[person_id] = len(person_parents)
+        for parent in person_parents:
+            children[parent].append(person_id)
+
+    tables: Dict[str, Dict[str, int]] = {}
+    stack = [str(person_id) for person_id in family_links if parent_counts.get(str(person_id), 0) == 0]
+    processed = 0
+    while len(stack) > 0:
+        person_id = stack.pop()
+        processed += 1
+        table: Dict[str, int] = {}
+        for parent in parents.get(person_id, []):
+            table[parent] = 1
+            for ancestor, generation in tables.get(parent, {}).items():
+                if generation < max_generations and table.get(ancestor, max_generations) > generation:
+                    table[ancestor] = generation + 1
+        if len(table) > 0:
+            tables[person_id] = table
+        for child in children[person_id]:
+            parent_counts[child] -= 1
+            if parent_counts[child] == 0:
+                stack.append(child)
+    skipped = len(family_links) - processed
+    if skipped > 0:
+        print(f'Skipped ancestor tables of {skipped} people in family lines with cycles')
+    return tables
+
+
+def generate_json(
+        db: FamilyData, output_dir: str = 'data', source_file: Optional[str] = None, focus_person_id: Optional[str] = None,
+        jobs: int = 1, open_db: Optional[Callable[[], FamilyData]] = None, incremental: bool = False,
+        shard_max_bytes: int = SHARD_MAX_BYTES, sharded_links: bool = False
+    ) -> None:
+    """Generate all JSON files from the given data source.
+
+    Parameters
+    ----------
+    jobs
+        Number of worker processes used to generate the people, families and facts files.
+    open_db
+        A function that worker processes use to open their own connection to the data source.
+    incremental
+        Only regenerate files affected by changes to the data since the previous build into the same
+        output directory.
+    shard_max_bytes
+        Target size of the people, families and facts files.
+    sharded_links
+        Split family links into files by id (along with the members of each family) instead of writing a
+        single "family-links.json" file.
+    """
+    if jobs > 1 and open_db is None and 'fork' not in multiprocessing.get_all_start_methods():
+        # worker processes can only use the data source if they inherit it (see `_worker_pool`)
+        print(f"Warning: generating files in a single process instead of {jobs}, since worker processes can't be "
+            "forked on this platform to share the data source (use --cache to let them open it themselves)")
+        jobs = 1
+    with run_report.stage('metadata'):
+        last_updated = db.get_last_updated_date()
+        metadata = {
+            "generated_at": datetime.now().replace(microsecond=0).isoformat(),
+            # "source": source_file
+            "source_updated_at": last_updated.isoformat(),
+        }
+        print("Metadata:", metadata)
+
+        load_manifest(output_dir)
+        for folder in SHARD_TYPES + LINK_SHARD_TYPES + ['search']:
+            os.makedirs(f'{output_dir}/{folder}', exist_ok=True)
+
+    with run_report.stage('links'):
+        print("Extracting family-link data...")
+        links = db.get_all_family_links()
+        people_ids = get_persons_in_family_links(links)
+        family_ids = get_families_in_family_links(links)
+        update_stamps = db.get_update_stamps()
+        run_report.add_rows(len(links))
+
+        state = load_build_state(output_dir, shard_max_bytes) if incremental else None
+        if incremental and state is None:
+            print("No (compatible) state of previous build found: regenerating everything")
+        # links as they're stored in the build state, i.e. with JSON types
+        state_links = json_serializer.loads(json_serializer.dumps(links, compact=True)) if incremental else links
+        links_changed = state is None or state['links'] != state_links
+
+    # data derived from family links: antecedents of a specific person, ancestors of everyone and (if sharded)
+    # the links themselves
+    link_legend = get_link_legend(links) if sharded_links else None
+    link_data_changed = state is None or links_changed or state['focusPersonId'] != focus_person_id or \
+        state['shardedLinks'] != sharded_links
+    if link_data_changed:
+        def write_link_shards(shard_type: str, data: Dict[str, Any]) -> List[Shard]:
+            return write_shards(output_dir, shard_type, ((id, data[id]) for id in sorted(data, key=id_sort_key)),
+                shard_max_bytes, metadata)[0]
+
+        link_shards: ShardPlan = {}
+        with run_report.stage('antecedents'):
+            link_shards['antecedents'] = write_link_shards('antecedents',
+                {} if focus_person_id is None else get_antecedents(focus_person_id, links))
+        with run_report.stage('kinship'):
+            link_shards['kinship'] = write_link_shards('kinship', get_ancestor_tables(links))
+        with run_report.stage('links'):
+            link_shards['links'] = write_link_shards('links',
+                {} if link_legend is None else encode_sharded_links(links, link_legend))
+    else:
+        assert state is not None
+        link_shards = {shard_type: [(lower, upper, ids) for lower, upper, ids in state['shards'][shard_type]]
+            for shard_type in LINK_SHARD_TYPES}
+
+    with run_report.stage('links'):
+        if sharded_links:
+            remove_json_file(f'{output_dir}/family-links.json')
+        elif link_data_changed or not os.path.exists(f'{output_dir}/family-links.json'):
+            print(f'Saving {output_dir}/family-links.json for {len(links)} ids...')
+            write_json_file(f'{output_dir}/family-links.json', links, metadata, stream=True)
+
+    if state is not None:
+        with run_report.stage('plan'):
+            changed_ids = get_changed_ids(state, update_stamps, links)
+            shards, sizes = plan_changed_shards(db, state, changed_ids, people_ids, family_ids, shard_max_bytes)
+            tasks = get_file_tasks(output_dir, shards, metadata)
+            changed_tasks = get_changed_file_tasks(output_dir, tasks, state, changed_ids)
+            person_titles = {person_id: state['people'][str(person_id)][1] for person_id in people_ids
+                if str(person_id) in state['people']}
+        person_titles.update(generate_files(db, changed_tasks, jobs, open_db))
+        search_changed = links_changed or len(changed_ids['people']) > 0
+    elif jobs > 1:
+        person_titles, shards, sizes = generate_json_parallel(db, output_dir, people_ids, family_ids, metadata,
+            shard_max_bytes, jobs, open_db)
+        search_changed = True
+    else:
+        person_titles, shards, sizes = generate_json_serial(db, output_dir, people_ids, family_ids, metadata,
+            shard_max_bytes)
+        search_changed = True
+
+    if search_changed:
+        with run_report.stage('search'):
+            write_search_index(output_dir, {person_id: person_titles[person_id] for person_id in people_ids},
+                metadata)
+            run_report.add_rows(len(people_ids))
+
+    with run_report.stage('save'):
+        shards.update(link_shards)
+        remove_stale_shard_files(output_dir, {**shards, **{shard_type: [] for shard_type in REMOVED_SHARD_TYPES}})
+        write_shard_index(output_dir, shards, focus_person_id, link_legend, metadata)
+        save_build_state(output_dir, shard_max_bytes, focus_person_id, sharded_links, update_stamps, person_titles,
+            state_links, shards, sizes)
+        save_manifest(output_dir)
+
+
+# Page cache size of in-memory copies of databases (negative values are in KiB)
+SNAPSHOT_CACHE_SIZE = -256 * 1024
+# Maximum size of databases to memory-map while copying them
+SNAPSHOT_MMAP_SIZE = 1024 ** 3
+
+
+def open_ftb_db(data_path: str, in_memory: bool = False) -> FTBDB:
+    """Open an FTB database read-only.
+
+    Parameters
+    ----------
+    in_memory
+        Copy the database into memory (leaving the file untouched) and index the columns that queries join on.
+    """
+    sqlite_db_uri = pathlib.Path(os.path.realpath(data_path)).as_uri()
+    # Open database in read-only mode
+    sqlite_db_uri = sqlite_db_uri + '?mode=ro'
+    # report queries if the run is being reported on (see `run_report`)
+    factory = run_report.ReportingConnection if run_report.get_report() is not None else sql.Connection
+    conn = sql.connect(sqlite_db_uri, uri=True, factory=factory)
+    if in_memory:
+        conn.execute(f'PRAGMA mmap_size = {SNAPSHOT_MMAP_SIZE}')
+        snapshot = sql.connect(':memory:', factory=factory)
+        conn.backup(snapshot)
+        conn.close()
+        conn = snapshot
+        conn.execute(f'PRAGMA cache_size = {SNAPSHOT_CACHE_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        for statement in SNAPSHOT_INDEXES:
+            conn.execute(statement)
+    # Ignore unicode decoding errors
+    conn.text_factory = lambda b: b.decode(errors = 'ignore')
+    cursor = conn.cursor()
+    conn.row_factory = sql.Row
+    return FTBDB(cursor)
+
+
+def open_cached(
+        cache_path: Optional[Path], data_path: Path, source_format: str, open_source: Callable[[], FamilyData],
+        close_source: bool = True
+    ) -> FamilyData:
+    """Open a data source from its extraction cache, extracting it into the cache first if that's out of date.
+
+    Parameters
+    ----------
+    cache_path
+        Extraction cache file (see `extraction_cache`), or None to open the data source directly.
+    open_source
+        Function that opens the data source.
+    close_source
+        Close the data source after extracting it into the cache (unless it's kept open, see `WatchedSource`).
+    """
+    if cache_path is None:
+        return open_source()
+    cached = open_cache(str(cache_path), str(data_path), source_format)
+    if cached is None:
+        print(f'Extracting {data_path} into cache {cache_path}')
+        with run_report.stage('cache'):
+            source = open_source()
+            try:
+                write_cache(str(cache_path), source, str(data_path), source_format)
+            finally:
+                if close_source and isinstance(source, FTBDB):
+                    source.close()
+        cached = CachedFamilyData(str(cache_path))
+    return cached
+
+
+class ReportStage(str, Enum):
+    load = "load"
+    cache = "cache"
+    metadata = "metadata"
+    links = "links"
+    antecedents = "antecedents"
+    kinship = "kinship"
+    plan = "plan"
+    people = "people"
+    families = "families"
+    facts = "facts"
+    files = "files"
+    search = "search"
+    save = "save"
 
 
 class FormatType(str, Enum):
@@ -227,48 +1302,315 @@ class FormatType(str, Enum):
     gxml = "GXML"
 
 
-@app.command()
+def generate_from_file(
+        data_path: Path, format: FormatType, jobs: int = 1, incremental: bool = False, stream_xml: bool = False,
+        in_memory: bool = False, cache: Optional[Path] = None, shard_bytes: int = SHARD_MAX_BYTES,
+        shard_links: bool = False, open_source: Optional[Callable[[], FamilyData]] = None
+    ) -> None:
+    """Open a family data file and generate its JSON files (see `main` for the parameters).
+
+    Parameters
+    ----------
+    open_source
+        Function that opens the data file (or returns it if it's already open, see `WatchedSource`), instead of
+        opening it as specified by the other parameters.
+    """
+    if format == FormatType.ftb:
+        # db._list_all_people(cursor)
+        # db._detail_person(cursor, 1)
+        # if media_path:
+        #     media_check_files(cursor, media_path[0])
+        # print(db.get_person_data(cursor, 1))
+
+        open_db: Callable[[], FamilyData] = functools.partial(open_ftb_db, str(data_path), in_memory)
+        with run_report.stage('load'):
+            db = open_cached(cache, data_path, format.value, open_source or open_db, close_source=open_source is None)
+        if cache is not None:
+            open_db = functools.partial(CachedFamilyData, str(cache))
+        generate_json(db, 'data-xml', os.path.basename(data_path), focus_person_id='1',
+            jobs=jobs, open_db=open_db, incremental=incremental,
+            shard_max_bytes=shard_bytes, sharded_links=shard_links)
+
+    elif format == FormatType.gxml:
+        with run_report.stage('load'):
+            # the XML tree isn't kept, so that only the records converted from it take up memory
+            xml = open_cached(cache, data_path, format.value, open_source or functools.partial(open_gramps_xml,
+                data_path, stream_xml))
+        # workers share the parsed XML by being forked, but open the cache themselves
+        generate_json(xml, 'var/dxml', os.path.basename(data_path), focus_person_id='I0000', jobs=jobs,
+            open_db=None if cache is None else functools.partial(CachedFamilyData, str(cache)),
+            incremental=incremental, shard_max_bytes=shard_bytes, sharded_links=shard_links)
+
+
+def open_gramps_xml(data_path: Path, stream_xml: bool = False) -> GrampsXML:
+    return iterparse_xml(str(data_path)) if stream_xml else GrampsXML(load_xml(str(data_path)))
+
+
+def start_run_report(profile: Optional[ReportStage] = None) -> run_report.RunReport:
+    """Start reporting on a run, with the names of the FTB queries (see `run_report`)."""
+    ftb_query_constants = {name: value for name, value in vars(ftb_queries).items()
+        if name.startswith('QRY_') and isinstance(value, str)}
+    return run_report.start_report(ftb_query_constants, None if profile is None else profile.value)
+
+
+# Options shared by the commands that generate JSON files
+DATA_PATH_ARGUMENT = typer.Argument(...,
+    help="File containing family data.",
+    exists=True,
+    file_okay=True,
+    dir_okay=False
+)
+FORMAT_OPTION = typer.Option(..., case_sensitive=False)
+STREAM_XML_OPTION = typer.Option(False,
+    help="Incrementally parse XML and only keep the parts that are used (lowers peak memory usage)."
+)
+JOBS_OPTION = typer.Option(1,
+    help="Number of worker processes used to generate the people, families and facts files.",
+    min=1
+)
+COMPACT_JSON_OPTION = typer.Option(False,
+    help="Write JSON files without whitespace."
+)
+COMPRESS_OPTION = typer.Option(False,
+    help="Also write gzip-compressed copies of JSON files (and brotli-compressed copies if brotli is installed)."
+)
+COLUMNAR_OPTION = typer.Option(False,
+    help="Write people and families files in a compact columnar format."
+)
+SHARD_BYTES_OPTION = typer.Option(SHARD_MAX_BYTES,
+    help="Target size in bytes of the people, families and facts files.",
+    min=1024
+)
+SHARD_LINKS_OPTION = typer.Option(False,
+    help="Split family links into files by id (with roles encoded as numbers) instead of a single file."
+)
+IN_MEMORY_OPTION = typer.Option(False,
+    help="Copy FTB databases into memory and index them before querying (each worker process makes its own copy)."
+)
+WRITE_THREADS_OPTION = typer.Option(WRITER_THREADS,
+    help="Number of threads that write files in the background while data is extracted (0 to not use threads).",
+    min=0
+)
+CACHE_OPTION = typer.Option(None,
+    help="Read family data from this extraction cache, which is (re)created whenever the data file has changed.",
+    dir_okay=False
+)
+
+
+@app.command('generate')
 # @click.argument('data_path', default=None, nargs=1, type=click.Path(exists=True, dir_okay=False))
 def main(
-    data_path: Path = typer.Argument(...,
-        help="File containing family data.",
-        exists=True,
-        file_okay=True,
-        dir_okay=False
-    ),
-    format: FormatType = typer.Option(..., case_sensitive=False),
+    data_path: Path = DATA_PATH_ARGUMENT,
+    format: FormatType = FORMAT_OPTION,
     media_path: Optional[Path] = typer.Option(
         None,
         help="Directory containing media files.",
         exists=True,
         file_okay=False,
         dir_okay=True
+    ),
+    stream_xml: bool = STREAM_XML_OPTION,
+    jobs: int = JOBS_OPTION,
+    incremental: bool = typer.Option(False,
+        help="Only regenerate files affected by changes to people and families since the previous run."
+    ),
+    compact_json: bool = COMPACT_JSON_OPTION,
+    compress: bool = COMPRESS_OPTION,
+    columnar: bool = COLUMNAR_OPTION,
+    shard_bytes: int = SHARD_BYTES_OPTION,
+    shard_links: bool = SHARD_LINKS_OPTION,
+    in_memory: bool = IN_MEMORY_OPTION,
+    write_threads: int = WRITE_THREADS_OPTION,
+    cache: Optional[Path] = CACHE_OPTION,
+    report: Optional[Path] = typer.Option(None,
+        help="Write a JSON report of the time, queries, records, bytes written and memory used by each stage.",
+        dir_okay=False
+    ),
+    profile: Optional[ReportStage] = typer.Option(None,
+        help="Profile a stage with cProfile and write its stats next to the report (or to <stage>.prof).",
+        case_sensitive=False
     )) -> None:
     """Extract individual, family and fact data to JSON."""
+    set_output_format(compact=compact_json, compress=compress, columnar=columnar)
+    set_writer_threads(write_threads)
+    if report is not None or profile is not None:
+        start_run_report(profile)
 
-    if format == FormatType.ftb:
-        sqlite_db_uri = pathlib.Path(os.path.realpath(data_path)).as_uri()
-        # Open database in read-only mode
-        sqlite_db_uri = sqlite_db_uri + '?mode=ro'
-        conn = sql.connect(sqlite_db_uri, uri=True)
-        # Ignore unicode decoding errors
-        conn.text_factory = lambda b: b.decode(errors = 'ignore')
-        cursor = conn.cursor()
-        conn.row_factory = sql.Row
+    generate_from_file(data_path, format, jobs, incremental, stream_xml, in_memory, cache, shard_bytes, shard_links)
 
-        # db._list_all_people(cursor)
-        # db._detail_person(cursor, 1)
-        # if media_path:
-        #     media_check_files(cursor, media_path[0])
-        # print(db.get_person_data(cursor, 1))
+    run = run_report.get_report()
+    if run is not None:
+        print('\n' + run.summary())
+        if report is not None:
+            run.save(str(report))
+        if profile is not None:
+            profile_filename = f'{os.path.splitext(report)[0]}-{profile.value}.prof' if report is not None \
+                else f'{profile.value}.prof'
+            run.save_profile(profile_filename)
+            print(f'Saved profile of {profile.value} stage to {profile_filename}')
+
+
+# Files of an FTB database that SQLite may write changes to before writing them to the database file itself
+SQLITE_JOURNAL_SUFFIXES = ['-wal', '-journal']
+# Time in seconds to wait between checking whether a data file has changed
+WATCH_INTERVAL = 0.5
+# Time in seconds that a data file must not have changed before its JSON files are regenerated
+WATCH_DEBOUNCE = 1.0
 
-        db = FTBDB(cursor)
-        generate_json(db, 'data-xml', os.path.basename(data_path), focus_person_id='1')
+# Size and modification time of a data file and its journal files (None if a file doesn't exist)
+SourceStamp = List[Optional[Tuple[int, int]]]
+
+
+def get_source_stamp(data_path: Path) -> SourceStamp:
+    stamp: SourceStamp = []
+    for path in [str(data_path)] + [f'{data_path}{suffix}' for suffix in SQLITE_JOURNAL_SUFFIXES]:
+        try:
+            stamp.append(_file_stamp(path))
+        except FileNotFoundError:
+            stamp.append(None)
+    return stamp
+
+
+def wait_for_change(data_path: Path, previous: SourceStamp, interval: float, debounce: float) -> float:
+    """Wait until a data file has changed, and then until it hasn't changed for `debounce` seconds.
+
+    Returns
+    -------
+    The time (from `time.perf_counter()`) at which the change was noticed.
+    """
+    stamp = previous
+    while stamp == previous:
+        time.sleep(interval)
+        stamp = get_source_stamp(data_path)
+    changed_at = time.perf_counter()
+    print(f'\n{data_path} changed, waiting until it has been unchanged for {debounce}s...')
+    unchanged_since = changed_at
+    while time.perf_counter() - unchanged_since < debounce:
+        time.sleep(min(interval, debounce))
+        latest = get_source_stamp(data_path)
+        if latest != stamp:
+            stamp, unchanged_since = latest, time.perf_counter()
+    return changed_at
+
+
+class WatchedSource:
+    """Data source of a watched data file, which is kept open between runs instead of being opened for every run.
+
+    FTB databases stay connected (unless they're copied into memory, in which case the copy has to be made
+    again), and only the places loaded from them are read again. Gramps XML files are only parsed again if their
+    content has changed, otherwise the records of the previous run are reused.
+    """
 
-    if format == FormatType.gxml:
-        root = load_xml(str(data_path))
-        xml = GrampsXML(root)
-        generate_json(xml, 'var/dxml', os.path.basename(data_path), focus_person_id='I0000')
+    def __init__(self, data_path: Path, format: FormatType, stream_xml: bool = False, in_memory: bool = False) -> None:
+        self.data_path = data_path
+        self.format = format
+        self.stream_xml = stream_xml
+        self.in_memory = in_memory
+        self.source: Optional[FamilyData] = None
+        # size and hash of the Gramps XML file that the source was parsed from
+        self.fingerprint: Optional[Tuple[int, str]] = None
+
+    def open(self) -> FamilyData:
+        if self.format == FormatType.ftb:
+            if isinstance(self.source, FTBDB) and not self.in_memory:
+                self.source.reset()
+            else:
+                if isinstance(self.source, FTBDB):
+                    # free the in-memory copy of the previous run before copying the database again
+                    self.source.close()
+                self.source = open_ftb_db(str(self.data_path), self.in_memory)
+            return self.source
+        fingerprint = (os.path.getsize(self.data_path), file_hash(str(self.data_path)))
+        if self.source is None or fingerprint != self.fingerprint:
+            # the previous records are dropped before parsing, so that they don't take up memory at the same time
+            self.source = None
+            self.source = open_gramps_xml(self.data_path, self.stream_xml)
+            self.fingerprint = fingerprint
+        else:
+            print(f'{self.data_path} is unchanged, reusing its records')
+        return self.source
+
+
+@app.command()
+def watch(
+    data_path: Path = DATA_PATH_ARGUMENT,
+    format: FormatType = FORMAT_OPTION,
+    interval: float = typer.Option(WATCH_INTERVAL,
+        help="Seconds between checks of whether the data file has changed.",
+        min=0.01
+    ),
+    debounce: float = typer.Option(WATCH_DEBOUNCE,
+        help="Seconds that the data file must have been unchanged before regenerating files.",
+        min=0
+    ),
+    stream_xml: bool = STREAM_XML_OPTION,
+    jobs: int = JOBS_OPTION,
+    compact_json: bool = COMPACT_JSON_OPTION,
+    compress: bool = COMPRESS_OPTION,
+    columnar: bool = COLUMNAR_OPTION,
+    shard_bytes: int = SHARD_BYTES_OPTION,
+    shard_links: bool = SHARD_LINKS_OPTION,
+    in_memory: bool = IN_MEMORY_OPTION,
+    write_threads: int = WRITE_THREADS_OPTION,
+    cache: Optional[Path] = CACHE_OPTION,
+    report: Optional[Path] = typer.Option(None,
+        help="Write a JSON report of the time, queries, records, bytes written and memory used by each stage of "
+            "the latest run.",
+        dir_okay=False
+    )) -> None:
+    """Regenerate the JSON files whenever the data file changes, until interrupted.
+
+    Each run is incremental, so only files affected by the changes are regenerated. The data source (see
+    `WatchedSource`) and the build state and manifest of the previous run are kept in memory instead of being
+    loaded again.
+    """
+    set_output_format(compact=compact_json, compress=compress, columnar=columnar)
+    set_writer_threads(write_threads)
+    source = WatchedSource(data_path, format, stream_xml, in_memory)
+    changed_at = time.perf_counter()
+    try:
+        for cycle in itertools.count(1):
+            # taken before the data is read, so that changes made while files are generated start another run
+            stamp = get_source_stamp(data_path)
+            start = time.perf_counter()
+            run = start_run_report()
+            try:
+                generate_from_file(data_path, format, jobs, incremental=True, stream_xml=stream_xml,
+                    in_memory=in_memory, cache=cache, shard_bytes=shard_bytes, shard_links=shard_links,
+                    open_source=source.open)
+            except Exception as error:
+                # e.g. the data file was read while it was being written, in which case it's read again once it
+                # changes again
+                print(f'\nRun {cycle} failed: {error!r}')
+            else:
+                end = time.perf_counter()
+                bytes_written = sum(stage['bytesWritten'] for stage in run.to_json()['stages'].values())
+                print(f'\nRun {cycle} took {end - start:.2f}s ({bytes_written / 2**20:.1f} MiB written), output was up '
+                    f'to date {end - changed_at:.2f}s after the data file changed')
+                if report is not None:
+                    run.save(str(report))
+            print(f'Watching {data_path} for changes (press Ctrl+C to stop)...')
+            changed_at = wait_for_change(data_path, stamp, interval, debounce)
+    except KeyboardInterrupt:
+        print('\nStopped watching')
+
+
+@app.command()
+def serve(
+    directory: Path = typer.Argument(Path('public'),
+        help="Directory of the website, with the generated JSON files in its json directory.",
+        exists=True,
+        file_okay=False,
+        dir_okay=True
+    ),
+    host: str = typer.Option('localhost',
+        help="Host name or address to listen on (e.g. 0.0.0.0 for all interfaces)."
+    ),
+    port: int = typer.Option(8000,
+        help="Port to listen on."
+    )) -> None:
+    """Serve the website, sending precompressed copies of files and letting browsers cache files until they change."""
+    site_server.serve(str(directory), host, port)
 
 
 if __name__ == '__main__':
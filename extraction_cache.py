@@ -0,0 +1,180 @@
+"""
+Cache of the data extracted from a data source (FTB database or Gramps XML file), so that runs with different
+output options don't have to query or parse the data source again.
+
+The cache is an SQLite file with the people, families, facts, family links and update stamps exactly as the data
+source returned them (as JSON, including the ids, so that integer ids are still integers when they're read). It's
+only used if the data source file still has the same size, modification time and hash, and if the code that
+extracts data from data sources hasn't changed (see `extractor_version`).
+"""
+import os
+import json
+import hashlib
+import sqlite3 as sql
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+CACHE_VERSION = 2
+# Modules of which the code determines what is extracted from data sources
+EXTRACTOR_MODULES = ['ftb_format.py', 'ftb_queries.py', 'gramps_xml_format.py']
+# Maximum number of ids to bind to a single query
+CACHE_MAX_IDS = 500
+
+# Types of records in the cache
+RECORD_LINKS = 'links'
+RECORD_STAMP = 'stamp'
+RECORD_PERSON = 'person'
+RECORD_FAMILY = 'family'
+RECORD_FACTS = 'facts'
+
+# ids are stored as JSON, like the data
+CACHE_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE records (seq INTEGER PRIMARY KEY, type TEXT, id TEXT, data TEXT);
+"""
+CACHE_INDEX = "CREATE UNIQUE INDEX records_type_id ON records (type, id)"
+
+
+def extractor_version(source_format: str) -> str:
+    """Get the version of the extraction of data from a format, which changes whenever its code does."""
+    digest = hashlib.sha256(f'{CACHE_VERSION} {source_format}'.encode('ascii'))
+    for module in EXTRACTOR_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), 'rb') as infile:
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+
+def file_hash(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat_fingerprint(filename: str) -> Dict[str, Any]:
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def source_fingerprint(filename: str) -> Dict[str, Any]:
+    """Get the size, modification time and hash of a data source file."""
+    return {**_stat_fingerprint(filename), 'sha256': file_hash(filename)}
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, separators=(',', ':'))
+
+
+class CachedFamilyData:
+    """Family data read from an extraction cache (see `write_cache`)."""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.conn = sql.connect(filename)
+        self.meta = {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM meta')}
+
+    def _records(self, record_type: str) -> Iterator[Tuple[Any, Any]]:
+        for id, data in self.conn.execute('SELECT id, data FROM records WHERE type = ? ORDER BY seq', (record_type,)):
+            yield json.loads(id), json.loads(data)
+
+    def _records_by_ids(self, record_type: str, ids: List[Any]) -> Dict[Any, Any]:
+        """Get the records of the given ids that are in the cache, keyed by id."""
+        records = {}
+        for start in range(0, len(ids), CACHE_MAX_IDS):
+            chunk = ids[start:start + CACHE_MAX_IDS]
+            query = f'SELECT id, data FROM records WHERE type = ? AND id IN ({", ".join("?" * len(chunk))})'
+            for id, data in self.conn.execute(query, [record_type, *(_dumps(id) for id in chunk)]):
+                records[json.loads(id)] = json.loads(data)
+        return records
+
+    def get_person_data(self, person_id: str) -> Dict[str, Any]:
+        return self.get_people_data([person_id])[person_id]
+
+    def get_people_data(self, person_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        people = self._records_by_ids(RECORD_PERSON, person_ids)
+        return {person_id: people[person_id] for person_id in person_ids}
+
+    def get_family_data(self, family_id: str) -> Dict[str, Any]:
+        return self.get_families_data([family_id])[family_id]
+
+    def get_families_data(self, family_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        families = self._records_by_ids(RECORD_FAMILY, family_ids)
+        return {family_id: families[family_id] for family_id in family_ids}
+
+    def get_all_family_links(self) -> Dict[str, List[Any]]:
+        return dict(self._records(RECORD_LINKS))
+
+    def get_facts(self, person_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        return dict(self.iter_facts(person_ids))
+
+    def iter_facts(self, person_ids: Iterable[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Generate the facts of the given people (that have any), in the same order as the given ids."""
+        person_ids = list(person_ids)
+        for start in range(0, len(person_ids), CACHE_MAX_IDS):
+            chunk = person_ids[start:start + CACHE_MAX_IDS]
+            facts = self._records_by_ids(RECORD_FACTS, chunk)
+            for person_id in chunk:
+                if person_id in facts:
+                    yield person_id, facts[person_id]
+
+    def get_last_updated_date(self) -> datetime:
+        return datetime.fromisoformat(self.meta['lastUpdated'])
+
+    def get_update_stamps(self) -> Dict[str, Any]:
+        return dict(self._records(RECORD_STAMP))
+
+
+def open_cache(filename: str, source_filename: str, source_format: str) -> Optional[CachedFamilyData]:
+    """Open the extraction cache of a data source, unless it doesn't exist or is out of date."""
+    if not os.path.isfile(filename):
+        return None
+    try:
+        cache = CachedFamilyData(filename)
+        meta = cache.meta
+    except (sql.DatabaseError, ValueError):
+        return None
+    fingerprint = meta.get('source', {})
+    if meta.get('extractorVersion') != extractor_version(source_format) or \
+            {key: fingerprint.get(key) for key in ['size', 'mtime']} != _stat_fingerprint(source_filename) or \
+            fingerprint.get('sha256') != file_hash(source_filename):
+        cache.conn.close()
+        return None
+    return cache
+
+
+def write_cache(filename: str, db: Any, source_filename: str, source_format: str) -> None:
+    """Extract all data from a data source (which implements `FamilyData`) into an extraction cache."""
+    links = db.get_all_family_links()
+    person_ids = list(links)
+    family_ids = sorted({family[0] for families in links.values() for family in families}, key=str)
+    meta = {
+        'version': CACHE_VERSION,
+        'extractorVersion': extractor_version(source_format),
+        'source': source_fingerprint(source_filename),
+        'lastUpdated': db.get_last_updated_date().isoformat(),
+    }
+
+    # write into a temporary file, so that an interrupted run doesn't leave an incomplete cache behind
+    temp_filename = filename + '.tmp'
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+    conn = sql.connect(temp_filename)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(CACHE_SCHEMA)
+    insert = 'INSERT INTO records (type, id, data) VALUES (?, ?, ?)'
+    conn.executemany(insert, ((RECORD_LINKS, _dumps(id), _dumps(data)) for id, data in links.items()))
+    conn.executemany(insert,
+        ((RECORD_STAMP, _dumps(id), _dumps(data)) for id, data in db.get_update_stamps().items()))
+    conn.executemany(insert,
+        ((RECORD_PERSON, _dumps(id), _dumps(data)) for id, data in db.get_people_data(person_ids).items()))
+    conn.executemany(insert,
+        ((RECORD_FAMILY, _dumps(id), _dumps(data)) for id, data in db.get_families_data(family_ids).items()))
+    conn.executemany(insert, ((RECORD_FACTS, _dumps(id), _dumps(data)) for id, data in db.iter_facts(person_ids)))
+    conn.execute(CACHE_INDEX)
+    conn.executemany('INSERT INTO meta VALUES (?, ?)', ((key, _dumps(value)) for key, value in meta.items()))
+    conn.commit()
+    conn.close()
+    os.replace(temp_filename, filename)
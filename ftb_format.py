@@ -1,8 +1,8 @@
 import functools
+import itertools
 from sqlite3 import Cursor
 from datetime import datetime
-from collections import defaultdict
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from ftb_queries import *
 
@@ -46,18 +46,94 @@ class FTBDB:
     
     def __init__(self, cursor: Cursor) -> None:
         self.cursor = cursor
+        self._places: Optional[Dict[int, str]] = None
+        # names of places of person details, keyed by the place ids they were concatenated from (e.g. "12_12")
+        self._places_by_ids: Dict[str, str] = {}
+
+    def reset(self) -> None:
+        """Forget the places loaded from the database, so that they're loaded again after the database has changed."""
+        self._places = None
+        self._places_by_ids = {}
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        self.cursor.connection.close()
+
+    def get_places(self) -> Dict[int, str]:
+        """Get the name of every place by id (loaded once, instead of joining places in every query)."""
+        if self._places is None:
+            # use separate cursor so that places can be loaded while other rows are being streamed
+            cursor = self.cursor.connection.cursor()
+            cursor.execute(QRY_ALL_PLACES, [])
+            self._places = {place_id: choose_lang_longest(place) for place_id, place in cursor}
+        return self._places
+
+    def _place_name(self, place_ids: Optional[str]) -> str:
+        """Get the name of one of multiple places (of which ids are under-score appended to one another)."""
+        if place_ids is None:
+            return ''
+        name = self._places_by_ids.get(place_ids)
+        if name is None:
+            places = self.get_places()
+            names = [places.get(int(place_id), '') for place_id in place_ids.split('_')]
+            name = choose_lang_longest('_'.join(names))
+            self._places_by_ids[place_ids] = name
+        return name
 
     def get_person_data(self, person_id: str) -> Dict[str, Any]:
         """Fetch details for a single person."""
         self.cursor.execute(QRY_PERSON_DETAILS, (person_id,))
         row = self.cursor.fetchone()
+        return self._person_row_to_object(row)
+
+    def _query_ids(
+            self, cursor: Cursor, all_query: str, some_query: str, range_query: str, ids: List[Any]
+        ) -> Iterator[Any]:
+        """Run a query for the given ids.
+
+        Long lists of ids use a single query over the rows from the lowest to the highest id (`range_query` with
+        the bounds as parameters), so that the cost of a query depends on the range of ids instead of the size of
+        the table, or over all rows (`all_query`) if ids aren't numbers. Shorter lists are queried in chunks of ids
+        (`some_query` with an "{ids}" placeholder). Rows of other ids might still be returned.
+        """
+        if len(ids) > QRY_MAX_IDS_BEFORE_FULL_SCAN:
+            try:
+                numbers = [int(id) for id in ids]
+            except ValueError:
+                cursor.execute(all_query, [])
+            else:
+                cursor.execute(range_query, [min(numbers), max(numbers)])
+            yield from cursor
+            return
+        for start in range(0, len(ids), QRY_MAX_IDS):
+            chunk = ids[start:start + QRY_MAX_IDS]
+            cursor.execute(some_query.format(ids=', '.join('?' * len(chunk))), chunk)
+            yield from cursor
+
+    def get_people_data(self, person_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch details for multiple people with as few queries as possible."""
+        remaining_ids = set(person_ids)
+        people = {}
+        for row in self._query_ids(self.cursor, QRY_ALL_PERSON_DETAILS, QRY_SOME_PERSON_DETAILS,
+                QRY_RANGE_PERSON_DETAILS, person_ids):
+            if row[0] not in remaining_ids:
+                continue
+            remaining_ids.remove(row[0])
+            people[row[0]] = self._person_row_to_object(row)
+        # fallback to individual queries for any people not found by bulk query
+        for person_id in person_ids:
+            if person_id in remaining_ids:
+                people[person_id] = self.get_person_data(person_id)
+        return people
+
+    def _person_row_to_object(self, row: List[Any]) -> Dict[str, Any]:
         row = list(row)
         row[2] = choose_lang_longest(row[2])
         row[3] = choose_lang_longest(row[3])
         row[5] = sorted_date_to_iso_8601(choose_date_longest_valid(row[5]))
         row[6] = sorted_date_to_iso_8601(choose_date_longest_valid(row[6]))
-        row[7] = choose_lang_longest(row[7])
-        row[8] = choose_lang_longest(row[8])
+        row[7] = self._place_name(row[7])
+        row[8] = self._place_name(row[8])
         obj: Dict[str, Any] = row_to_object(row, {
             'personId': 0,
             'gender': 1,
@@ -82,19 +158,21 @@ class FTBDB:
         """Get data on family, including family members with enough detail for display."""
         self.cursor.execute(QRY_FAMILY_MEMBER_DETAILS, (family_id,))
         family_members = self.cursor.fetchall()
-        family_members = [list(mem) for mem in family_members]
-        for member in family_members:
-            member[1] = individual_role_type[member[1]]
-            member[2] = choose_lang_longest(member[2])
-            member[3] = choose_lang_longest(member[3])
-        for idx in range(len(family_members)):
-            family_members[idx] = row_to_object(family_members[idx], {
-                'personId': 0,
-                'roleType': 1,
-                'firstName': 2,
-                'lastName': 3,
-                'gender': 4
-            })
+        return self._family_object(family_id, [self._family_member_row_to_object(mem) for mem in family_members])
+
+
+    def get_families_data(self, family_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get data on multiple families with as few queries as possible."""
+        families = {family_id: self._family_object(family_id, []) for family_id in family_ids}
+        for row in self._query_ids(self.cursor, QRY_ALL_FAMILY_MEMBER_DETAILS, QRY_SOME_FAMILY_MEMBER_DETAILS,
+                QRY_RANGE_FAMILY_MEMBER_DETAILS, family_ids):
+            if row[5] not in families:
+                continue
+            families[row[5]]['members'].append(self._family_member_row_to_object(row))
+        return families
+
+
+    def _family_object(self, family_id: str, family_members: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             'familyId': family_id,
             'type': None,
@@ -103,6 +181,20 @@ class FTBDB:
         }
 
 
+    def _family_member_row_to_object(self, row: List[Any]) -> Dict[str, Any]:
+        member = list(row)
+        member[1] = individual_role_type[member[1]]
+        member[2] = choose_lang_longest(member[2])
+        member[3] = choose_lang_longest(member[3])
+        return row_to_object(member, {
+            'personId': 0,
+            'roleType': 1,
+            'firstName': 2,
+            'lastName': 3,
+            'gender': 4
+        })
+
+
     def _get_person_family_links(self, person_id: str) -> List[str]:
         """Get person's family links.
 
@@ -133,43 +225,57 @@ class FTBDB:
         """Get family links for everyone in database."""
         self.cursor.execute(QRY_ALL_PERSON_IDS)
         result = self.cursor.fetchall()
-        all_person_ids = [row[0] for row in result]
-        family_links = {}
-        for person_id in all_person_ids:
-            family_links[person_id] = self._get_person_family_links(person_id)
+        family_links: Dict[str, List[Any]] = {row[0]: [] for row in result}
+        # links of all people are retrieved in one pass instead of calling _get_person_family_links() per person
+        self.cursor.execute(QRY_ALL_FAMILY_LINKS)
+        for person_id, family_id, role_type in self.cursor:
+            if person_id not in family_links:
+                continue
+            family_links[person_id].append([family_id, individual_role_type[role_type]])
         return family_links
 
 
     def get_facts(self, person_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
-        self.cursor.execute(QRY_ALL_FACTS, [])
-        result = self.cursor.fetchall()
-        facts: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
-        for row in result:
-            if row[0] not in person_ids:
-                continue
-            row = list(row)
-            if row[2] in fact_type:
-                row[2] = fact_type[row[2]]
-            row[4] = sorted_date_to_iso_8601(str(row[4]))
-            # override description with cause_of_death
-            if not row[4] and row[2] == 'DEAT':
-                row[4] = row[7]
-            row[5] = choose_lang_longest(row[5])
-            row[6] = choose_lang_longest(row[6])
-            obj = row_to_object(row, {
-                # 'personId': 0,
-                'factId': 1,
-                'type': 2,
-                'subType': 3,
-                'date': 4,
-                'description': 5,
-                'place': 6
-            })
-            # lack of all this data is likely a mistaken entry?
-            if [row[3], row[4], row[5]] == ['', None, '']:
-                continue
-            facts[row[0]].append(obj)
-        return facts
+        return dict(self.iter_facts(person_ids))
+
+
+    def iter_facts(self, person_ids: Iterable[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Stream the facts of the given people from the database, grouped per person and ordered by person id."""
+        person_ids = list(person_ids)
+        person_id_set = set(person_ids)
+        # use separate cursor so that other queries can run while facts are being streamed
+        cursor = self.cursor.connection.cursor()
+        all_rows = self._query_ids(cursor, QRY_ALL_FACTS, QRY_SOME_FACTS, QRY_RANGE_FACTS, person_ids)
+        rows = (row for row in all_rows if row[0] in person_id_set)
+        for person_id, person_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            facts = [fact for fact in map(self._fact_row_to_object, person_rows) if fact is not None]
+            if len(facts) > 0:
+                yield person_id, facts
+
+
+    def _fact_row_to_object(self, row: List[Any]) -> Optional[Dict[str, Any]]:
+        row = list(row)
+        if row[2] in fact_type:
+            row[2] = fact_type[row[2]]
+        row[4] = sorted_date_to_iso_8601(str(row[4]))
+        # override description with cause_of_death
+        if not row[4] and row[2] == 'DEAT':
+            row[4] = row[7]
+        row[5] = choose_lang_longest(row[5])
+        row[6] = '' if row[6] is None else self.get_places().get(row[6], '')
+        obj = row_to_object(row, {
+            # 'personId': 0,
+            'factId': 1,
+            'type': 2,
+            'subType': 3,
+            'date': 4,
+            'description': 5,
+            'place': 6
+        })
+        # lack of all this data is likely a mistaken entry?
+        if [row[3], row[4], row[5]] == ['', None, '']:
+            return None
+        return obj
 
 
     def get_last_updated_date(self) -> datetime:
@@ -178,6 +284,26 @@ class FTBDB:
         return datetime.utcfromtimestamp(last_updated_timestamp)
 
 
+    def get_update_stamps(self) -> Dict[str, Any]:
+        """Get a stamp of each person that changes whenever their data changes.
+
+        Stamps combine the last update time of a person with that of their facts (if facts have one) and with the
+        names of the places of their facts, since editing a fact or renaming a place doesn't update the person.
+        """
+        self.cursor.execute(QRY_TABLE_COLUMNS, ['individual_fact_main_data'])
+        facts_last_updated: Dict[str, Any] = {}
+        if any(row[0] == 'last_update' for row in self.cursor):
+            self.cursor.execute(QRY_ALL_PERSON_FACTS_LAST_UPDATED, [])
+            facts_last_updated = {row[0]: row[1] for row in self.cursor}
+        places = self.get_places()
+        self.cursor.execute(QRY_ALL_PERSON_FACT_PLACE_IDS, [])
+        place_names: Dict[str, List[str]] = {}
+        for person_id, rows in itertools.groupby(self.cursor, key=lambda row: row[0]):
+            place_names[person_id] = [places.get(place_id, '') for _, place_id in rows]
+        self.cursor.execute(QRY_ALL_PERSON_LAST_UPDATED, [])
+        return {row[0]: [row[1], facts_last_updated.get(row[0]), place_names.get(row[0], [])] for row in self.cursor}
+
+
     def _list_all_people(self) -> None:
         self.cursor.execute(EXP_QRY_ALL_PEOPLE, [])
         result = self.cursor.fetchall()
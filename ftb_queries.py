@@ -71,6 +71,12 @@ family_main_data_status = ['unk', 'engaged', 'divorced', 'married', 'separated',
 family_token_types = { 'MARR': 'married', 'DIV': 'divorced', 'ANUL': 'annulled', 'EVEN': 'event' }
 
 
+# Maximum number of ids to bind to a single "IN ({ids})" query (SQLite versions before 3.32 only allow 999 variables)
+QRY_MAX_IDS = 500
+# Id lists longer than this are rather retrieved with a single query over the range of ids (or the whole table)
+QRY_MAX_IDS_BEFORE_FULL_SCAN = 10_000
+
+
 QRY_ALL_PERSON_IDS = """
 SELECT
     imd.individual_id as id
@@ -140,7 +146,18 @@ ORDER BY fic.family_id
 """
 
 
-QRY_PERSON_DETAILS = """
+QRY_ALL_FAMILY_LINKS = """
+SELECT
+    fic.individual_id,
+    fic.family_id,
+    fic.individual_role_type
+FROM family_individual_connection fic
+WHERE fic.delete_flag = 0
+ORDER BY fic.individual_id, fic.family_id
+"""
+
+
+QRY_PERSON_DETAILS_VIEW = """
 SELECT
     imd.individual_id as person_id,
     imd.gender,
@@ -150,8 +167,9 @@ SELECT
     --group_concat(ifmd.token, '_') as facts,
     group_concat(fact_birt.sorted_date, '_') as birth_date,
     group_concat(fact_deat.sorted_date, '_') as death_date,
-    group_concat(place_birt.place, '_') as birth_place,
-    group_concat(place_deat.place, '_') as death_place,
+    -- places are looked up in the result of QRY_ALL_PLACES instead of being joined
+    group_concat(fact_birt.place_id, '_') as birth_place_ids,
+    group_concat(fact_deat.place_id, '_') as death_place_ids,
     imd.is_alive,
     imd.privacy_level
 FROM individual_main_data imd
@@ -168,23 +186,38 @@ LEFT JOIN individual_fact_main_data fact_birt
 LEFT JOIN individual_fact_main_data fact_deat
     ON fact_deat.individual_id = imd.individual_id
     AND fact_deat.token = 'DEAT'
-LEFT JOIN places_lang_data place_birt
-    ON place_birt.place_id = fact_birt.place_id
-LEFT JOIN places_lang_data place_deat
-    ON place_deat.place_id = fact_deat.place_id
+"""
+
+QRY_PERSON_DETAILS = QRY_PERSON_DETAILS_VIEW + """
 WHERE person_id = ? AND imd.delete_flag = 0
 GROUP BY person_id
 """
 
+QRY_ALL_PERSON_DETAILS = QRY_PERSON_DETAILS_VIEW + """
+WHERE imd.delete_flag = 0
+GROUP BY person_id
+"""
+
+QRY_SOME_PERSON_DETAILS = QRY_PERSON_DETAILS_VIEW + """
+WHERE person_id IN ({ids}) AND imd.delete_flag = 0
+GROUP BY person_id
+"""
+
+QRY_RANGE_PERSON_DETAILS = QRY_PERSON_DETAILS_VIEW + """
+WHERE CAST(person_id AS INTEGER) BETWEEN ? AND ? AND imd.delete_flag = 0
+GROUP BY person_id
+"""
+
 
 # We return data in multiple languages appended together with underscores.
-QRY_FAMILY_MEMBER_DETAILS = """
+QRY_FAMILY_MEMBER_DETAILS_VIEW = """
 SELECT
     fic.individual_id as person_id,
     fic.individual_role_type as role_type,
     group_concat(ild.first_name, '_') as first_name,
     group_concat(ild.last_name, '_') as last_name,
-    imd.gender
+    imd.gender,
+    fmd.family_id
 FROM family_main_data fmd
 JOIN family_individual_connection fic
     ON fic.family_id = fmd.family_id
@@ -197,11 +230,32 @@ LEFT JOIN individual_lang_data ild
 LEFT JOIN individual_main_data imd
     ON imd.individual_id = fic.individual_id
     AND imd.delete_flag = 0
+"""
+
+QRY_FAMILY_MEMBER_DETAILS = QRY_FAMILY_MEMBER_DETAILS_VIEW + """
 WHERE fmd.family_id = ? and fmd.delete_flag = 0
 GROUP BY fic.individual_id
 ORDER BY fic.individual_id
 """
 
+QRY_ALL_FAMILY_MEMBER_DETAILS = QRY_FAMILY_MEMBER_DETAILS_VIEW + """
+WHERE fmd.delete_flag = 0
+GROUP BY fmd.family_id, fic.individual_id
+ORDER BY fmd.family_id, fic.individual_id
+"""
+
+QRY_SOME_FAMILY_MEMBER_DETAILS = QRY_FAMILY_MEMBER_DETAILS_VIEW + """
+WHERE fmd.family_id IN ({ids}) AND fmd.delete_flag = 0
+GROUP BY fmd.family_id, fic.individual_id
+ORDER BY fmd.family_id, fic.individual_id
+"""
+
+QRY_RANGE_FAMILY_MEMBER_DETAILS = QRY_FAMILY_MEMBER_DETAILS_VIEW + """
+WHERE CAST(fmd.family_id AS INTEGER) BETWEEN ? AND ? AND fmd.delete_flag = 0
+GROUP BY fmd.family_id, fic.individual_id
+ORDER BY fmd.family_id, fic.individual_id
+"""
+
 
 QRY_ALL_PLACES = """
 SELECT
@@ -212,7 +266,7 @@ GROUP BY pld.place_id
 """
 
 
-QRY_ALL_FACTS = """
+QRY_FACTS_VIEW = """
 SELECT DISTINCT
     ifmd.individual_id as person_id,
     ifmd.individual_fact_id as fact_id,
@@ -220,15 +274,30 @@ SELECT DISTINCT
     ifmd.fact_type,
     ifmd.sorted_date,
     group_concat(ifld.header, '_') as header,
-    group_concat(place.place, '_') as place,
+    -- places are looked up in the result of QRY_ALL_PLACES instead of being joined
+    ifmd.place_id,
     ifld.cause_of_death
 FROM individual_fact_main_data ifmd
 LEFT JOIN individual_fact_lang_data ifld
     ON ifld.individual_fact_id = ifmd.individual_fact_id
-LEFT JOIN places_lang_data place
-    ON place.place_id = ifmd.place_id
+"""
+
+QRY_ALL_FACTS = QRY_FACTS_VIEW + """
 WHERE ifmd.delete_flag = 0
 GROUP BY fact_id
+ORDER BY CAST(person_id AS INTEGER), person_id, fact_id
+"""
+
+QRY_SOME_FACTS = QRY_FACTS_VIEW + """
+WHERE person_id IN ({ids}) AND ifmd.delete_flag = 0
+GROUP BY fact_id
+ORDER BY CAST(person_id AS INTEGER), person_id, fact_id
+"""
+
+QRY_RANGE_FACTS = QRY_FACTS_VIEW + """
+WHERE CAST(person_id AS INTEGER) BETWEEN ? AND ? AND ifmd.delete_flag = 0
+GROUP BY fact_id
+ORDER BY CAST(person_id AS INTEGER), person_id, fact_id
 """
 
 
@@ -257,6 +326,52 @@ WHERE mimd.item_type = 1
 
 QRY_LAST_UPDATED = """select last_update from individual_main_data order by last_update desc limit 1"""
 
+# Indexes for the joins and filters of the queries above, which are created in in-memory copies of databases (the
+# FTB schema doesn't necessarily index these columns). Indexes include the other columns that queries use of those
+# tables, so that rows can be read from indexes alone.
+SNAPSHOT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS snapshot_ids_individual ON individual_data_set "
+    "(individual_id, delete_flag, individual_data_set_id)",
+    "CREATE INDEX IF NOT EXISTS snapshot_ild_data_set ON individual_lang_data "
+    "(individual_data_set_id, first_name, last_name, suffix)",
+    "CREATE INDEX IF NOT EXISTS snapshot_ifmd_individual ON individual_fact_main_data (individual_id, token)",
+    "CREATE INDEX IF NOT EXISTS snapshot_ifld_fact ON individual_fact_lang_data "
+    "(individual_fact_id, header, cause_of_death)",
+    "CREATE INDEX IF NOT EXISTS snapshot_pld_place ON places_lang_data (place_id, place)",
+    "CREATE INDEX IF NOT EXISTS snapshot_fic_individual ON family_individual_connection "
+    "(individual_id, family_id, individual_role_type, delete_flag)",
+    "CREATE INDEX IF NOT EXISTS snapshot_fic_family ON family_individual_connection "
+    "(family_id, individual_id, individual_role_type, delete_flag)",
+]
+
+QRY_ALL_PERSON_LAST_UPDATED = """
+SELECT
+    imd.individual_id as id,
+    imd.last_update
+FROM individual_main_data imd
+"""
+
+# places of the facts of each person, of which the names are part of the data of people and facts
+QRY_ALL_PERSON_FACT_PLACE_IDS = """
+SELECT DISTINCT
+    ifmd.individual_id as id,
+    ifmd.place_id
+FROM individual_fact_main_data ifmd
+WHERE ifmd.place_id IS NOT NULL AND ifmd.delete_flag = 0
+ORDER BY ifmd.individual_id, ifmd.place_id
+"""
+
+# last update time of the facts of each person, if facts have one (they don't necessarily in every FTB schema)
+QRY_ALL_PERSON_FACTS_LAST_UPDATED = """
+SELECT
+    ifmd.individual_id as id,
+    max(ifmd.last_update)
+FROM individual_fact_main_data ifmd
+GROUP BY ifmd.individual_id
+"""
+
+QRY_TABLE_COLUMNS = """SELECT name FROM pragma_table_info(?)"""
+
 
 def row_to_object(row: List[str], mapping: Dict[str, int]) -> Dict[str, str]:
     object = {}
@@ -1,11 +1,38 @@
+import io
+import gzip
 from datetime import datetime
 import xml.etree.ElementTree as ET
-from collections import defaultdict
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
+
+
+# Sections of a Gramps XML file that contain records that are used, with the tag of their records
+RECORD_SECTIONS = {
+    'places': 'placeobj',
+    'events': 'event',
+    'people': 'person',
+    'families': 'family',
+}
+# Sections of a Gramps XML file that are kept as XML
+KEEP_XML_SECTIONS = {'header'}
+
+
+def _open_xml(filepath: str) -> io.BufferedIOBase:
+    """Open XML file for reading while decompressing it if it's gzipped (the default for .gramps files)."""
+    with open(filepath, 'rb') as file:
+        magic = file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(filepath, 'rb')
+    return open(filepath, 'rb')
+
+
+def _local_tag(tag: str) -> str:
+    """Get tag without namespace."""
+    return tag.rsplit('}', 1)[-1]
 
 
 def load_xml(filepath: str) -> ET.Element:
-    tree = ET.parse(filepath)
+    with _open_xml(filepath) as file:
+        tree = ET.parse(file)
     return tree.getroot()
 
 
@@ -16,125 +43,300 @@ ROLE_MAPPING = {
 }
 
 
-class GrampsXML:
+def _last_child(el: ET.Element, tag: str) -> Optional[ET.Element]:
+    """Get the last child with the given tag (without namespace), which is the one used if there are multiple."""
+    result = None
+    for child in el:
+        if _local_tag(child.tag) == tag:
+            result = child
+    return result
+
+
+def _child_value(el: Optional[ET.Element]) -> Optional[str]:
+    """Get the value of an element without children: its text or else its "val" or "value" attribute."""
+    if el is None:
+        return None
+    if el.text is not None:
+        return el.text
+    return el.attrib.get('val', el.attrib.get('value'))
+
+
+class Place:
+    __slots__ = ['change', 'name']
+
+    def __init__(self, change: int, name: Dict[str, str]) -> None:
+        self.change = change
+        # attributes of the place name (e.g. "value" and "lang"), along with its value as ".value"
+        self.name = name
+
 
-    def __init__(self, root: ET.Element) -> None:
-        self.root = root
-        self.namespace = root.tag.split('}')[0][1:]
-
-    def _ntag(self, val: ET.Element) -> str:
-        """Get tag without namespace (no-namespace tag)."""
-        return val.tag.replace(f"{{{self.namespace}}}", "")
-
-    def _todict(self, el: ET.Element) -> Dict[str, Any]:
-        """Convert values in children of element into dictionary."""
-        el_dict: Dict[str, Any] = {}
-        for child in el:
-            assert not isinstance(child, str)
-            # if child has children, then recurse
-            if len(child) != 0:
-                el_dict[self._ntag(child)] = self._todict(child)
+class Event:
+    __slots__ = ['id', 'change', 'type', 'date', 'place', 'description']
+
+    def __init__(
+            self, id: str, change: int, type: Optional[str], date: str, place: Optional[Place],
+            description: Optional[str]
+        ) -> None:
+        self.id = id
+        self.change = change
+        self.type = type
+        self.date = date
+        self.place = place
+        self.description = description
+
+
+class Person:
+    __slots__ = ['id', 'handle', 'change', 'gender', 'first_name', 'last_name', 'events', 'child_of', 'parent_in']
+
+    def __init__(
+            self, id: str, handle: str, change: int, gender: Optional[str], first_name: Optional[str],
+            last_name: Optional[str], events: List[Event]
+        ) -> None:
+        self.id = id
+        self.handle = handle
+        self.change = change
+        self.gender = gender
+        self.first_name = first_name
+        self.last_name = last_name
+        self.events = events
+        self.child_of: List['Family'] = []
+        self.parent_in: List['Family'] = []
+
+
+class Family:
+    __slots__ = ['id', 'handle', 'members']
+
+    def __init__(self, id: str, handle: str) -> None:
+        self.id = id
+        self.handle = handle
+        # father, mother and children in order of the XML: (person handle, role, person if it exists)
+        self.members: List[Tuple[str, str, Optional[Person]]] = []
+
+
+class RecordBuilder:
+    """Converts the XML elements of records into people, families, events and places.
+
+    References between records are resolved by `resolve` once all records have been added, so records can be
+    added in any order, e.g. while the XML is being parsed (see `iterparse_xml`).
+    """
+
+    def __init__(self) -> None:
+        self.places_by_handle: Dict[str, Place] = {}
+        self.events_by_handle: Dict[str, Event] = {}
+        self.people_by_handle: Dict[str, Person] = {}
+        self.families_by_handle: Dict[str, Family] = {}
+        self.people_by_id: Dict[str, Person] = {}
+        self.families_by_id: Dict[str, Family] = {}
+        # place handle of each event that has a place
+        self.event_places: List[Tuple[Event, str]] = []
+        # event handles of each person and family handles of their "childof" and "parentin" references
+        self.person_references: List[Tuple[Person, List[str], List[str], List[str]]] = []
+
+    def add(self, record_el: ET.Element) -> None:
+        """Add the record of an element of one of the `RECORD_SECTIONS` (other elements are ignored)."""
+        tag = _local_tag(record_el.tag)
+        if tag == 'placeobj':
+            self._add_place(record_el)
+        elif tag == 'event':
+            self._add_event(record_el)
+        elif tag == 'person':
+            self._add_person(record_el)
+        elif tag == 'family':
+            self._add_family(record_el)
+
+    def add_tree(self, root: ET.Element) -> None:
+        """Add the records of a whole XML tree, clearing each section of the XML once it has been converted."""
+        for section in root:
+            record_tag = RECORD_SECTIONS.get(_local_tag(section.tag))
+            if record_tag is None:
                 continue
-            # if ntag(child).endswith("ref"):
-            #     continue
-            value = child.text
-            if value is None:
-                if 'val' in child.attrib:
-                    value = child.attrib['val']
-                elif 'value' in child.attrib:
-                    value = child.attrib['value']
-            
-            if len(child.attrib) == 0:
-                el_dict[self._ntag(child)] = value
-            else:
-                el_dict[self._ntag(child)] = child.attrib
-                if value is not None:
-                    # strings starting with period or hyphen aren't legal XML tag names
-                    el_dict[self._ntag(child)]['.value'] = value
-        el_dict.update(el.attrib)
-        return el_dict
-    
-    def _person_surname(self, person: Dict[str, Any]) -> Optional[str]:
-        full_surname = None
-        surname = person['name'].get('surname')
-        if isinstance(surname, str):
-            full_surname = surname
-        elif isinstance(surname, dict):
-            full_surname = (surname.get('prefix', '') + ' ' + surname.get('.value', '')).strip()
-        return full_surname
+            for record_el in section:
+                if _local_tag(record_el.tag) == record_tag:
+                    self.add(record_el)
+            section.clear()
 
-    def get_last_updated_date(self) -> datetime:
-        date = self.root.findall('./{*}header/{*}created')[0].attrib['date']
-        return datetime.fromisoformat(date)
+    def _add_place(self, place_el: ET.Element) -> None:
+        name_el = _last_child(place_el, 'pname')
+        name = {}
+        if name_el is not None:
+            name = dict(name_el.attrib)
+            value = _child_value(name_el)
+            if value is not None:
+                # strings starting with period or hyphen aren't legal XML tag names
+                name['.value'] = value
+        self.places_by_handle.setdefault(place_el.attrib['handle'], Place(int(place_el.attrib.get('change', 0)), name))
 
-    def _get_person_family_links(self, person_id: str) -> List[List[str]]:
-        """Get person's family links."""
-        person = self.root.find(f"./{{*}}people/{{*}}person[@id='{person_id}']")
-        assert person is not None
-        person_handle = person.attrib['handle']
+    def _add_event(self, event_el: ET.Element) -> None:
+        handle = event_el.attrib['handle']
+        if handle in self.events_by_handle:
+            return
+        date_el = _last_child(event_el, 'dateval')
+        place_ref = event_el.find('./{*}place')
+        description_el = _last_child(event_el, 'description')
+        event = Event(
+            event_el.attrib['id'],
+            int(event_el.attrib.get('change', 0)),
+            _child_value(_last_child(event_el, 'type')),
+            '' if date_el is None else date_el.attrib.get('val', ''),
+            None,
+            '' if description_el is None else _child_value(description_el),
+        )
+        self.events_by_handle[handle] = event
+        if place_ref is not None:
+            self.event_places.append((event, place_ref.attrib['hlink']))
+
+    def _add_person(self, person_el: ET.Element) -> None:
+        name_el = _last_child(person_el, 'name')
+        first_name: Optional[str] = ''
+        last_name = None
+        if name_el is not None:
+            first_el = _last_child(name_el, 'first')
+            first_name = '' if first_el is None else _child_value(first_el)
+            last_name = self._surname(_last_child(name_el, 'surname'))
+        person = Person(person_el.attrib['id'], person_el.attrib['handle'], int(person_el.attrib.get('change', 0)),
+            _child_value(_last_child(person_el, 'gender')), first_name, last_name, [])
+        self.people_by_id.setdefault(person.id, person)
+        self.people_by_handle.setdefault(person.handle, person)
+        self.person_references.append((person,
+            [el.attrib['hlink'] for el in person_el.iterfind('./{*}eventref')],
+            [el.attrib['hlink'] for el in person_el.iterfind('./{*}childof')],
+            [el.attrib['hlink'] for el in person_el.iterfind('./{*}parentin')]))
+
+    def _add_family(self, family_el: ET.Element) -> None:
+        family = Family(family_el.attrib['id'], family_el.attrib['handle'])
+        for member_el in family_el:
+            role = ROLE_MAPPING.get(_local_tag(member_el.tag))
+            if role is not None:
+                family.members.append((member_el.attrib['hlink'], role, None))
+        self.families_by_id.setdefault(family.id, family)
+        self.families_by_handle.setdefault(family.handle, family)
+
+    @staticmethod
+    def _surname(surname_el: Optional[ET.Element]) -> Optional[str]:
+        if surname_el is None:
+            return None
+        if len(surname_el.attrib) == 0:
+            return _child_value(surname_el)
+        return (surname_el.attrib.get('prefix', '') + ' ' + (surname_el.text or '')).strip()
+
+    def resolve(self) -> None:
+        """Resolve the references between the records that have been added."""
+        for event, place_handle in self.event_places:
+            event.place = self.places_by_handle.get(place_handle)
+        for person, event_handles, child_of, parent_in in self.person_references:
+            person.events = [self.events_by_handle[handle] for handle in event_handles
+                if handle in self.events_by_handle]
+            person.child_of = [self.families_by_handle[handle] for handle in child_of]
+            person.parent_in = [self.families_by_handle[handle] for handle in parent_in]
+        for family in self.families_by_handle.values():
+            family.members = [(handle, role, self.people_by_handle.get(handle)) for handle, role, _ in family.members]
+        self.event_places = []
+        self.person_references = []
+
+
+def iterparse_xml(filepath: str) -> 'GrampsXML':
+    """Incrementally parse a Gramps XML file into its records while the XML is being parsed.
+
+    The element of each record is converted (see `RecordBuilder`) and removed as soon as it has been parsed, so
+    that peak memory scales with the extracted records instead of with the size of the whole XML document.
+    """
+    root: Optional[ET.Element] = None
+    builder = RecordBuilder()
+    # path of open elements: [root, section, record, ...]
+    stack: List[ET.Element] = []
+    with _open_xml(filepath) as file:
+        for event, el in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = el
+                stack.append(el)
+                continue
+            stack.pop()
+            if len(stack) == 1 and _local_tag(el.tag) not in KEEP_XML_SECTIONS:
+                stack[0].remove(el)
+            elif len(stack) == 2:
+                section = stack[1]
+                section_tag = _local_tag(section.tag)
+                if section_tag in KEEP_XML_SECTIONS:
+                    continue
+                if RECORD_SECTIONS.get(section_tag) == _local_tag(el.tag):
+                    builder.add(el)
+                el.clear()
+                section.remove(el)
+    assert root is not None
+    return GrampsXML(root, builder)
+
+
+class GrampsXML:
+    """Family data of a Gramps XML file.
+
+    The XML is converted into records of people, families, events and places (with references between them
+    resolved) when this is created, after which the XML tree is cleared, so it can't be used anymore.
+    """
+
+    def __init__(self, root: ET.Element, records: Optional[RecordBuilder] = None) -> None:
+        """Convert an XML tree, or only read its header if its records have already been added to `records`."""
+        created = root.find('./{*}header/{*}created')
+        assert created is not None
+        self.created_date = created.attrib['date']
+        if records is None:
+            records = RecordBuilder()
+            records.add_tree(root)
+        records.resolve()
+        # Lookup indexes so that references can be resolved without scanning all records
+        self.people_by_id = records.people_by_id
+        self.families_by_id = records.families_by_id
 
-        family_hlinks = []
-        for el in person.findall(f"./{{*}}childof"):
-            family_hlinks.append(("child", el.attrib['hlink']))
-        for el in person.findall(f"./{{*}}parentin"):
-            family_hlinks.append(("parent", el.attrib['hlink']))
+    def get_last_updated_date(self) -> datetime:
+        return datetime.fromisoformat(self.created_date)
+
+    def get_update_stamps(self) -> Dict[str, Any]:
+        """Get the last change time of each person, including changes to their events and the places of those."""
+        stamps = {}
+        for person_id, person in self.people_by_id.items():
+            change = person.change
+            for event in person.events:
+                change = max(change, event.change)
+                if event.place is not None:
+                    change = max(change, event.place.change)
+            stamps[person_id] = change
+        return stamps
 
+    def _get_person_family_links(self, person: Person) -> List[List[str]]:
+        """Get person's family links."""
         family_links = []
-        for family_type, hlink in family_hlinks:
-            family = self.root.find(f"./{{*}}families/{{*}}family[@handle='{hlink}']")
-            assert family is not None
-            result = family.find(f"./*[@hlink='{person_handle}']")
-            assert result is not None
-            role = ROLE_MAPPING[self._ntag(result)]
-            family_links.append([family.attrib['id'], role, family_type])
+        for family_type, families in [("child", person.child_of), ("parent", person.parent_in)]:
+            for family in families:
+                role = next(role for hlink, role, _ in family.members if hlink == person.handle)
+                family_links.append([family.id, role, family_type])
         return family_links
 
     def get_all_family_links(self) -> Dict[str, List[Any]]:
         """Get family links for everyone in database."""
-        people = self.root.findall('./{*}people/{*}person')
-        all_person_ids = [self._todict(person)['id'] for person in people]
-        family_links = {}
-        for person_id in all_person_ids:
-            family_links[person_id] = self._get_person_family_links(person_id)
-        return family_links
+        return {person_id: self._get_person_family_links(person) for person_id, person in self.people_by_id.items()}
 
     def get_person_data(self, person_id: str) -> Dict[str, Any]:
         """Fetch details for a single person."""
-        person_el = self.root.find(f"./{{*}}people/{{*}}person[@id='{person_id}']")
-        assert person_el is not None
-        person = self._todict(person_el)
-        events = person_el.findall("./{*}eventref")
+        person = self.people_by_id[person_id]
         birth = {}
         death = {}
-        for eventref in events:
-            hlink = eventref.attrib['hlink']
-            event_el = self.root.find(f"./{{*}}events/{{*}}event[@handle='{hlink}']")
-            assert event_el is not None
-            event = self._todict(event_el)
-            event_date = ''
-            if 'dateval' in event:
-                event_date = event['dateval']['val']
-            place = ''
-            if 'place' in event:
-                place_hlink = event['place']['hlink']
-                place_el = self.root.find(f"./{{*}}places/{{*}}placeobj[@handle='{place_hlink}']")
-                assert place_el is not None
-                place = self._todict(place_el)['pname']
-            if event['type'] == 'Birth':
+        for event in person.events:
+            place = '' if event.place is None else event.place.name
+            if event.type == 'Birth':
                 birth = {
-                    'date': event_date,
+                    'date': event.date,
                     'place': place,
                 }
-            elif event['type'] == 'Death':
+            elif event.type == 'Death':
                 death = {
-                    'date': event_date,
+                    'date': event.date,
                     'place': place,
                 }
         obj = {
             'personId': person_id,
-            'gender': person['gender'],
-            'firstName': person['name'].get('first', ''),
-            'lastName': self._person_surname(person),
+            'gender': person.gender,
+            'firstName': person.first_name,
+            'lastName': person.last_name,
             'suffix': '',
             'facts': {
                 'birth': birth,
@@ -143,36 +345,33 @@ class GrampsXML:
         }
         return obj
 
+    def get_people_data(self, person_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch details for multiple people."""
+        return {person_id: self.get_person_data(person_id) for person_id in person_ids}
+
     def get_family_data(self, family_id: str) -> Dict[str, Any]:
-        family_el = self.root.find(f"./{{*}}families/{{*}}family[@id='{family_id}']")
-        if family_el is None:
+        family = self.families_by_id.get(family_id)
+        if family is None:
             return {}
-        father_el = family_el.find("./{*}father")
-        mother_el = family_el.find("./{*}mother")
-        children_els = family_el.findall("./{*}childref")
-
-        member_els: List[ET.Element] = []
-        if father_el is not None:
-            member_els.append(father_el)
-        if mother_el is not None:
-            member_els.append(mother_el)
-        member_els.extend(children_els)
+        # father and mother are listed first, followed by children
+        members = [next((member for member in family.members if member[1] == role), None)
+            for role in ['husband', 'wife']]
+        members.extend(member for member in family.members if member[1] == 'natural_child')
 
         family_members = []
-        for member_el in member_els:
-            hlink = self._todict(member_el)['hlink']
-            person_el = self.root.find(f"./{{*}}people/{{*}}person[@handle='{hlink}']")
-            if person_el is None:
+        for member in members:
+            if member is None:
+                continue
+            hlink, role, person = member
+            if person is None:
                 print(f"Missing person referenced by family: {hlink}")
                 continue
-            person = self._todict(person_el)
-
             family_members.append({
-                'personId': person['id'],
-                'roleType': ROLE_MAPPING[self._ntag(member_el)],
-                'gender': person['gender'],
-                'firstName': person['name'].get('first', ''),
-                'lastName': self._person_surname(person),
+                'personId': person.id,
+                'roleType': role,
+                'gender': person.gender,
+                'firstName': person.first_name,
+                'lastName': person.last_name,
             })
         return {
             'familyId': family_id,
@@ -181,52 +380,33 @@ class GrampsXML:
             'members': family_members
         }
 
+    def get_families_data(self, family_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get data on multiple families."""
+        return {family_id: self.get_family_data(family_id) for family_id in family_ids}
+
     def get_facts(self, person_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
-        facts: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
-        for person_id in person_ids:
-            person_el = self.root.find(f"./{{*}}people/{{*}}person[@id='{person_id}']")
-            assert person_el is not None
-            events = person_el.findall("./{*}eventref")
-            for eventref in events:
-                hlink = eventref.attrib['hlink']
-                event_el = self.root.find(f"./{{*}}events/{{*}}event[@handle='{hlink}']")
-                assert event_el is not None
-                event = self._todict(event_el)
-
-                event_date = ''
-                if 'dateval' in event:
-                    event_date = event['dateval']['val']
-                place = ''
-
-                if 'place' in event:
-                    place_hlink = event['place']['hlink']
-                    place_el = self.root.find(f"./{{*}}places/{{*}}placeobj[@handle='{place_hlink}']")
-                    assert place_el is not None
-                    place = self._todict(place_el)['pname'].get('value', '')
+        return dict(self.iter_facts(person_ids))
 
+    def iter_facts(self, person_ids: Iterable[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Generate the facts of the given people, grouped per person and in the same order as the given ids."""
+        for person_id in person_ids:
+            facts = []
+            for event in self.people_by_id[person_id].events:
                 obj = {
-                    'factId': event['id'],
-                    'type': event['type'].lower(),
+                    'factId': event.id,
+                    'type': (event.type or '').lower(),
                     'subType': '',
-                    'date': event_date,
-                    'description': event.get('description', ''),
-                    'place': place,
+                    'date': event.date,
+                    'description': event.description,
+                    'place': '' if event.place is None else event.place.name.get('value', ''),
                 }
-                facts[person_id].append(obj)
-        return facts
+                facts.append(obj)
+            if len(facts) > 0:
+                yield person_id, facts
 
 
 if __name__ == "__main__":
-    tree = ET.parse('data/family2.gramps')
-    root = tree.getroot()
-    xml = GrampsXML(root)
-
-    namespace = root.tag.split('}')[0][1:]
-    print(namespace)
-    print(xml._ntag(root))
-
-    for child in root:
-        print(xml._ntag(child))
+    xml = GrampsXML(load_xml('data/family2.gramps'))
 
     print(xml.get_last_updated_date())
     print(xml.get_person_data("I0000"))
@@ -0,0 +1,83 @@
+"""
+Serialisation of output to JSON bytes, with orjson if it's installed (which is several times faster than the json
+module) and with the json module otherwise.
+
+Both produce exactly the same output for the data that is written (dicts, lists, strings, integers, booleans and
+null), so output doesn't depend on whether orjson is installed:
+- compact JSON (without whitespace) is UTF-8 encoded, i.e. non-ASCII characters aren't escaped;
+- JSON with whitespace (e.g. `{"a": 1, "b": [1, 2]}`) is always written by the json module, since orjson can't write
+  it, and is ASCII-only.
+
+Large dicts and lists can also be encoded in chunks (see `iterencode`), so that files can be written without
+holding all of their JSON in memory at once.
+"""
+import json
+import importlib
+from typing import Any, Iterable, Iterator, Optional
+
+
+try:
+    # imported by name, so that type checking doesn't depend on whether it's installed
+    orjson: Optional[Any] = importlib.import_module('orjson')
+except ImportError:
+    orjson = None
+
+# Approximate size of the chunks generated by `iterencode`
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def backend_name() -> str:
+    """Get the name of the module that compact JSON is written with ("orjson" or "json")."""
+    return 'orjson' if orjson is not None else 'json'
+
+
+def dumps(data: Any, compact: bool = False) -> bytes:
+    """Serialise data to JSON."""
+    if not compact:
+        return json.dumps(data).encode('ascii')
+    if orjson is not None:
+        return bytes(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _key(key: Any) -> str:
+    """Convert a dict key to a string in the same way as json.dumps."""
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def iterencode(data: Any, compact: bool = False, chunk_bytes: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Serialise data to JSON in chunks of about chunk_bytes (the same JSON as `dumps`, when joined).
+
+    Dicts and lists are encoded item by item, so only the JSON of a single chunk is held in memory.
+    """
+    if not isinstance(data, (dict, list)) or len(data) == 0:
+        yield dumps(data, compact)
+        return
+    item_separator, key_separator = (b',', b':') if compact else (b', ', b': ')
+    is_dict = isinstance(data, dict)
+    parts = [b'{' if is_dict else b'[']
+    size = 1
+    items: Iterable[Any] = data.items() if isinstance(data, dict) else data
+    for index, item in enumerate(items):
+        if index > 0:
+            parts.append(item_separator)
+        if is_dict:
+            key, value = item
+            parts.append(dumps(_key(key), compact) + key_separator)
+        else:
+            value = item
+        encoded = dumps(value, compact)
+        parts.append(encoded)
+        size += len(encoded)
+        if size >= chunk_bytes:
+            yield b''.join(parts)
+            parts, size = [], 0
+    parts.append(b'}' if is_dict else b']')
+    yield b''.join(parts)
+
+
+def loads(data: bytes) -> Any:
+    """Deserialise JSON."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
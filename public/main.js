@@ -2,11 +2,9 @@
  * Use Handlebar templates to generate HTML.
  */
 
-const familyJsonDivSize = 100;
-const personJsonDivSize = 1000;
-const factsJsonDivSize = 1000;
-
 window.drawFamilyTree = false;
+window.shardIndex = null;
+window.searchIndex = null;
 
 
 /**
@@ -38,14 +36,174 @@ function readJsonFile(fileURL, callback, errorCallback=Function()) {
 
 
 /**
- * Determine the filename of a divided-JSON file (i.e. a dictionary where the keys are
- * integer ids that have been split across multiple files).
+ * Get the integer part of an id (e.g. "I0012" -> 12).
+ */
+function numericId(id) {
+    return parseInt(String(id).replace(/[A-Za-z]/g, ''));
+}
+
+
+/**
+ * Determine the filename of the sharded-JSON file (i.e. a dictionary where the keys are ids that
+ * have been split across multiple files) of the given type (e.g. "people") that contains an id.
+ * The shard index lists the id range of each file. Returns null if no file contains the id.
+ */
+function shardFilenameFromId(shardType, id) {
+    if (window.shardIndex === null) {
+        const req = readJsonFile("json/shard-index.json");
+        window.shardIndex = JSON.parse(req.response);
+    }
+    // E.g. files with name "1000-2000" contain ids 1000 to 1999 (inclusive), listed as [1000, 2000, version]
+    const ranges = window.shardIndex[shardType] || [];
+    const num = numericId(id);
+    // binary search for the last range with a lower bound not above the id
+    var low = 0;
+    var high = ranges.length - 1;
+    while (low < high) {
+        const mid = Math.ceil((low + high) / 2);
+        if (ranges[mid][0] <= num) {
+            low = mid;
+        } else {
+            high = mid - 1;
+        }
+    }
+    if (ranges.length === 0 || num < ranges[low][0] || num >= ranges[low][1]) {
+        return null;
+    }
+    const filename = `json/${shardType}/${shardType}-${ranges[low][0]}-${ranges[low][1]}.json`;
+    // the version of the file's content lets browsers cache it until it changes (see "site_server.py")
+    const version = ranges[low][2];
+    return version ? `${filename}?v=${version}` : filename;
+}
+
+
+/**
+ * Forget the shard index, so that it's requested again the next time a file is looked up. The website's
+ * server makes browsers revalidate it (see "site_server.py"), so it's only downloaded again if the data has
+ * been regenerated since, after which the files it lists might have been renamed.
+ */
+function resetShardIndex() {
+    window.shardIndex = null;
+}
+
+
+/**
+ * Decode records stored in columnar format (see "columnar_format.py") into a dictionary
+ * keyed by id, i.e. the same structure as the default format.
+ */
+function decodeColumnar(data) {
+    if (data.version !== 1) {
+        throw new Error(`Unsupported columnar format version: ${data.version}`);
+    }
+    function decodeRow(row) {
+        var record = {};
+        data.schemas[row[0]].forEach((column, idx) => {
+            const kind = column[0];
+            const path = column.slice(1);
+            var value = row[idx + 1];
+            var target = record;
+            path.slice(0, -1).forEach(key => {
+                if (!target.hasOwnProperty(key)) {
+                    target[key] = {};
+                }
+                target = target[key];
+            });
+            if (kind === 1) {
+                value = data.strings[value];
+            } else if (kind === 2) {
+                value = value.map(decodeRow);
+            }
+            target[path[path.length - 1]] = value;
+        });
+        return record;
+    }
+    var records = {};
+    data.ids.forEach((id, idx) => {
+        records[id] = decodeRow(data.rows[idx]);
+    });
+    if (data.hasOwnProperty('metadata')) {
+        records.metadata = data.metadata;
+    }
+    return records;
+}
+
+
+/**
+ * Parse a JSON file of records (e.g. people or families) in either the default or columnar format.
+ */
+function parseRecordsJson(text) {
+    const jsonData = JSON.parse(text);
+    if (jsonData.format === 'columnar') {
+        return decodeColumnar(jsonData);
+    }
+    return jsonData;
+}
+
+
+/**
+ * Fetch the ancestors of a person (up to a few generations back) along with the generation of each.
+ * Returns null if the file containing them couldn't be loaded.
  */
-function divJsonFilenameFromId(prepend, id, divisions=1000) {
-    // E.g. files with name "1000-2000" contain ids 1000 to 1999 (inclusive)
-    lower = Math.floor(id / divisions) * divisions;
-    upper = lower + divisions;
-    return `${prepend}-${lower}-${upper}.json`;
+function loadAncestors(personId) {
+    const jsonFilename = shardFilenameFromId("kinship", personId);
+    if (jsonFilename === null) {
+        return {};
+    }
+    const req = readJsonFile(jsonFilename);
+    if (req.status != 200) {
+        return null;
+    }
+    const jsonData = JSON.parse(req.response);
+    return jsonData.hasOwnProperty(personId) ? jsonData[personId] : {};
+}
+
+
+/**
+ * Find the nearest common ancestor of two people, which determines how they're related.
+ * Returns the id of the ancestor and the number of generations from each person to the ancestor,
+ * or null if they have no common ancestor within the generations in the ancestor tables.
+ */
+function findCommonAncestor(personId, otherPersonId) {
+    personId = String(personId);
+    otherPersonId = String(otherPersonId);
+    const ancestors = loadAncestors(personId);
+    const otherAncestors = loadAncestors(otherPersonId);
+    if (ancestors === null || otherAncestors === null) {
+        return null;
+    }
+    // people are their own ancestor of generation 0
+    ancestors[personId] = 0;
+    otherAncestors[otherPersonId] = 0;
+    var nearest = null;
+    Object.keys(ancestors).forEach(ancestorId => {
+        if (!otherAncestors.hasOwnProperty(ancestorId)) {
+            return;
+        }
+        const generations = [ancestors[ancestorId], otherAncestors[ancestorId]];
+        if (nearest === null || generations[0] + generations[1] < nearest[1] + nearest[2]) {
+            nearest = [ancestorId, generations[0], generations[1]];
+        }
+    });
+    return nearest;
+}
+
+
+function showRelationshipToFocusPerson(personId) {
+    const focusPersonId = window.shardIndex.focusPersonId;
+    if (focusPersonId === null || String(personId) == String(focusPersonId)) {
+        return;
+    }
+    const commonAncestor = findCommonAncestor(personId, focusPersonId);
+    if (commonAncestor === null) {
+        return;
+    }
+    const factsUl = document.getElementById("person-facts");
+    if (factsUl === null) {
+        return;
+    }
+    const relationship = relationshipName(commonAncestor[1], commonAncestor[2]);
+    factsUl.innerHTML += `<li>Relationship: <span style="text-transform: capitalize">${relationship}</span>`
+        + ` of <a href="#${focusPersonId}">${focusPersonId}</a></li>`;
 }
 
 
@@ -55,10 +213,10 @@ function loadRelativeData(familyLinks) {
         const familyId = link[0];
         const roleType = link[1];
         const familyType = isChild(roleType) ? 'ischild' : 'isparent';
-        const jsonFilename = divJsonFilenameFromId("json/families/families", familyId, familyJsonDivSize);
-        const req = readJsonFile(jsonFilename);
-        if (req.status == 200) {
-            const jsonData = JSON.parse(req.response);
+        const jsonFilename = shardFilenameFromId("families", familyId);
+        const req = jsonFilename === null ? null : readJsonFile(jsonFilename);
+        if (req !== null && req.status == 200) {
+            const jsonData = parseRecordsJson(req.response);
             const familyData = jsonData[familyId];
             if (familyData === undefined) {
                 console.log(`Family #${familyId} not found in ${jsonFilename}!`)
@@ -84,7 +242,7 @@ function loadRelativeData(familyLinks) {
 
 function processPersonData(personId, personDiv, response) {
     var personData = { 'personId': personId };
-    const jsonData = JSON.parse(response);
+    const jsonData = parseRecordsJson(response);
 
     if (!jsonData.hasOwnProperty(personId)) {
         personDiv.innerHTML = `<span>Missing person data for ${personId}</span>`;
@@ -95,7 +253,11 @@ function processPersonData(personId, personDiv, response) {
     personDiv.innerHTML = htmlPerson(personData);
 
     const factsUl = document.getElementById("person-facts");
-    readJsonFile(divJsonFilenameFromId("json/facts/facts", personId, factsJsonDivSize), function(text){
+    const factsFilename = shardFilenameFromId("facts", personId);
+    if (factsFilename === null) {
+        return;
+    }
+    readJsonFile(factsFilename, function(text){
         const facts = JSON.parse(text);
         const personFacts = facts[personId];
         console.log('Facts', facts[personId]);
@@ -127,8 +289,42 @@ function treeRelativesDim(personId, relativeData, familyType='ischild') {
 }
 
 
-function processFamilyLinks(personId, relativesDiv, response, htmlOnly=true) {
-    var familyLinks = JSON.parse(response);
+/**
+ * Load the family links of a person, either from their links shard (roles and family types are
+ * stored as indexes in the legend of the shard index) or from the single family links file.
+ * The callback receives family links keyed by person id (along with any metadata).
+ */
+function loadFamilyLinks(personId, callback) {
+    const linksFilename = shardFilenameFromId("links", personId);
+    const legend = window.shardIndex.linkLegend;
+    if (!legend) {
+        readJsonFile("json/family-links.json", function(response) {
+            callback(JSON.parse(response));
+        });
+        return;
+    }
+    if (linksFilename === null) {
+        callback({});
+        return;
+    }
+    readJsonFile(linksFilename, function(response) {
+        const jsonData = JSON.parse(response);
+        const familyLinks = {};
+        if (jsonData.hasOwnProperty("metadata")) {
+            familyLinks["metadata"] = jsonData["metadata"];
+        }
+        if (jsonData.hasOwnProperty(personId)) {
+            // only links from Gramps XML files include a family type
+            familyLinks[personId] = jsonData[personId].map(link => link.length > 2
+                ? [link[0], legend.roles[link[1]], legend.types[link[2]]]
+                : [link[0], legend.roles[link[1]]]);
+        }
+        callback(familyLinks);
+    });
+}
+
+
+function processFamilyLinks(personId, relativesDiv, familyLinks, htmlOnly=true) {
     // take metadata and show in footer
     if (familyLinks.hasOwnProperty("metadata")) {
         const metadata = familyLinks["metadata"];
@@ -177,25 +373,34 @@ function loadFamilyTree(personId) {
 
     document.title = `Family tree: ${personId}`;
 
-    personDiv.classList.add('loading');
-    readJsonFile(divJsonFilenameFromId("json/people/people", personId, personJsonDivSize), function(response) {
-        processPersonData(personId, personDiv, response);
-        personDiv.classList.remove('loading');
-        readJsonFile("json/antecedents.json", function(response) {
-            const jsonData = JSON.parse(response);
-            if (!(personId in jsonData)) { return; }
-            // add generation indicator to name
-            const nameEl = document.getElementById('full-name');
-            nameEl.innerHTML = nameEl.innerHTML.replace("]", `-g${jsonData[personId].join()}]`)
-        });
-    }, function(response) {
+    resetShardIndex();
+    const peopleFilename = shardFilenameFromId("people", personId);
+    if (peopleFilename === null) {
         personDiv.innerHTML = `Unknown person: ${personId}`;
-        personDiv.classList.remove('loading');
-    });
+    } else {
+        personDiv.classList.add('loading');
+        readJsonFile(peopleFilename, function(response) {
+            processPersonData(personId, personDiv, response);
+            personDiv.classList.remove('loading');
+            showRelationshipToFocusPerson(personId);
+            const antecedentsFilename = shardFilenameFromId("antecedents", personId);
+            if (antecedentsFilename === null) { return; }
+            readJsonFile(antecedentsFilename, function(response) {
+                const jsonData = JSON.parse(response);
+                if (!(personId in jsonData)) { return; }
+                // add generation indicator to name
+                const nameEl = document.getElementById('full-name');
+                nameEl.innerHTML = nameEl.innerHTML.replace("]", `-g${jsonData[personId].join()}]`)
+            });
+        }, function(response) {
+            personDiv.innerHTML = `Unknown person: ${personId}`;
+            personDiv.classList.remove('loading');
+        });
+    }
 
     relativesDiv.classList.add('loading');
-    readJsonFile("json/family-links.json", function(response) {
-        processFamilyLinks(personId, relativesDiv, response, !window.drawFamilyTree);
+    loadFamilyLinks(personId, function(familyLinks) {
+        processFamilyLinks(personId, relativesDiv, familyLinks, !window.drawFamilyTree);
         relativesDiv.classList.remove('loading');
     });
 }
@@ -208,15 +413,77 @@ function jumpToPerson(value) {
 }
 
 
-function loadQuickJump() {
-    readJsonFile("json/person-search.json", function(text){
-        var personSearch = JSON.parse(text);
+/**
+ * Normalise text into lowercase words without diacritics (e.g. "Zoë-Marie" -> ["zoe", "marie"]),
+ * in the same way as "search_index.py".
+ */
+function searchWords(text) {
+    return text.normalize("NFKD").replace(/\p{M}/gu, "").toLowerCase()
+        .split(/[^\p{L}\p{N}]+/u).filter(word => word.length > 0);
+}
+
+
+function searchFilename(prefix) {
+    const hex = Array.from(new TextEncoder().encode(prefix), byte => byte.toString(16).padStart(2, "0")).join("");
+    return `json/search/search-${hex}.json`;
+}
+
 
-        const select = document.getElementById('jump-to-person');
-        personSearch.forEach(person => {
-            select.add(new Option(person[1], person[0]));
+/**
+ * Search people by the start of the words in their names, passing the matching people (id and title,
+ * in order of rank) to the callback. Only the file of the longest prefix in the search index that matches
+ * the longest word in the query is fetched.
+ */
+function searchPeople(query, callback) {
+    const words = searchWords(query);
+    if (words.length == 0) {
+        callback([]);
+        return;
+    }
+    const longestWord = Array.from(words.reduce((word1, word2) => word2.length > word1.length ? word2 : word1));
+    const prefixes = window.searchIndex.prefixes;
+    var length = longestWord.length;
+    while (length > 0 && !prefixes.hasOwnProperty(longestWord.slice(0, length).join(""))) {
+        length--;
+    }
+    const prefix = longestWord.slice(0, length).join("");
+    // an incomplete prefix only lists people with words longer than the prefix that are ranked best
+    if (length == 0 || (length < longestWord.length && !prefixes[prefix])) {
+        callback([]);
+        return;
+    }
+    readJsonFile(searchFilename(prefix), function(text) {
+        const people = JSON.parse(text).filter(person => {
+            const titleWords = searchWords(person[1]);
+            return words.every(word => titleWords.some(titleWord => titleWord.startsWith(word)));
         });
+        callback(people);
+    }, function() {
+        callback([]);
+    });
+}
+
+
+function loadQuickJump() {
+    readJsonFile("json/search-index.json", function(text){
+        window.searchIndex = JSON.parse(text);
+
         new TomSelect("#jump-to-person", {
+            valueField: 'id',
+            labelField: 'title',
+            searchField: [],
+            // people have already been searched, so show all of them in order of rank
+            score: function() { return function() { return 1; }; },
+            sortField: 'rank',
+            shouldLoad: function(query) { return searchWords(query).length > 0; },
+            load: function(query, callback) {
+                // only keep the people found for the latest query, and always search again for other queries
+                this.clearOptions();
+                this.loadedSearches = {};
+                searchPeople(query, function(people) {
+                    callback(people.map((person, rank) => ({ id: person[0], title: person[1], rank: rank })));
+                });
+            },
             onChange: function(value){ 
                 jumpToPerson(value);
                 this.clear();
@@ -155,6 +155,39 @@ function htmlPersonFacts(personFacts) {
 }
 
 
+/**
+ * Describe how a person is related to someone, based on the number of generations from each of them
+ * to their nearest common ancestor (e.g. 1 and 2 for an aunt/uncle).
+ */
+function relationshipName(generations, otherGenerations) {
+    const greats = (count) => "great-".repeat(Math.max(count, 0));
+    const ordinal = (n) => n + (n % 10 == 1 && n % 100 != 11 ? "st" : n % 10 == 2 && n % 100 != 12 ? "nd"
+        : n % 10 == 3 && n % 100 != 13 ? "rd" : "th");
+    if (generations == 0 && otherGenerations == 0) {
+        return "self";
+    }
+    if (generations == 0) {
+        return otherGenerations == 1 ? "parent" : `${greats(otherGenerations - 2)}grandparent`;
+    }
+    if (otherGenerations == 0) {
+        return generations == 1 ? "child" : `${greats(generations - 2)}grandchild`;
+    }
+    if (generations == 1 && otherGenerations == 1) {
+        return "sibling";
+    }
+    if (generations == 1) {
+        return otherGenerations == 2 ? "aunt/uncle" : `${greats(otherGenerations - 3)}grand-aunt/uncle`;
+    }
+    if (otherGenerations == 1) {
+        return generations == 2 ? "niece/nephew" : `${greats(generations - 3)}grand-niece/nephew`;
+    }
+    const removed = Math.abs(generations - otherGenerations);
+    const removedName = removed == 0 ? "" : removed == 1 ? " once removed" : removed == 2 ? " twice removed"
+        : ` ${removed} times removed`;
+    return `${ordinal(Math.min(generations, otherGenerations) - 1)} cousin${removedName}`;
+}
+
+
 function htmlRelatives(personId, relativeData) {
     removeSelfFromMembers(personId, relativeData);
     console.log("Family tree data", relativeData);
@@ -0,0 +1,250 @@
+"""
+Report of where the time of a run goes: wall and CPU time of each stage of generating the JSON files, the number
+of records processed and bytes written per stage, the SQL statements run per query constant (for FTB databases)
+and the peak memory usage.
+
+Stages are measured with `stage()` (which does nothing unless a report has been started with `start_report()`),
+and a single stage can also be profiled with cProfile. Only the main process is measured, so work done by worker
+processes is only included in the time of the stage that waits for them. The SQL statements that workers run are
+reported by their own reports, which they hand back to the main process (see `pop_queries` and `merge_queries`).
+
+E.g.:
+
+    {"version": 1, "wallSeconds": 12.5, "cpuSeconds": 12.1, "peakRssBytes": 512000000,
+     "stages": {"people": {"calls": 1, "wallSeconds": 3.2, "cpuSeconds": 3.1, "rows": 30000,
+                           "rowsPerSecond": 9375.0, "bytesWritten": 6100000, "peakRssBytes": 310000000}, ...},
+     "queries": {"QRY_ALL_PERSON_DETAILS": {"count": 1, "seconds": 1.4, "rows": 30000}, ...}}
+"""
+import sys
+import json
+import time
+import cProfile
+import threading
+import contextlib
+import sqlite3 as sql
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None  # type: ignore
+
+
+REPORT_VERSION = 1
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Get the peak memory usage (resident set size) of this process so far."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, but bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class RunReport:
+
+    def __init__(self, queries: Optional[Dict[str, str]] = None, profile_stage: Optional[str] = None) -> None:
+        """Start a report of a run.
+
+        Parameters
+        ----------
+        queries
+            SQL queries keyed by the name of their constant, by which the statements that are run are reported.
+            Queries can contain an "{ids}" placeholder.
+        profile_stage
+            Name of a stage to profile with cProfile.
+        """
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.queries: Dict[str, Dict[str, Any]] = {}
+        self.current_stage: Optional[str] = None
+        # records and bytes are also added by threads that write files in the background
+        self.lock = threading.Lock()
+        self.profile_stage = profile_stage
+        self.profiler: Optional[cProfile.Profile] = None
+        self.query_constants = dict(queries or {})
+        self.query_names = {query: name for name, query in (queries or {}).items() if '{ids}' not in query}
+        self.query_templates = [(name, tuple(query.split('{ids}', 1))) for name, query in (queries or {}).items()
+            if '{ids}' in query]
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure a stage of the run (time spent in a stage that is entered multiple times is added up)."""
+        stage = self.stages.setdefault(name, {'calls': 0, 'wallSeconds': 0.0, 'cpuSeconds': 0.0, 'rows': 0,
+            'bytesWritten': 0})
+        previous_stage = self.current_stage
+        self.current_stage = name
+        if name == self.profile_stage:
+            self.profiler = self.profiler or cProfile.Profile()
+            self.profiler.enable()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stage['calls'] += 1
+            stage['wallSeconds'] += time.perf_counter() - start_wall
+            stage['cpuSeconds'] += time.process_time() - start_cpu
+            stage['peakRssBytes'] = peak_rss_bytes()
+            if name == self.profile_stage and self.profiler is not None:
+                self.profiler.disable()
+            self.current_stage = previous_stage
+
+    def add_rows(self, count: int) -> None:
+        """Add to the number of records (e.g. people or facts) processed by the current stage."""
+        with self.lock:
+            if self.current_stage is not None:
+                self.stages[self.current_stage]['rows'] += count
+
+    def add_bytes(self, count: int) -> None:
+        """Add to the number of bytes written by the current stage."""
+        with self.lock:
+            if self.current_stage is not None:
+                self.stages[self.current_stage]['bytesWritten'] += count
+
+    def query_name(self, statement: str) -> str:
+        """Get the name of the query constant of an SQL statement (or the statement itself if it's unknown)."""
+        name = self.query_names.get(statement)
+        if name is not None:
+            return name
+        for name, (prefix, suffix) in self.query_templates:
+            if statement.startswith(prefix) and statement.endswith(suffix):
+                return name
+        return ' '.join(statement.split())
+
+    def add_query(self, name: str, seconds: float, rows: int, statements: int = 0) -> None:
+        query = self.queries.setdefault(name, {'count': 0, 'seconds': 0.0, 'rows': 0})
+        query['count'] += statements
+        query['seconds'] += seconds
+        query['rows'] += rows
+
+    def merge_queries(self, queries: Dict[str, Dict[str, Any]]) -> None:
+        """Add the queries reported by another report (e.g. that of a worker process)."""
+        with self.lock:
+            for name, query in queries.items():
+                self.add_query(name, query['seconds'], query['rows'], query['count'])
+
+    def to_json(self) -> Dict[str, Any]:
+        stages = {}
+        for name, stage in self.stages.items():
+            rows_per_second = stage['rows'] / stage['wallSeconds'] if stage['wallSeconds'] > 0 else None
+            stages[name] = {**stage, 'rowsPerSecond': rows_per_second}
+        return {
+            'version': REPORT_VERSION,
+            'wallSeconds': time.perf_counter() - self.start_wall,
+            'cpuSeconds': time.process_time() - self.start_cpu,
+            'peakRssBytes': peak_rss_bytes(),
+            'stages': stages,
+            'queries': self.queries,
+        }
+
+    def save(self, filename: str) -> None:
+        with open(filename, 'w') as outfile:
+            json.dump(self.to_json(), outfile, indent=2)
+
+    def save_profile(self, filename: str) -> None:
+        """Save the cProfile stats of the profiled stage (which can be viewed with the pstats module)."""
+        if self.profiler is not None:
+            self.profiler.dump_stats(filename)
+
+    def summary(self) -> str:
+        """Get a table of the time spent in each stage."""
+        lines = [f"{'stage':<14} {'wall s':>8} {'cpu s':>8} {'rows':>9} {'rows/s':>10} {'MiB written':>11}"]
+        for name, stage in self.to_json()['stages'].items():
+            rows_per_second = '' if stage['rowsPerSecond'] is None else f"{stage['rowsPerSecond']:.0f}"
+            lines.append(f"{name:<14} {stage['wallSeconds']:>8.2f} {stage['cpuSeconds']:>8.2f} {stage['rows']:>9} "
+                f"{rows_per_second:>10} {stage['bytesWritten'] / 2**20:>11.1f}")
+        return '\n'.join(lines)
+
+
+# Report of the current run, if any
+_report: Optional[RunReport] = None
+
+
+def start_report(queries: Optional[Dict[str, str]] = None, profile_stage: Optional[str] = None) -> RunReport:
+    """Start reporting on the current run."""
+    global _report
+    _report = RunReport(queries, profile_stage)
+    return _report
+
+
+def get_report() -> Optional[RunReport]:
+    return _report
+
+
+def stage(name: str) -> 'contextlib.AbstractContextManager[None]':
+    """Measure a stage of the current run, if it's being reported on."""
+    if _report is None:
+        return contextlib.nullcontext()
+    return _report.stage(name)
+
+
+def add_rows(count: int) -> None:
+    if _report is not None:
+        _report.add_rows(count)
+
+
+def add_bytes(count: int) -> None:
+    if _report is not None:
+        _report.add_bytes(count)
+
+
+def pop_queries() -> Dict[str, Dict[str, Any]]:
+    """Get the queries reported so far by the current run and start counting them from zero again."""
+    if _report is None:
+        return {}
+    queries, _report.queries = _report.queries, {}
+    return queries
+
+
+def merge_queries(queries: Dict[str, Dict[str, Any]]) -> None:
+    if _report is not None:
+        _report.merge_queries(queries)
+
+
+class ReportingCursor(sql.Cursor):
+    """SQLite cursor that reports the time spent on and the rows returned by each query of the current run."""
+
+    query: Optional[str] = None
+
+    def _add(self, start: float, rows: int, statements: int = 0) -> None:
+        if _report is not None and self.query is not None:
+            _report.add_query(self.query, time.perf_counter() - start, rows, statements)
+
+    def execute(self, statement: str, parameters: Any = ()) -> 'ReportingCursor':
+        self.query = None if _report is None else _report.query_name(statement)
+        start = time.perf_counter()
+        super().execute(statement, parameters)
+        self._add(start, 0, 1)
+        return self
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(start, 0 if row is None else 1)
+        return row
+
+    def fetchall(self) -> List[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(start, len(rows))
+        return rows
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(start, 0)
+            raise
+        self._add(start, 1)
+        return row
+
+
+class ReportingConnection(sql.Connection):
+    """SQLite connection of which cursors report their queries, see `ReportingCursor`."""
+
+    def cursor(self, factory: Any = ReportingCursor) -> Any:
+        return super().cursor(factory)
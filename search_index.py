@@ -0,0 +1,99 @@
+"""
+Person search index split into files by name prefix, so that searching only requires the file for what was typed.
+
+Names are normalised into words (lowercase, without diacritics, e.g. "Zoë van der Merwe" -> ["zoe", "van", "der",
+"merwe"]) and every person is indexed under each word of their name. Starting with the first letter of words, the
+people under a prefix are stored in one file, unless that file would be larger than the size limit. In that case
+the prefix is split into longer prefixes (e.g. "m" into "ma", "me", ...), and the file of the prefix itself only
+contains people with the prefix as a complete word followed by the best ranked people under the prefix.
+
+People in each file are ranked by the word they're indexed under (shorter words first, then alphabetically), so
+for any longer prefix the people matching it are still in order of rank. The index lists every prefix, and
+whether its file contains all people under it. See `searchPeople()` in "public/main.js".
+"""
+import re
+import json
+import unicodedata
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+SEARCH_INDEX_VERSION = 1
+# Maximum size of a file of people under a prefix, unless it can't be split into longer prefixes
+SEARCH_SHARD_MAX_BYTES = 16 * 1024
+# Number of best ranked people stored in the file of a prefix that has been split into longer prefixes
+SEARCH_MAX_RESULTS = 50
+
+WORD_RE = re.compile(r"[^\W_]+")
+
+# A person indexed under a word: (word, person id, search title, size of the person's JSON in a file)
+SearchEntry = Tuple[str, Any, str, int]
+
+
+def search_words(text: str) -> List[str]:
+    """Normalise text into lowercase words without diacritics (e.g. "Zoë-Marie" -> ["zoe", "marie"])."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    without_marks = ''.join(char for char in decomposed if not unicodedata.category(char).startswith('M'))
+    return WORD_RE.findall(without_marks.lower())
+
+
+def search_filename(prefix: str) -> str:
+    """Get filename of the people under a prefix (hex-encoded to be safe to use in URLs and on any file system)."""
+    return f'search-{prefix.encode("utf-8").hex()}.json'
+
+
+def _unique_people(entries: List[SearchEntry]) -> List[List[Any]]:
+    """Get the id and title of the people of entries, with people only listed at their best rank."""
+    people: Dict[Any, str] = {}
+    for _, person_id, title, _ in entries:
+        people.setdefault(person_id, title)
+    return [[person_id, title] for person_id, title in people.items()]
+
+
+def _split_prefix(
+        prefix: str, entries: List[SearchEntry], max_bytes: int, max_results: int
+    ) -> Iterator[Tuple[str, bool, List[List[Any]]]]:
+    if sum(entry[3] for entry in entries) <= max_bytes:
+        yield prefix, True, _unique_people(entries)
+        return
+    longer: Dict[str, List[SearchEntry]] = {}
+    exact_count = 0
+    for entry in entries:
+        if len(entry[0]) == len(prefix):
+            exact_count += 1
+        else:
+            longer.setdefault(entry[0][:len(prefix) + 1], []).append(entry)
+    if len(longer) == 0:
+        yield prefix, True, _unique_people(entries)
+        return
+    # complete words rank first, so they're followed by the best ranked longer words
+    yield prefix, False, _unique_people(entries)[:exact_count + max_results]
+    for longer_prefix in sorted(longer):
+        yield from _split_prefix(longer_prefix, longer[longer_prefix], max_bytes, max_results)
+
+
+def build_search_index(
+        person_titles: Dict[Any, str], max_bytes: int = SEARCH_SHARD_MAX_BYTES, max_results: int = SEARCH_MAX_RESULTS
+    ) -> Tuple[Dict[str, Any], Dict[str, List[List[Any]]]]:
+    """Build the search index of people by the words of their search titles.
+
+    Returns
+    -------
+    A tuple containing the index of prefixes and the people (id and title) in the file of each prefix, keyed by
+    filename.
+    """
+    entries: List[SearchEntry] = []
+    for person_id, title in person_titles.items():
+        size = len(json.dumps([person_id, title])) + 2
+        entries.extend((word, person_id, title, size) for word in set(search_words(title)))
+    entries.sort(key=lambda entry: (len(entry[0]), entry[0], entry[2], str(entry[1])))
+    by_letter: Dict[str, List[SearchEntry]] = {}
+    for entry in entries:
+        by_letter.setdefault(entry[0][0], []).append(entry)
+
+    prefixes: Dict[str, bool] = {}
+    files: Dict[str, List[List[Any]]] = {}
+    for letter in sorted(by_letter):
+        for prefix, complete, people in _split_prefix(letter, by_letter[letter], max_bytes, max_results):
+            prefixes[prefix] = complete
+            files[search_filename(prefix)] = people
+    return {'version': SEARCH_INDEX_VERSION, 'prefixes': prefixes}, files
@@ -0,0 +1,216 @@
+"""
+Web server for the website and its generated JSON files, for testing and for small deployments.
+
+Compared to `python -m http.server` it:
+- serves the precompressed copies of files (e.g. "people-1-610.json.br" or ".gz", see `extract.py --compress`) to
+  browsers that accept them;
+- sends a strong ETag (a hash of the content that is sent) with every file, and answers conditional requests for
+  unchanged files with "304 Not Modified";
+- lets browsers cache files requested with the version of their content (e.g. "people-1-610.json?v=3f2a...", as
+  listed in "shard-index.json") without ever revalidating them, while other files are always revalidated;
+- sends files with `socket.sendfile()`, which copies them from the page cache to the socket without reading them
+  into Python (where the operating system supports it).
+"""
+import os
+import hashlib
+import functools
+import threading
+import email.utils
+import urllib.parse
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import json_serializer
+
+
+# Content encodings of precompressed copies of files in order of preference, with their file extensions
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+# Cache-Control of files requested with the current version of their content
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Cache-Control of other files, which browsers may cache but must revalidate (with their ETag) before using
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+MANIFEST_FILENAME = 'manifest.json'
+# Number of hex digits of the content hash of a file in its version (as in `extract.SHARD_VERSION_DIGITS`)
+SHARD_VERSION_DIGITS = 16
+
+# Size and modification time of a file
+FileStamp = Tuple[int, int]
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """Get the content encodings accepted according to an Accept-Encoding header (e.g. "gzip, br;q=0.8")."""
+    encodings = []
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() != '' and quality > 0:
+            encodings.append(name.strip().lower())
+    return encodings
+
+
+class SiteRequestHandler(SimpleHTTPRequestHandler):
+
+    # keeps connections open for the many JSON files that a page view requests
+    protocol_version = 'HTTP/1.1'
+    # ETags of files keyed by path, along with the stamp of the file they were calculated for
+    etags: Dict[str, Tuple[FileStamp, str]] = {}
+    # File hashes listed in manifests keyed by the path of the manifest, along with the stamp of the manifest
+    manifests: Dict[str, Tuple[FileStamp, Dict[str, str]]] = {}
+    lock = threading.Lock()
+
+    def choose_file(self, path: str) -> Tuple[str, Optional[str]]:
+        """Choose the file to send for a path: a precompressed copy if the client accepts it, or the file itself.
+
+        Returns
+        -------
+        A tuple containing the path of the file to send and its content encoding (None if it's not compressed).
+        """
+        encodings = accepted_encodings(self.headers.get('Accept-Encoding', ''))
+        mtime = os.stat(path).st_mtime_ns
+        for encoding, extension in PRECOMPRESSED_ENCODINGS:
+            # copies older than the file itself are left over from before it changed
+            if (encoding in encodings or '*' in encodings) and os.path.isfile(path + extension) and \
+                    os.stat(path + extension).st_mtime_ns >= mtime:
+                return path + extension, encoding
+        return path, None
+
+    def etag(self, path: str, stamp: FileStamp) -> str:
+        """Get the strong ETag of a file, which is only recalculated if its size or modification time changed."""
+        with self.lock:
+            cached = self.etags.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(1024 * 1024), b''):
+                digest.update(block)
+        etag = f'"{digest.hexdigest()[:32]}"'
+        with self.lock:
+            self.etags[path] = (stamp, etag)
+        return etag
+
+    def manifest_hash(self, path: str) -> Optional[str]:
+        """Get the content hash of a file from the manifest of the directory it was generated into (if any)."""
+        root = os.path.realpath(self.directory)
+        directory = os.path.dirname(os.path.realpath(path))
+        while directory == root or directory.startswith(root + os.sep):
+            manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+            if os.path.isfile(manifest_path):
+                stat = os.stat(manifest_path)
+                stamp = (stat.st_size, stat.st_mtime_ns)
+                with self.lock:
+                    cached = self.manifests.get(manifest_path)
+                if cached is None or cached[0] != stamp:
+                    with open(manifest_path, 'rb') as infile:
+                        manifest = json_serializer.loads(infile.read())
+                    cached = (stamp, {filename: entry['hash'] for filename, entry in manifest.get('files', {}).items()})
+                    with self.lock:
+                        self.manifests[manifest_path] = cached
+                relative_path = os.path.relpath(os.path.realpath(path), directory).replace(os.sep, '/')
+                return cached[1].get(relative_path)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+        return None
+
+    def cache_control(self, path: str) -> str:
+        """Let files be cached without revalidation if they're requested with the current version of their content."""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        versions = query.get('v', [])
+        if len(versions) == 1 and len(versions[0]) == SHARD_VERSION_DIGITS:
+            content_hash = self.manifest_hash(path)
+            if content_hash is not None and content_hash[:SHARD_VERSION_DIGITS] == versions[0]:
+                return IMMUTABLE_CACHE_CONTROL
+        return REVALIDATE_CACHE_CONTROL
+
+    def is_not_modified(self, etag: str, mtime: float) -> bool:
+        """Check whether the client's copy is current according to the conditional headers of the request."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # weak comparison, as specified for If-None-Match
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return since is not None and since.tzinfo is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def send_head(self) -> Any:
+        """Send the headers of the response to a GET or HEAD request, and return the file to send (if any)."""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urllib.parse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                # redirect to the path with a slash, with an empty body so that the connection can be kept open
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header('Location', urllib.parse.urlunsplit(parts._replace(path=parts.path + '/')))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            index_path = os.path.join(path, 'index.html')
+            if not os.path.isfile(index_path):
+                # directory listing
+                return super().send_head()
+            path = index_path
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+
+        send_path, encoding = self.choose_file(path)
+        try:
+            outfile: BinaryIO = open(send_path, 'rb')
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+        try:
+            stat = os.fstat(outfile.fileno())
+            etag = self.etag(send_path, (stat.st_size, stat.st_mtime_ns))
+            not_modified = self.is_not_modified(etag, stat.st_mtime)
+            self.send_response(HTTPStatus.NOT_MODIFIED if not_modified else HTTPStatus.OK)
+            if not not_modified:
+                self.send_header('Content-Type', self.guess_type(path))
+                self.send_header('Content-Length', str(stat.st_size))
+                if encoding is not None:
+                    self.send_header('Content-Encoding', encoding)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', self.date_time_string(int(stat.st_mtime)))
+            self.send_header('Cache-Control', self.cache_control(path))
+            if any(os.path.isfile(path + extension) for _, extension in PRECOMPRESSED_ENCODINGS):
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+        except BaseException:
+            outfile.close()
+            raise
+        if not_modified:
+            outfile.close()
+            return None
+        return outfile
+
+    def copyfile(self, source: Any, outputfile: Any) -> None:
+        """Send a file with `socket.sendfile()` (which falls back to reading and sending it if needed)."""
+        # the headers are buffered
+        outputfile.flush()
+        self.connection.sendfile(source)
+
+
+def serve(directory: str, host: str, port: int) -> None:
+    """Serve the files in a directory until interrupted."""
+    with ThreadingHTTPServer((host, port), functools.partial(SiteRequestHandler, directory=directory)) as server:
+        print(f'Serving {directory} at http://{host}:{server.server_address[1]}/ (press Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('\nStopped serving')
@@ -0,0 +1,47 @@
+import contextlib
+import os
+import sqlite3 as sql
+import tempfile
+import unittest
+
+import benchmark
+import extract
+
+
+class IncrementalFTBTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+        self.source = os.path.join(self.work_dir.name, 'tree.ftb')
+        benchmark.write_ftb_db(self.source, benchmark.generate_tree(300))
+
+    def generate(self, output_dir: str, incremental: bool) -> None:
+        db = extract.open_ftb_db(self.source)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            extract.generate_json(db, output_dir, 'tree.ftb', benchmark.ftb_person_id(0), incremental=incremental,
+                shard_max_bytes=4_000)
+        db.close()
+
+    def test_renamed_place(self) -> None:
+        incremental_dir = os.path.join(self.work_dir.name, 'incremental')
+        self.generate(incremental_dir, incremental=True)
+        before = benchmark.output_digests(incremental_dir)
+
+        conn = sql.connect(self.source)
+        place_id, = conn.execute('SELECT place_id FROM individual_fact_main_data '
+            'WHERE place_id IS NOT NULL AND delete_flag = 0 LIMIT 1').fetchone()
+        conn.execute("UPDATE places_lang_data SET place = place || ' (renamed)' WHERE place_id = ?", [place_id])
+        conn.commit()
+        conn.close()
+
+        self.generate(incremental_dir, incremental=True)
+        full_dir = os.path.join(self.work_dir.name, 'full')
+        self.generate(full_dir, incremental=False)
+        after = benchmark.output_digests(full_dir)
+        self.assertNotEqual(before['facts'], after['facts'])
+        self.assertEqual(benchmark.output_digests(incremental_dir), after)
+
+
+if __name__ == '__main__':
+    unittest.main()